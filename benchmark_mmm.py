@@ -0,0 +1,71 @@
+import sys
+import tempfile
+from pathlib import Path
+
+import pydantic_argparse
+
+from source import logging
+from source.benchmark.benchmarkconfig import BenchmarkConfig
+from source.benchmark.syntheticcorpus import generate_corpus
+from source.benchmark.stages import (
+    run_benchmark,
+    compare_results,
+    save_results,
+    load_results,
+)
+
+logger = logging.create_logger("benchmark")
+
+
+def main() -> None:
+    # Create Parser and Parse Args
+    parser = pydantic_argparse.ArgumentParser(
+        model=BenchmarkConfig,
+        prog="MMM Tokenizer LMD Clean - Benchmark",
+        description="This program times every stage of the tokenization pipeline",
+        version="0.0.1",
+    )
+    benchmark_config = parser.parse_typed_args()
+
+    with tempfile.TemporaryDirectory() as corpus_path:
+        if benchmark_config.midi_source is not None:
+            midi_paths = sorted(Path(benchmark_config.midi_source).glob("**/*.mid"))
+            corpus = {"midi_source": str(benchmark_config.midi_source)}
+        else:
+            corpus = {
+                "num_files": benchmark_config.num_files,
+                "num_tracks": benchmark_config.num_tracks,
+                "num_bars": benchmark_config.num_bars,
+                "notes_per_bar": benchmark_config.notes_per_bar,
+                "seed": benchmark_config.seed,
+            }
+            midi_paths = generate_corpus(corpus_path, **corpus)
+        logger.info(f"Benchmarking {len(midi_paths)} files")
+
+        results = run_benchmark(
+            midi_paths,
+            repeats=benchmark_config.repeats,
+            corpus=corpus,
+            startup_workers=benchmark_config.startup_workers,
+            latency_repeats=benchmark_config.latency_repeats,
+            transfer_repeats=benchmark_config.transfer_repeats,
+        )
+
+    save_results(results, benchmark_config.save_path)
+    logger.info(f"Saved results to {benchmark_config.save_path}")
+
+    if benchmark_config.baseline is not None:
+        regressions = compare_results(
+            load_results(benchmark_config.baseline),
+            results,
+            tolerance=benchmark_config.tolerance,
+        )
+        for regression in regressions:
+            logger.warning(f"Regression in {regression}")
+        if regressions:
+            sys.exit(1)
+        logger.info("No regressions")
+
+
+if __name__ == "__main__":
+    main()
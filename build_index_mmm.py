@@ -0,0 +1,47 @@
+from pathlib import Path
+
+import pydantic_argparse
+
+from source import logging
+from source.datasetcreatorconfig import BuildIndexConfig
+from source.preprocess.loading.corpusindex import CorpusIndex, build_index
+from source.preprocess.loading.serialization import Music21Serializer
+
+logger = logging.create_logger("index")
+
+
+def main() -> None:
+    # Create Parser and Parse Args
+    parser = pydantic_argparse.ArgumentParser(
+        model=BuildIndexConfig,
+        prog="MMM Tokenizer LMD Clean - Index",
+        description="This program records the properties of every MIDI file",
+        version="0.0.1",
+    )
+    index_config = parser.parse_typed_args()
+
+    midi_paths = sorted(
+        list(Path(index_config.midi_source).glob("**/*.mid"))
+        + list(Path(index_config.midi_source).glob("**/*.midi"))
+    )
+    logger.info(f"There are {len(midi_paths)} midi files in the directory")
+
+    max_memory = None
+    if index_config.max_file_memory_mb is not None:
+        max_memory = index_config.max_file_memory_mb * 1024 * 1024
+
+    index = CorpusIndex(index_config.index_path)
+    counts = build_index(
+        index,
+        midi_paths,
+        Music21Serializer(),
+        parse=index_config.parse,
+        timeout=index_config.file_timeout,
+        max_memory=max_memory,
+    )
+    logger.info(f"Index has {len(index)} files: {counts}")
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
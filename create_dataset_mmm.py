@@ -16,6 +16,7 @@
 # Lint as: python3
 
 import os
+import json
 from pathlib import Path
 
 import pydantic_argparse
@@ -23,8 +24,16 @@ import pydantic_argparse
 from source.datasetcreatorconfig import LMDCleanDatasetCreatorBarConfig
 from source import datasetcreator
 from source import logging
+from source.metrics import PipelineMetrics
+from source.preprocess.dedup import Deduplicator
+from source.preprocess.sharedstate import warm_up
+from source.preprocess.loading.quarantine import Quarantine
+from source.preprocess.loading.corpusindex import CorpusIndex
+from source.preprocess.loading.archive import ArchiveReader, is_archive
 from source.preprocess.loading.loaderiterator import LoaderIterator
-from source.preprocess.loading.serialization import Music21Serializer
+from source.preprocess.loading.serialization import Music21Serializer, get_song_id
+from source.preprocess.loading.sharding import get_shard_name, select_shard
+from source.preprocess.loading.scheduling import order_longest_first
 
 
 logger = logging.create_logger("main")
@@ -45,32 +54,138 @@ def main() -> None:
     dataset_creator_config = parser.parse_typed_args()
 
     # Print Args
-    logger.info("Creating DatasetCreator")
-    dataset_creator = datasetcreator.DatasetCreator(dataset_creator_config)
+    metrics = PipelineMetrics(
+        profile_file_index=dataset_creator_config.profile_file_index
+    )
 
     # Get songs from folder and iterate in batches
     logger.info("Creating list of path files...")
-    midi_paths = sorted(
-        list(Path(dataset_creator_config.midi_source).glob("**/*.mid"))
-        + list(Path(dataset_creator_config.midi_source).glob("**/*.midi"))
-    )
+    archive_reader = None
+    if is_archive(dataset_creator_config.midi_source):
+        # Members are streamed out of the archive, without extracting it
+        archive_reader = ArchiveReader(dataset_creator_config.midi_source)
+        midi_paths = archive_reader.member_paths
+    else:
+        midi_paths = sorted(
+            list(Path(dataset_creator_config.midi_source).glob("**/*.mid"))
+            + list(Path(dataset_creator_config.midi_source).glob("**/*.midi"))
+        )
     logger.info(f"There are {len(midi_paths)} midi files in the directory")
+    parse_seconds = None
+    if dataset_creator_config.index_path is not None:
+        # Files outside the selection are never parsed
+        index = CorpusIndex(dataset_creator_config.index_path)
+        selected = set(
+            index.select(
+                genres=dataset_creator_config.genres,
+                time_signature=dataset_creator_config.time_signature,
+                max_tracks=dataset_creator_config.max_tracks,
+            )
+        )
+        parse_seconds = index.get_parse_seconds()
+        index.close()
+        midi_paths = [
+            midi_path for midi_path in midi_paths if get_song_id(midi_path) in selected
+        ]
+        logger.info(f"The index selects {len(midi_paths)} midi files")
+    if dataset_creator_config.num_shards > 1:
+        midi_paths = select_shard(
+            midi_paths,
+            Path(dataset_creator_config.midi_source),
+            dataset_creator_config.num_shards,
+            dataset_creator_config.shard_index,
+        )
+        logger.info(
+            f"Shard {dataset_creator_config.shard_index} has {len(midi_paths)} midi files"
+        )
+    if dataset_creator_config.longest_first:
+        if archive_reader is None:
+            midi_paths = order_longest_first(midi_paths, parse_seconds)
+        elif archive_reader.random_access:
+            midi_paths = order_longest_first(
+                midi_paths, parse_seconds, archive_reader.get_sizes()
+            )
+        else:
+            # Reading a compressed tar out of order decompresses it again
+            logger.warning("Tar archives are read in archive order, not longest first")
     batch_size = dataset_creator_config.num_files_per_iteration
 
+    dataset_path = (
+        dataset_creator_config.save_path / dataset_creator_config.dataset_name
+    )
+    if dataset_creator_config.num_shards > 1:
+        dataset_path = dataset_path / get_shard_name(
+            dataset_creator_config.shard_index, dataset_creator_config.num_shards
+        )
+
+    # Skip the files that earlier runs rejected
+    quarantine = None
+    if dataset_creator_config.use_quarantine:
+        # Imports music21, so it is only done after the arguments are parsed
+        from source.preprocess.music21lmd import PREPROCESSOR_VERSION
+
+        quarantine = Quarantine(
+            dataset_creator_config.quarantine_path or dataset_path / "quarantine.json",
+            PREPROCESSOR_VERSION,
+            dataset_creator_config.file_timeout,
+            dataset_creator_config.max_file_memory,
+        )
+        metrics.skip_callbacks.append(quarantine.add)
+        logger.info(f"Quarantined files: {quarantine.summary()}")
+
+    # Skip files with the same content as a file seen before
+    deduplicator = None
+    if dataset_creator_config.deduplicate:
+        deduplicator = Deduplicator(dataset_path / "duplicates.json")
+
+    # Built before any worker is forked, so workers share it instead of building it
+    warm_up(
+        density_bins_number=dataset_creator_config.density_bins_number,
+        ticks_per_quarter=dataset_creator_config.ticks_per_quarter,
+    )
+
+    logger.info("Creating DatasetCreator")
+    dataset_creator = datasetcreator.DatasetCreator(
+        dataset_creator_config, metrics, deduplicator
+    )
+
     logger.info("Creating loader iterator...")
-    loader_iterator = LoaderIterator(Music21Serializer(), batch_size, midi_paths)
+    loader_iterator = LoaderIterator(
+        Music21Serializer(),
+        batch_size,
+        midi_paths,
+        metrics=metrics,
+        file_timeout=dataset_creator_config.file_timeout,
+        max_file_memory=dataset_creator_config.max_file_memory,
+        quarantine=quarantine,
+        prescan=dataset_creator_config.prescan,
+        num_workers=dataset_creator_config.num_workers,
+        max_batch_memory=dataset_creator_config.max_batch_memory,
+        prefetch_files=dataset_creator_config.prefetch_files,
+        archive_reader=archive_reader,
+        deduplicator=deduplicator,
+        # Songs are preprocessed in the workers, which send back song data
+        preprocess=dataset_creator.get_loader_preprocess(),
+    )
     logger.info(f"Loader iterator ready.")
 
     # Try to recover last iteration from a file
-    iteration_file = (
-        dataset_creator_config.save_path
-        / dataset_creator_config.dataset_name
-        / "last_iteration.txt"
+    iteration_file = dataset_path / "last_iteration.txt"
+    metrics_file = dataset_path / "metrics.json"
+    # Records of single files, appended after every batch
+    metrics_files_file = dataset_path / "metrics_files.jsonl"
+    profile_file = (
+        dataset_path / f"profile_{dataset_creator_config.profile_file_index}.prof"
     )
     if os.path.exists(iteration_file):
         with open(iteration_file, "r") as f:
-            last_iteration = int(f.read().strip())
-            loader_iterator.set_current_iteration(last_iteration)
+            lines = f.read().splitlines()
+        # Runs with a memory budget also write the first file of the iteration
+        values = [int(value) for value in lines[0].split()]
+        loader_iterator.set_current_iteration(*values)
+        # The rows of the Parquet files written so far
+        if len(lines) > 1:
+            dataset_creator.set_state(json.loads(lines[1]))
 
     # Iterate over the batches
     logger.info(f"Loading songs")
@@ -82,11 +197,28 @@ def main() -> None:
             m21_streams=batch_data,
             current_iteration=loader_iterator._current_iteration,
             overwrite=True,
+            preprocessed=loader_iterator.preprocess is not None,
         )
 
         # Keep some how the information in long-term storage so if the computer breaks, we can resume the processing
         # Write current iteration to a file
-        loader_iterator.write_current_iteration(iteration_file)
+        loader_iterator.write_current_iteration(
+            iteration_file, dataset_creator.get_state()
+        )
+        metrics.dump(metrics_file, profile_file, metrics_files_file)
+        if quarantine is not None:
+            quarantine.save()
+        if deduplicator is not None:
+            deduplicator.save(metrics)
+            logger.info(f"Duplicates: {deduplicator.summary(metrics)}")
+        summary = metrics.summary()
+        logger.info(
+            f"{summary['files_per_second']:.2f} files/s, "
+            f"{summary['tokens_per_second']:.0f} tokens/s"
+        )
+    dataset_creator.close(dataset_creator_config.save_path)
+    if archive_reader is not None:
+        archive_reader.close()
 
 
 if __name__ == "__main__":
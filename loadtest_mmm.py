@@ -0,0 +1,48 @@
+import tempfile
+from pathlib import Path
+
+import pydantic_argparse
+
+from source import logging
+from source.benchmark.benchmarkconfig import LoadTestConfig
+from source.benchmark.syntheticcorpus import generate_corpus
+from source.benchmark.loadtest import run_load_test
+from source.benchmark.stages import save_results
+
+logger = logging.create_logger("loadtest")
+
+
+def main() -> None:
+    # Create Parser and Parse Args
+    parser = pydantic_argparse.ArgumentParser(
+        model=LoadTestConfig,
+        prog="MMM Tokenizer LMD Clean - Load Test",
+        description="This program measures the throughput and latency of serve_mmm.py",
+        version="0.0.1",
+    )
+    load_test_config = parser.parse_typed_args()
+
+    with tempfile.TemporaryDirectory() as corpus_path:
+        if load_test_config.midi_source is not None:
+            midi_paths = sorted(Path(load_test_config.midi_source).glob("**/*.mid"))
+        else:
+            midi_paths = generate_corpus(
+                corpus_path, num_files=load_test_config.num_files
+            )
+        files_data = [midi_path.read_bytes() for midi_path in midi_paths]
+    logger.info(
+        f"Sending {load_test_config.num_requests} requests to {load_test_config.url}"
+    )
+
+    results = run_load_test(
+        load_test_config.url,
+        files_data,
+        num_requests=load_test_config.num_requests,
+        concurrency=load_test_config.concurrency,
+    )
+    save_results(results, load_test_config.save_path)
+    logger.info(f"Results: {results}")
+
+
+if __name__ == "__main__":
+    main()
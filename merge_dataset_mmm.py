@@ -0,0 +1,30 @@
+import pydantic_argparse
+
+from source.datasetcreatorconfig import MergeShardsConfig
+from source.datasetmerger import merge_shards
+from source import logging
+
+logger = logging.create_logger("merge")
+
+
+def main() -> None:
+    # Create Parser and Parse Args
+    parser = pydantic_argparse.ArgumentParser(
+        model=MergeShardsConfig,
+        prog="MMM Tokenizer LMD Clean - Merge",
+        description="This program merges the shards written by create_dataset_mmm.py",
+        version="0.0.1",
+    )
+    merge_config = parser.parse_typed_args()
+
+    summary = merge_shards(
+        merge_config.dataset_path,
+        reconcile_density=merge_config.reconcile_density,
+        pack_context_length=merge_config.pack_context_length,
+        separator_token=merge_config.separator_token,
+    )
+    logger.info(f"Merged dataset: {summary}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+from pathlib import Path
+from typing import Optional
+
+import pydantic_argparse
+
+from source import logging
+from source.datasetcreatorconfig import RecheckQuarantineConfig
+from source.preprocess.loading.archive import ArchiveReader
+from source.preprocess.loading.isolation import IsolatedTaskError, run_isolated
+from source.preprocess.loading.quarantine import Quarantine, recheck_quarantine
+from source.preprocess.loading.serialization import Music21Serializer
+
+logger = logging.create_logger("recheck")
+
+
+def load_and_preprocess(
+    serializer: Music21Serializer, data: bytes, load_path: Path
+) -> bool:
+    from source.preprocess.music21lmd import preprocess_music21_song
+
+    m21_stream = serializer.load_bytes(data, load_path)
+    return preprocess_music21_song(m21_stream, train=True) is not None
+
+
+def main() -> None:
+    # Create Parser and Parse Args
+    parser = pydantic_argparse.ArgumentParser(
+        model=RecheckQuarantineConfig,
+        prog="MMM Tokenizer LMD Clean - Recheck quarantine",
+        description="This program processes quarantined files again",
+        version="0.0.1",
+    )
+    recheck_config = parser.parse_typed_args()
+
+    # Imports music21, so it is only done after the arguments are parsed
+    from source.preprocess.music21lmd import MULTIPLE_METERS, PREPROCESSOR_VERSION
+
+    max_memory = None
+    if recheck_config.max_file_memory_mb is not None:
+        max_memory = recheck_config.max_file_memory_mb * 1024 * 1024
+    quarantine = Quarantine(
+        recheck_config.quarantine_path,
+        PREPROCESSOR_VERSION,
+        recheck_config.file_timeout,
+        max_memory,
+    )
+    if recheck_config.recheck_all:
+        song_ids = list(quarantine.entries)
+    else:
+        song_ids = quarantine.get_stale_song_ids()
+    logger.info(f"Re-checking {len(song_ids)} of {len(quarantine.entries)} files")
+
+    serializer = Music21Serializer()
+
+    def check_file(load_path: Path, data: bytes) -> Optional[str]:
+        try:
+            accepted = run_isolated(
+                load_and_preprocess,
+                (serializer, data, load_path),
+                timeout=recheck_config.file_timeout,
+                max_memory=max_memory,
+            )
+        except IsolatedTaskError as e:
+            return e.reason
+        return None if accepted else MULTIPLE_METERS
+
+    archive_reader = None
+    if recheck_config.midi_source is not None:
+        archive_reader = ArchiveReader(recheck_config.midi_source)
+    counts = recheck_quarantine(quarantine, check_file, song_ids, archive_reader)
+    if archive_reader is not None:
+        archive_reader.close()
+    logger.info(f"Re-checked quarantine: {counts}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import pydantic_argparse
+
+from source.datasetcreatorconfig import ServeConfig
+from source import logging
+
+logger = logging.create_logger("serve")
+
+
+def main() -> None:
+    # Create Parser and Parse Args
+    parser = pydantic_argparse.ArgumentParser(
+        model=ServeConfig,
+        prog="MMM Tokenizer LMD Clean - Serve",
+        description="This program tokenizes MIDI files sent over HTTP",
+        version="0.0.1",
+    )
+    serve_config = parser.parse_typed_args()
+
+    # Local import so --help does not load the tokenizer
+    from source.tokenizationserver import TokenizationService, create_server
+
+    service = TokenizationService(
+        num_workers=serve_config.num_workers,
+        max_batch_size=serve_config.max_batch_size,
+        max_batch_wait=serve_config.max_batch_wait_ms / 1000,
+        cache_size=serve_config.cache_size,
+        density_bins_path=serve_config.density_bins_path,
+    )
+    server = create_server(service, serve_config.host, serve_config.port)
+    logger.info(f"Serving on http://{serve_config.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        logger.info(f"Stopped. {service.stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+from pathlib import Path
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+
+class BenchmarkConfig(BaseModel):
+    """
+    A configuration class for the stage benchmark.
+
+    Attributes:
+        save_path: JSON file where the results are written.
+        midi_source: Optional folder with MIDI files. A synthetic corpus is used if missing.
+        num_files: Number of synthetic files.
+        num_tracks: Number of tracks of every synthetic file.
+        num_bars: Number of bars of every synthetic file.
+        notes_per_bar: Number of notes per bar and track of every synthetic file.
+        seed: Seed of the synthetic corpus.
+        repeats: Number of times every stage is timed. The best time is kept.
+        baseline: Optional JSON file with the results of a previous run.
+        tolerance: Slowdown over the baseline reported as a regression.
+        startup_workers: Number of workers started with fork and with spawn to time their startup.
+        latency_repeats: Number of times every file is tokenized alone to time the p50 and p99 latency.
+        transfer_repeats: Number of times the songs are sent to a worker and encoded, with pickle and with shared memory.
+    """
+
+    save_path: Path = Field(description="JSON file where the results are written")
+    midi_source: Optional[Path] = Field(
+        None, description="Folder with MIDI files. Default: synthetic corpus"
+    )
+    num_files: int = Field(10, description="Number of synthetic files")
+    num_tracks: int = Field(4, description="Tracks per synthetic file")
+    num_bars: int = Field(8, description="Bars per synthetic file")
+    notes_per_bar: int = Field(8, description="Notes per bar and track")
+    seed: int = Field(0, description="Seed of the synthetic corpus")
+    repeats: int = Field(3, description="Repeats per stage. The best is kept")
+    baseline: Optional[Path] = Field(
+        None, description="Results of a previous run to compare with"
+    )
+    tolerance: float = Field(
+        0.1, description="Slowdown over the baseline reported as a regression"
+    )
+    startup_workers: int = Field(
+        2, description="Workers started to time their startup. 0 skips it"
+    )
+    latency_repeats: int = Field(
+        3, description="Times every file is tokenized alone for latency. 0 skips it"
+    )
+    transfer_repeats: int = Field(
+        3, description="Times the songs are sent to a worker and encoded. 0 skips it"
+    )
+
+
+class LoadTestConfig(BaseModel):
+    """
+    A configuration class for the load test of the tokenization server.
+
+    Attributes:
+        save_path: JSON file where the results are written.
+        url: The address of a running server, started with serve_mmm.py.
+        midi_source: Optional folder with MIDI files. A synthetic corpus is used if missing.
+        num_files: Number of synthetic files.
+        num_requests: Number of requests sent.
+        concurrency: Number of clients sending requests at once.
+    """
+
+    save_path: Path = Field(description="JSON file where the results are written")
+    url: str = Field("http://127.0.0.1:8765", description="Address of the server")
+    midi_source: Optional[Path] = Field(
+        None, description="Folder with MIDI files. Default: synthetic corpus"
+    )
+    num_files: int = Field(10, description="Number of synthetic files")
+    num_requests: int = Field(100, description="Number of requests sent")
+    concurrency: int = Field(8, description="Clients sending requests at once")
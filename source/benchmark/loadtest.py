@@ -0,0 +1,84 @@
+import json
+import time
+import base64
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from source.benchmark.stages import get_percentile
+
+
+def post_tokenize(url: str, data: bytes, settings: Optional[Dict] = None) -> Dict:
+    """
+    Sends a MIDI file to the tokenization server.
+
+    Args:
+        url: The address of the server, e.g. http://127.0.0.1:8765.
+        data: The bytes of the MIDI file.
+        settings: Optional encoding settings, see TokenizationSettings.
+
+    Returns:
+        The answer of the server, with "tokens" or "error".
+    """
+    body = {"midi": base64.b64encode(data).decode("ascii")}
+    if settings is not None:
+        body["settings"] = settings
+    request = urllib.request.Request(
+        f"{url}/tokenize",
+        data=json.dumps(body).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+    try:
+        with urllib.request.urlopen(request) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        return json.load(e)
+
+
+def run_load_test(
+    url: str,
+    files_data: List[bytes],
+    num_requests: int = 100,
+    concurrency: int = 8,
+    settings: Optional[Dict] = None,
+) -> Dict:
+    """
+    Sends the files to the server from concurrent clients and times the answers.
+
+    The files are sent in turn, so with more requests than files the later
+    ones are answered from the cache of the server.
+
+    Args:
+        url: The address of the server.
+        files_data: The bytes of the MIDI files to send.
+        num_requests: The number of requests to send.
+        concurrency: The number of clients sending requests at once.
+        settings: Optional encoding settings sent with every request.
+
+    Returns:
+        The number of requests and errors, the requests per second and the
+        median and 99th percentile latency.
+    """
+
+    def send(index: int) -> Tuple[float, bool]:
+        start = time.perf_counter()
+        answer = post_tokenize(url, files_data[index % len(files_data)], settings)
+        seconds = time.perf_counter() - start
+        return seconds, "error" in answer
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(send, range(num_requests)))
+    total_seconds = time.perf_counter() - start
+
+    seconds = [seconds for seconds, _ in results]
+    return {
+        "requests": num_requests,
+        "errors": sum(error for _, error in results),
+        "concurrency": concurrency,
+        "seconds": total_seconds,
+        "requests_per_second": num_requests / total_seconds,
+        "p50_seconds": get_percentile(seconds, 50),
+        "p99_seconds": get_percentile(seconds, 99),
+    }
@@ -0,0 +1,373 @@
+import os
+import json
+import math
+import time
+import pickle
+import platform
+import tempfile
+import subprocess
+import multiprocessing
+from pathlib import Path
+from typing import Dict, List
+
+from source import logging
+from source.datasetcreator import save_token_sequences
+from source.preprocess.columnar import (
+    encode_columnar_songs,
+    read_shared_songs,
+    share_songs,
+)
+from source.preprocess.encode import get_density_bins, encode_songs_data
+from source.preprocess.music21lmd import preprocess_music21_song
+from source.preprocess.loading.serialization import Music21Serializer
+from source.preprocess.sharedstate import warm_up
+from source.tokenizer import tokenize_midi
+
+logger = logging.create_logger("benchmark")
+
+STAGES = ["load", "preprocess", "density_bins", "encode", "write"]
+
+
+def get_commit() -> str:
+    """Gets the current git commit, so results can be compared between commits."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_stages(midi_paths: List[Path], serializer: Music21Serializer) -> Dict:
+    """
+    Runs every stage of the pipeline once over the given files.
+
+    Args:
+        midi_paths: The MIDI files to process.
+        serializer: The serializer used to load the files.
+
+    Returns:
+        A dictionary with the seconds spent in every stage and the number of tokens.
+    """
+    seconds = {}
+
+    start = time.perf_counter()
+    songs = [serializer.load(midi_path) for midi_path in midi_paths]
+    seconds["load"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    songs_data = [preprocess_music21_song(song, train=True) for song in songs]
+    songs_data = [song_data for song_data in songs_data if song_data is not None]
+    seconds["preprocess"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    density_bins = get_density_bins(
+        songs_data, window_size_bars=8, hop_length_bars=8, bins=5
+    )
+    seconds["density_bins"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    token_sequences = encode_songs_data(
+        songs_data,
+        transpositions=[0],
+        permute=True,
+        window_size_bars=8,
+        hop_length_bars=8,
+        density_bins=density_bins,
+        bar_fill=False,
+        seed=0,
+    )
+    seconds["encode"] = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as temporary_path:
+        start = time.perf_counter()
+        save_token_sequences(
+            token_sequences, os.path.join(temporary_path, "token_sequences.txt")
+        )
+        seconds["write"] = time.perf_counter() - start
+
+    tokens = sum(len(token_sequence) for token_sequence in token_sequences)
+    return {"seconds": seconds, "songs": len(songs_data), "tokens": tokens}
+
+
+def _start_worker(ready) -> None:
+    # Everything a worker needs before it can load and preprocess a song
+    warm_up()
+    Music21Serializer()
+    ready.put(os.getpid())
+
+
+def time_worker_startup(num_workers: int, start_method: str) -> List[float]:
+    """
+    Times how long workers take to be ready to process songs.
+
+    With "fork" the shared state is built once in this process and inherited.
+    With "spawn" every worker imports music21 and builds the state itself.
+
+    Args:
+        num_workers: The number of workers started, one after the other.
+        start_method: The multiprocessing start method, "fork" or "spawn".
+
+    Returns:
+        The seconds from starting every worker until it was ready.
+    """
+    context = multiprocessing.get_context(start_method)
+    if start_method == "fork":
+        warm_up()
+    seconds = []
+    for _ in range(num_workers):
+        ready = context.Queue()
+        start = time.perf_counter()
+        process = context.Process(target=_start_worker, args=(ready,))
+        process.start()
+        ready.get()
+        seconds.append(time.perf_counter() - start)
+        process.join()
+    return seconds
+
+
+def get_percentile(values: List[float], percentile: float) -> float:
+    """Gets a percentile of the values with the nearest-rank method."""
+    values = sorted(values)
+    rank = max(math.ceil(percentile / 100 * len(values)), 1)
+    return values[rank - 1]
+
+
+def time_tokenize_latency(midi_paths: List[Path], repeats: int = 5) -> Dict:
+    """
+    Times tokenize_midi on every file, like a service tokenizing single uploads.
+
+    The first file that tokenizes warms the caches and is not counted.
+
+    Args:
+        midi_paths: The MIDI files to tokenize.
+        repeats: How many times every file is tokenized.
+
+    Returns:
+        The number of calls and the median and 99th percentile latency.
+    """
+    files_data = [midi_path.read_bytes() for midi_path in midi_paths]
+    for file_data in files_data:
+        try:
+            tokenize_midi(file_data)
+            break
+        except ValueError:
+            continue
+    seconds = []
+    for _ in range(repeats):
+        for file_data in files_data:
+            start = time.perf_counter()
+            try:
+                tokenize_midi(file_data)
+            except ValueError:
+                # Files that can not be tokenized still answer a request
+                pass
+            seconds.append(time.perf_counter() - start)
+    return {
+        "calls": len(seconds),
+        "p50_seconds": get_percentile(seconds, 50),
+        "p99_seconds": get_percentile(seconds, 99),
+    }
+
+
+def time_song_transfer(songs_data: List[Dict], repeats: int = 3) -> Dict:
+    """
+    Times sending songs to a worker and encoding them there, the way
+    create_async does, against pickling the dicts of the songs.
+
+    The best of the repeats is kept. The tokens of both ways are the same.
+
+    Args:
+        songs_data: Songs as returned by preprocess_music21_song.
+        repeats: How many times the songs are sent and encoded.
+
+    Returns:
+        The bytes sent and the seconds of both ways, with and without encoding.
+    """
+    encode_settings = {
+        "transpositions": [0],
+        "permute": True,
+        "window_size_bars": 8,
+        "hop_length_bars": 8,
+        "density_bins": get_density_bins(
+            songs_data, window_size_bars=8, hop_length_bars=8, bins=5
+        ),
+        "bar_fill": False,
+        "seed": 0,
+    }
+    seconds = {
+        "pickle": float("inf"),
+        "shared_memory": float("inf"),
+        "pickle_encode": float("inf"),
+        "shared_memory_encode": float("inf"),
+    }
+    for _ in range(repeats):
+        start = time.perf_counter()
+        data = pickle.dumps(songs_data)
+        pickle.loads(data)
+        seconds["pickle"] = min(seconds["pickle"], time.perf_counter() - start)
+
+        start = time.perf_counter()
+        encode_songs_data(pickle.loads(pickle.dumps(songs_data)), **encode_settings)
+        seconds["pickle_encode"] = min(
+            seconds["pickle_encode"], time.perf_counter() - start
+        )
+
+        start = time.perf_counter()
+        block = share_songs(songs_data)
+        try:
+            read_shared_songs(block.name, len)
+            transfer_seconds = time.perf_counter() - start
+            seconds["shared_memory"] = min(seconds["shared_memory"], transfer_seconds)
+
+            start = time.perf_counter()
+            read_shared_songs(
+                block.name,
+                lambda columnar_songs: encode_columnar_songs(
+                    columnar_songs, **encode_settings
+                ),
+            )
+            seconds["shared_memory_encode"] = min(
+                seconds["shared_memory_encode"],
+                transfer_seconds + time.perf_counter() - start,
+            )
+            shared_bytes = block.size
+        finally:
+            block.close()
+            block.unlink()
+    return {
+        "songs": len(songs_data),
+        "pickle_bytes": len(data),
+        "shared_memory_bytes": shared_bytes,
+        **{f"{way}_seconds": way_seconds for way, way_seconds in seconds.items()},
+    }
+
+
+def run_benchmark(
+    midi_paths: List[Path],
+    repeats: int = 3,
+    corpus: Dict = None,
+    startup_workers: int = 0,
+    latency_repeats: int = 0,
+    transfer_repeats: int = 0,
+) -> Dict:
+    """
+    Times every stage of the pipeline and keeps the best of several repeats.
+
+    Args:
+        midi_paths: The MIDI files to process.
+        repeats: How many times the whole pipeline runs.
+        corpus: A description of the corpus, stored with the results.
+        startup_workers: Workers started to time their startup. 0 skips it.
+        latency_repeats: Times every file is tokenized alone to time the latency.
+            0 skips it.
+        transfer_repeats: Times the songs are sent to a worker and encoded
+            there, with pickle and with shared memory. 0 skips it.
+
+    Returns:
+        The results, ready to be dumped as JSON.
+    """
+    serializer = Music21Serializer()
+    best_seconds = {stage: float("inf") for stage in STAGES}
+    for repeat in range(repeats):
+        run = run_stages(midi_paths, serializer)
+        for stage in STAGES:
+            best_seconds[stage] = min(best_seconds[stage], run["seconds"][stage])
+        logger.info(f"Repeat {repeat + 1}/{repeats}: {run['seconds']}")
+
+    stages = {}
+    for stage in STAGES:
+        seconds = best_seconds[stage]
+        stages[stage] = {
+            "seconds": seconds,
+            "files_per_second": len(midi_paths) / seconds if seconds else None,
+        }
+    total_seconds = sum(best_seconds.values())
+
+    worker_startup = {}
+    for start_method in ["fork", "spawn"] if startup_workers > 0 else []:
+        startup_seconds = time_worker_startup(startup_workers, start_method)
+        worker_startup[start_method] = {
+            "mean_seconds": sum(startup_seconds) / len(startup_seconds),
+            "max_seconds": max(startup_seconds),
+        }
+        logger.info(f"Worker startup with {start_method}: {startup_seconds}")
+
+    tokenize_latency = {}
+    if latency_repeats > 0:
+        tokenize_latency = time_tokenize_latency(midi_paths, latency_repeats)
+        logger.info(f"Single file latency: {tokenize_latency}")
+
+    song_transfer = {}
+    if transfer_repeats > 0:
+        songs_data = [
+            preprocess_music21_song(serializer.load(midi_path), train=True)
+            for midi_path in midi_paths
+        ]
+        song_transfer = time_song_transfer(
+            [song_data for song_data in songs_data if song_data is not None],
+            transfer_repeats,
+        )
+        logger.info(f"Song transfer: {song_transfer}")
+
+    return {
+        "metadata": {
+            "commit": get_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeats": repeats,
+            "corpus": corpus or {},
+        },
+        "files": len(midi_paths),
+        "songs": run["songs"],
+        "tokens": run["tokens"],
+        "total_seconds": total_seconds,
+        "tokens_per_second": run["tokens"] / total_seconds if total_seconds else None,
+        "stages": stages,
+        "worker_startup": worker_startup,
+        "tokenize_latency": tokenize_latency,
+        "song_transfer": song_transfer,
+    }
+
+
+def compare_results(
+    baseline: Dict, current: Dict, tolerance: float = 0.1, min_difference: float = 0.005
+) -> List:
+    """
+    Finds the stages that got slower than the baseline.
+
+    Args:
+        baseline: Results of a previous run.
+        current: Results of this run.
+        tolerance: Allowed slowdown, as a fraction of the baseline time.
+        min_difference: Slowdowns under this number of seconds are ignored as noise.
+
+    Returns:
+        A list of messages, one for every stage that regressed.
+    """
+    regressions = []
+    for stage, stage_results in current["stages"].items():
+        if stage not in baseline["stages"]:
+            continue
+        baseline_seconds = baseline["stages"][stage]["seconds"]
+        seconds = stage_results["seconds"]
+        too_slow = seconds > baseline_seconds * (1 + tolerance)
+        if too_slow and seconds - baseline_seconds > min_difference:
+            regressions.append(
+                f"{stage}: {seconds:.4f}s vs {baseline_seconds:.4f}s "
+                f"({seconds / baseline_seconds - 1:+.0%})"
+            )
+    return regressions
+
+
+def save_results(results: Dict, path: Path) -> None:
+    with open(path, "w") as file:
+        json.dump(results, file, indent=2)
+
+
+def load_results(path: Path) -> Dict:
+    with open(path, "r") as file:
+        return json.load(file)
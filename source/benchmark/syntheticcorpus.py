@@ -0,0 +1,126 @@
+import random
+from pathlib import Path
+from typing import List
+
+TICKS_PER_QUARTER = 480
+
+# General MIDI programs used for the synthetic tracks
+PROGRAMS = [0, 24, 33, 40, 56, 73, 81, 89]
+
+
+def encode_variable_length(value: int) -> bytes:
+    """Encodes an integer as a MIDI variable length quantity."""
+    encoded = [value & 0x7F]
+    value >>= 7
+    while value:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(reversed(encoded))
+
+
+def make_track_chunk(events: List) -> bytes:
+    """Builds an MTrk chunk from (delta_ticks, event_bytes) pairs."""
+    data = b"".join(
+        encode_variable_length(delta) + event_bytes for delta, event_bytes in events
+    )
+    data += encode_variable_length(0) + b"\xff\x2f\x00"
+    return b"MTrk" + len(data).to_bytes(4, "big") + data
+
+
+def make_midi_bytes(
+    num_tracks: int = 4,
+    num_bars: int = 8,
+    notes_per_bar: int = 8,
+    time_signature=(4, 4),
+    drums: bool = True,
+    seed: int = 0,
+) -> bytes:
+    """
+    Creates a multi-track MIDI file in memory.
+
+    Every track plays notes_per_bar evenly spaced notes in every bar. When drums
+    is True the last track plays on the percussion channel.
+
+    Args:
+        num_tracks: The number of instrument tracks.
+        num_bars: The number of bars of every track.
+        notes_per_bar: The number of notes in every bar of every track.
+        time_signature: The (numerator, denominator) of the only time signature.
+        drums: Whether the last track is a drum track.
+        seed: The seed used to choose the pitches.
+
+    Returns:
+        The bytes of a type 1 MIDI file.
+    """
+    rng = random.Random(seed)
+    numerator, denominator = time_signature
+    bar_ticks = TICKS_PER_QUARTER * 4 * numerator // denominator
+    note_ticks = bar_ticks // notes_per_bar
+
+    # The first track holds the tempo and the time signature
+    conductor = [
+        (0, b"\xff\x51\x03\x07\xa1\x20"),
+        (
+            0,
+            bytes([0xFF, 0x58, 0x04, numerator, denominator.bit_length() - 1, 24, 8]),
+        ),
+    ]
+    chunks = [make_track_chunk(conductor)]
+
+    for track_index in range(num_tracks):
+        is_drum = drums and track_index == num_tracks - 1
+        channel = 9 if is_drum else track_index % 9
+        # music21 needs a program change to create the instrument of the part
+        program = 0 if is_drum else PROGRAMS[track_index % len(PROGRAMS)]
+        events = [(0, bytes([0xC0 | channel, program]))]
+        for _ in range(num_bars * notes_per_bar):
+            pitch = rng.choice([36, 38, 42, 46]) if is_drum else rng.randint(48, 72)
+            events.append((0, bytes([0x90 | channel, pitch, 80])))
+            events.append((note_ticks, bytes([0x80 | channel, pitch, 0])))
+        chunks.append(make_track_chunk(events))
+
+    header = b"MThd" + (6).to_bytes(4, "big")
+    header += (1).to_bytes(2, "big") + len(chunks).to_bytes(2, "big")
+    header += TICKS_PER_QUARTER.to_bytes(2, "big")
+    return header + b"".join(chunks)
+
+
+def generate_corpus(
+    save_path: Path,
+    num_files: int = 10,
+    num_tracks: int = 4,
+    num_bars: int = 8,
+    notes_per_bar: int = 8,
+    num_artists: int = 3,
+    seed: int = 0,
+) -> List[Path]:
+    """
+    Writes synthetic MIDI files in the LMD folder layout (artist/title.mid).
+
+    Args:
+        save_path: Folder where the corpus is written.
+        num_files: The number of files.
+        num_tracks: The number of instrument tracks per file.
+        num_bars: The number of bars per file.
+        notes_per_bar: The number of notes per bar and track.
+        num_artists: The number of artist folders.
+        seed: The seed of the first file. File i uses seed + i.
+
+    Returns:
+        The sorted paths of the written files.
+    """
+    paths = []
+    for file_index in range(num_files):
+        artist_path = Path(save_path) / f"Synthetic Artist {file_index % num_artists}"
+        artist_path.mkdir(parents=True, exist_ok=True)
+        path = artist_path / f"Synthetic Song {file_index}.mid"
+        path.write_bytes(
+            make_midi_bytes(
+                num_tracks=num_tracks,
+                num_bars=num_bars,
+                notes_per_bar=notes_per_bar,
+                seed=seed + file_index,
+            )
+        )
+        paths.append(path)
+    return sorted(paths)
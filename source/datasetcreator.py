@@ -16,98 +16,536 @@
 # Lint as: python3
 
 import os
+import asyncio
+import json
+import functools
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor
+from collections import Counter
 from pathlib import Path
-from typing import List
-
-from music21.stream import Score
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
 
 from source import logging
-from source.preprocess.music21lmd import preprocess_music21
-from source.preprocess.encode import get_density_bins, encode_songs_data
+from source.metrics import PipelineMetrics
+from source.preprocess.encode import (
+    get_density_distribution,
+    compute_density_bins,
+    encode_songs_data,
+)
+from source.preprocess.dedup import WindowDeduplicator
+from source.preprocess.packing import pack_token_files
+from source.preprocess.parquetexport import ParquetExporter
+from source.preprocess.sharedstate import get_vocabulary, warm_up
+from source.preprocess.loading.serialization import Music21Serializer
+from source.preprocess.loading.sharding import get_shard_name
+from source.datasetmerger import get_sequences_paths
+
+if TYPE_CHECKING:
+    from music21.stream import Score
 
 logger = logging.create_logger("datasetcreator")
 
 
 class DatasetCreator:
-    def __init__(self, config):
+    def __init__(self, config, metrics=None, deduplicator=None):
         self.config = config
+        self.metrics = metrics if metrics is not None else PipelineMetrics()
+        # Drops songs with the notes of a song seen before
+        self.deduplicator = deduplicator
+        # Drops windows with the content of a window already encoded. Kept
+        # across iterations, so repeats in later batches are dropped too
+        self.window_deduplicator = None
+        if config.deduplicate_windows:
+            self.window_deduplicator = WindowDeduplicator(
+                config.window_dedup_capacity,
+                config.window_dedup_error_rate,
+                self.metrics,
+            )
+        # Kept open across iterations, so Parquet files fill up
+        self.parquet_exporter = None
+        self._parquet_rows = None
+        # Runs the CPU work of create_async. Created on first use
+        self.executor = None
+
+    def get_state(self) -> Dict:
+        """What a resumed run needs besides the iteration, for last_iteration.txt."""
+        state = {}
+        if self.parquet_exporter is not None:
+            state["parquet_rows"] = self.parquet_exporter.get_rows()
+        return state
+
+    def set_state(self, state: Dict) -> None:
+        """Resumes from the state returned by get_state at the last checkpoint."""
+        self._parquet_rows = state.get("parquet_rows")
+
+    def close(self, dataset_path: Path) -> None:
+        """
+        Finishes the files that span the whole run, after the last iteration.
+
+        Writes the Parquet files being filled and, with pack_context_length,
+        packs the token sequences of every split into token_blocks_{split}.txt.
+        Stops the worker of create_async, if it was started.
+
+        Args:
+            dataset_path: The folder passed to create.
+        """
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        if self.parquet_exporter is not None:
+            with self.metrics.stage("write"):
+                self.parquet_exporter.close()
+            logger.info(f"Exported Parquet tables: {self.parquet_exporter.get_rows()}")
+            self.parquet_exporter = None
+
+        if self.config.pack_context_length is None:
+            return
+        dataset_path = Path(self.__get_dataset_path(dataset_path))
+        for split in ["train", "valid"]:
+            blocks_path = dataset_path / f"token_blocks_{split}.txt"
+            with self.metrics.stage("write"):
+                num_blocks = pack_token_files(
+                    get_sequences_paths(dataset_path, split),
+                    blocks_path,
+                    self.config.pack_context_length,
+                    self.config.separator_token,
+                )
+            logger.info(f"Packed {num_blocks} blocks to {blocks_path}")
+
+    def get_loader_preprocess(self) -> Optional[Callable]:
+        """
+        The preprocessing the loader can run where songs are loaded, in its
+        workers. Batches of its results are passed to create with
+        preprocessed=True.
+
+        Returns:
+            None when json_data_method is not preprocess_music21.
+        """
+        if self.config.json_data_method != "preprocess_music21":
+            return None
+        # Imports music21, so it is only done when songs are preprocessed
+        from source.preprocess.music21lmd import preprocess_loaded_song
+
+        return functools.partial(
+            preprocess_loaded_song,
+            valid_ratio=self.config.valid_ratio,
+            split_key=self.config.split_key,
+            ticks_per_quarter=self.config.ticks_per_quarter,
+        )
+
+    def __get_dataset_path(self, dataset_path):
+        dataset_path = os.path.join(dataset_path, self.config.dataset_name)
+        if self.config.num_shards > 1:
+            dataset_path = os.path.join(
+                dataset_path,
+                get_shard_name(self.config.shard_index, self.config.num_shards),
+            )
+        return dataset_path
 
     def create(
         self,
         dataset_path: Path,
-        m21_streams: List[Score],
+        m21_streams: List["Score"],
         current_iteration: int,
         overwrite=False,
+        preprocessed=False,
     ) -> None:
+        # With preprocessed, m21_streams are the results of get_loader_preprocess
+        dataset_path = self.__prepare_dataset_path(dataset_path, overwrite)
+        if dataset_path is None:
+            return
+
+        # Get music data as json
+        json_data_method = self.__get_json_data_method(preprocessed, self.metrics)
+        with self.metrics.stage("preprocess"):
+            songs_data_train, songs_data_valid = json_data_method(m21_streams)
+
+        songs_data_train, songs_data_valid = self.__filter_duplicates(
+            songs_data_train, songs_data_valid
+        )
+
+        # Get density bins
+        with self.metrics.stage("density_bins"):
+            density_bins, density_distribution = get_density_bins_of_songs(
+                songs_data_train,
+                self.config.window_size_bars,
+                self.config.hop_length_bars,
+                self.config.density_bins_number,
+            )
+        self.__save_density_bins(
+            density_bins, density_distribution, dataset_path, current_iteration
+        )
+
+        # Songs are exported before bar fill changes their bars
+        parquet_exporter = self.__get_parquet_exporter(dataset_path)
+        if parquet_exporter is not None:
+            with self.metrics.stage("write"):
+                parquet_exporter.write_songs(songs_data_train, "train")
+                parquet_exporter.write_songs(songs_data_valid, "valid")
+
+        for split, songs_data in [
+            ("train", songs_data_train),
+            ("valid", songs_data_valid),
+        ]:
+            sequence_windows = [] if parquet_exporter is not None else None
+            with self.metrics.stage("encode"):
+                token_sequences = encode_songs_data(
+                    songs_data,
+                    metrics=self.metrics,
+                    window_deduplicator=self.window_deduplicator,
+                    sequence_windows=sequence_windows,
+                    **self.__get_encode_settings(split, density_bins),
+                )
+            with self.metrics.stage("write"):
+                self.__write_split(
+                    token_sequences,
+                    sequence_windows,
+                    dataset_path,
+                    split,
+                    current_iteration,
+                )
+
+    async def create_async(
+        self,
+        dataset_path: Path,
+        m21_streams: List["Score"],
+        current_iteration: int,
+        overwrite=False,
+        preprocessed=False,
+    ) -> None:
+        """
+        Like create, but awaits instead of blocking the event loop.
+
+        Preprocessing, density bins and encoding run on a process executor,
+        so music21 and the encoder do not hold the GIL of the loop. Songs
+        reach the worker through shared memory, which the encoder reads
+        without copies. Files are written on threads. The state of the
+        creator, like the window filter and the Parquet writers, stays in
+        this process.
+        """
+        dataset_path = await asyncio.to_thread(
+            self.__prepare_dataset_path, dataset_path, overwrite
+        )
+        if dataset_path is None:
+            return
+        loop = asyncio.get_running_loop()
+        executor = self.__get_executor()
+
+        with self.metrics.stage("preprocess"):
+            if preprocessed:
+                # Only splits the results, the workers of the loader did the work
+                json_data_method = self.__get_json_data_method(True, self.metrics)
+                songs_data_train, songs_data_valid = json_data_method(m21_streams)
+            else:
+                # Scores do not pickle, so they are frozen to be sent. Passing
+                # batches preprocessed by the loader avoids it
+                serializer = Music21Serializer()
+                frozen_streams = [
+                    serializer.to_bytes(m21_stream) for m21_stream in m21_streams
+                ]
+                (songs_data_train, songs_data_valid), records = (
+                    await loop.run_in_executor(
+                        executor,
+                        functools.partial(
+                            _preprocess_in_worker,
+                            self.__get_json_data_method(False, None),
+                            frozen_streams,
+                            self.config.json_data_method == "preprocess_music21",
+                        ),
+                    )
+                )
+                self.metrics.add_records(records)
+
+        songs_data_train, songs_data_valid = self.__filter_duplicates(
+            songs_data_train, songs_data_valid
+        )
+
+        # Songs go to the worker through shared memory, in the columnar layout
+        # the worker reads without unpickling them
+        from source.preprocess.columnar import share_songs
+
+        blocks = {
+            "train": share_songs(songs_data_train),
+            "valid": share_songs(songs_data_valid),
+        }
+        try:
+            with self.metrics.stage("density_bins"):
+                density_bins, density_distribution = await loop.run_in_executor(
+                    executor,
+                    functools.partial(
+                        _get_shared_density_bins,
+                        blocks["train"].name,
+                        self.config.window_size_bars,
+                        self.config.hop_length_bars,
+                        self.config.density_bins_number,
+                    ),
+                )
+            await asyncio.to_thread(
+                self.__save_density_bins,
+                density_bins,
+                density_distribution,
+                dataset_path,
+                current_iteration,
+            )
+
+            parquet_exporter = await asyncio.to_thread(
+                self.__get_parquet_exporter, dataset_path
+            )
+            if parquet_exporter is not None:
+                with self.metrics.stage("write"):
+                    await asyncio.to_thread(
+                        parquet_exporter.write_songs, songs_data_train, "train"
+                    )
+                    await asyncio.to_thread(
+                        parquet_exporter.write_songs, songs_data_valid, "valid"
+                    )
+
+            for split in ["train", "valid"]:
+                # The window filter goes to the worker and comes back with the
+                # windows of this split, so splits are encoded one after the other
+                seen_windows = None
+                if self.window_deduplicator is not None:
+                    seen_windows = self.window_deduplicator.seen_windows
+                with self.metrics.stage("encode"):
+                    (
+                        token_sequences,
+                        sequence_windows,
+                        seen_windows,
+                        records,
+                    ) = await loop.run_in_executor(
+                        executor,
+                        functools.partial(
+                            _encode_in_worker,
+                            blocks[split].name,
+                            seen_windows,
+                            parquet_exporter is not None,
+                            self.__get_encode_settings(split, density_bins),
+                        ),
+                    )
+                if self.window_deduplicator is not None:
+                    self.window_deduplicator.seen_windows = seen_windows
+                self.metrics.add_records(records)
+                with self.metrics.stage("write"):
+                    await asyncio.to_thread(
+                        self.__write_split,
+                        token_sequences,
+                        sequence_windows,
+                        dataset_path,
+                        split,
+                        current_iteration,
+                    )
+        finally:
+            for block in blocks.values():
+                block.close()
+                block.unlink()
+
+    def __get_executor(self) -> Executor:
+        if self.executor is None:
+            # Built before forking, so the worker starts warm
+            warm_up(
+                density_bins_number=self.config.density_bins_number,
+                ticks_per_quarter=self.config.ticks_per_quarter,
+            )
+            self.executor = ProcessPoolExecutor(
+                1, mp_context=multiprocessing.get_context("fork")
+            )
+        return self.executor
+
+    def __prepare_dataset_path(self, dataset_path, overwrite):
+        """Creates the folder of the dataset. Returns None if it must not be written."""
         # Make sure the dataset_path exists
         if not os.path.exists(dataset_path):
             os.mkdir(dataset_path)
 
         # Make sure that path for this specific dataset exists
-        dataset_path = os.path.join(dataset_path, self.config.dataset_name)
+        dataset_path = self.__get_dataset_path(dataset_path)
         if os.path.exists(dataset_path) and overwrite is False:
             logger.info("Dataset already exists.")
-            return
+            return None
         if not os.path.exists(dataset_path):
             os.makedirs(dataset_path)
+        return dataset_path
+
+    def __get_json_data_method(self, preprocessed, metrics):
+        """
+        Prepare for getting music data as json. Without metrics, they are
+        left for the caller, e.g. a worker with its own.
+        """
+        bound = {"metrics": metrics} if metrics is not None else {}
+        if preprocessed:
+            from source.preprocess.music21lmd import split_preprocessed_songs
 
-        # Prepare for getting music data as json
-        json_data_method = None
+            return functools.partial(split_preprocessed_songs, **bound)
         if self.config.json_data_method == "preprocess_music21":
-            json_data_method = preprocess_music21
-        elif callable(self.config.json_data_method):
-            json_data_method = self.config.json_data_method
-        else:
-            error_string = f"Unexpected {self.config.json_data_method}"
-            logger.error(error_string)
-            raise Exception(error_string)
+            # Imports music21, so it is only done when songs are preprocessed
+            from source.preprocess.music21lmd import preprocess_music21
 
-        # Get music data as json
-        songs_data_train, songs_data_valid = json_data_method(m21_streams)
+            return functools.partial(
+                preprocess_music21,
+                valid_ratio=self.config.valid_ratio,
+                split_key=self.config.split_key,
+                timeout=self.config.file_timeout,
+                max_memory=self.config.max_file_memory,
+                ticks_per_quarter=self.config.ticks_per_quarter,
+                **bound,
+            )
+        if callable(self.config.json_data_method):
+            return self.config.json_data_method
+        error_string = f"Unexpected {self.config.json_data_method}"
+        logger.error(error_string)
+        raise Exception(error_string)
 
-        # Get density bins
-        density_bins = get_density_bins(
-            songs_data_train,
-            self.config.window_size_bars,
-            self.config.hop_length_bars,
-            self.config.density_bins_number,
-        )
+    def __filter_duplicates(self, songs_data_train, songs_data_valid):
+        if self.deduplicator is None:
+            return songs_data_train, songs_data_valid
+        with self.metrics.stage("dedup"):
+            songs_data_train = self.deduplicator.filter_songs_data(
+                songs_data_train, self.metrics
+            )
+            songs_data_valid = self.deduplicator.filter_songs_data(
+                songs_data_valid, self.metrics
+            )
+        return songs_data_train, songs_data_valid
+
+    def __get_parquet_exporter(self, dataset_path):
+        if self.config.export_parquet and self.parquet_exporter is None:
+            self.parquet_exporter = ParquetExporter(
+                dataset_path,
+                get_vocabulary(
+                    self.config.density_bins_number, self.config.ticks_per_quarter
+                ),
+                self.config.parquet_row_group_size,
+                self.config.parquet_file_rows,
+                self._parquet_rows,
+            )
+        return self.parquet_exporter
 
-        # Process and save training data
-        token_sequences_train = encode_songs_data(
-            songs_data_train,
-            transpositions=self.config.transpositions_train,
+    def __get_encode_settings(self, split, density_bins):
+        # Only training songs are transposed
+        return dict(
+            transpositions=(
+                self.config.transpositions_train if split == "train" else [0]
+            ),
             permute=self.config.permute_tracks,
             window_size_bars=self.config.window_size_bars,
             hop_length_bars=self.config.hop_length_bars,
             density_bins=density_bins,
             bar_fill=self.config.encoding_method == "mmmbar",
+            seed=self.config.seed,
+            max_tokens=self.config.max_tokens,
+            over_length=self.config.over_length,
         )
 
-        dataset_path_train = os.path.join(
-            dataset_path, f"token_sequences_train_{current_iteration}.txt"
+    def __write_split(
+        self, token_sequences, sequence_windows, dataset_path, split, current_iteration
+    ):
+        path = self.__save_token_sequences(
+            token_sequences, dataset_path, split, current_iteration
         )
-        self.__save_token_sequences(token_sequences_train, dataset_path_train)
-        logger.info(f"Saved training data to {dataset_path_train}")
+        if self.parquet_exporter is not None:
+            self.parquet_exporter.write_sequences(
+                token_sequences, sequence_windows, split
+            )
+        split_name = "training" if split == "train" else "validation"
+        logger.info(f"Saved {split_name} data to {path}")
 
-        # Process and save validation data
-        token_sequences_valid = encode_songs_data(
-            songs_data_valid,
-            transpositions=[0],
-            permute=self.config.permute_tracks,
-            window_size_bars=self.config.window_size_bars,
-            hop_length_bars=self.config.hop_length_bars,
-            density_bins=density_bins,
-            bar_fill=self.config.encoding_method == "mmmbar",
-        )
+    def __save_density_bins(
+        self, density_bins, density_distribution, dataset_path, current_iteration
+    ):
+        # Keep the distribution so shards can be merged with common bins
+        path = os.path.join(dataset_path, f"density_bins_{current_iteration}.json")
+        with open(path, "w") as file:
+            json.dump(
+                {
+                    "bins_number": self.config.density_bins_number,
+                    "bins": [float(density_bin) for density_bin in density_bins],
+                    "histogram": dict(Counter(density_distribution)),
+                },
+                file,
+            )
 
-        dataset_path_valid = os.path.join(
-            dataset_path, f"token_sequences_valid_{current_iteration}.txt"
+    def __save_token_sequences(
+        self, token_sequences, dataset_path, split, current_iteration
+    ):
+        # Packed at the end of the run, so blocks span the batches
+        path = os.path.join(
+            dataset_path, f"token_sequences_{split}_{current_iteration}.txt"
         )
-        self.__save_token_sequences(token_sequences_valid, dataset_path_valid)
-        logger.info(f"Saved validation data to {dataset_path_valid}")
+        save_token_sequences(token_sequences, path)
+        return path
 
-    def __save_token_sequences(self, token_sequences, path):
-        with open(path, "w") as file:
-            for token_sequence in token_sequences:
-                print(" ".join(token_sequence), file=file)
+
+def save_token_sequences(token_sequences, path):
+    with open(path, "w") as file:
+        for token_sequence in token_sequences:
+            print(" ".join(token_sequence), file=file)
+
+
+def get_density_bins_of_songs(
+    songs_data, window_size_bars, hop_length_bars, density_bins_number
+):
+    """Returns the density bins of the songs and the distribution they come from."""
+    density_distribution = get_density_distribution(
+        songs_data, window_size_bars, hop_length_bars
+    )
+    density_bins = compute_density_bins(density_distribution, density_bins_number)
+    return density_bins, density_distribution
+
+
+def _preprocess_in_worker(json_data_method, frozen_streams, takes_metrics):
+    """Preprocesses frozen streams in a worker, with metrics whose records are sent back."""
+    serializer = Music21Serializer()
+    m21_streams = [serializer.from_bytes(data) for data in frozen_streams]
+    metrics = PipelineMetrics()
+    if takes_metrics:
+        songs_data = json_data_method(m21_streams, metrics=metrics)
+    else:
+        songs_data = json_data_method(m21_streams)
+    return songs_data, metrics.get_records()
+
+
+def _get_shared_density_bins(
+    block_name, window_size_bars, hop_length_bars, density_bins_number
+):
+    """Computes the density bins of songs shared with share_songs, in a worker."""
+    from source.preprocess.columnar import (
+        get_columnar_density_distribution,
+        read_shared_songs,
+    )
+
+    density_distribution = read_shared_songs(
+        block_name,
+        functools.partial(
+            get_columnar_density_distribution,
+            window_size_bars=window_size_bars,
+            hop_length_bars=hop_length_bars,
+        ),
+    )
+    density_bins = compute_density_bins(density_distribution, density_bins_number)
+    return density_bins, density_distribution
+
+
+def _encode_in_worker(block_name, seen_windows, keep_windows, encode_settings):
+    """
+    Encodes songs shared with share_songs in a worker, with the window filter
+    of the creator.
+    """
+    from source.preprocess.columnar import encode_columnar_songs, read_shared_songs
+
+    metrics = PipelineMetrics()
+    window_deduplicator = None
+    if seen_windows is not None:
+        window_deduplicator = WindowDeduplicator(1, metrics=metrics)
+        window_deduplicator.seen_windows = seen_windows
+    sequence_windows = [] if keep_windows else None
+    token_sequences = read_shared_songs(
+        block_name,
+        functools.partial(
+            encode_columnar_songs,
+            metrics=metrics,
+            window_deduplicator=window_deduplicator,
+            sequence_windows=sequence_windows,
+            **encode_settings,
+        ),
+    )
+    return token_sequences, sequence_windows, seen_windows, metrics.get_records()
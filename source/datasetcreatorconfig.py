@@ -16,12 +16,18 @@
 # Lint as: python3
 
 import os
-from typing import List
+import importlib.util
+from typing import Any, Dict, List, Optional
 from pathlib import Path
 
 from pydantic import BaseModel, validator, Field
 
 from source import logging
+from source.preprocess.encode import OVER_LENGTH_ACTIONS
+from source.preprocess.packing import SEPARATOR_TOKEN
+from source.preprocess.split import SPLIT_KEYS
+from source.preprocess.preprocessutilities import TICKS_PER_QUARTER
+from source.preprocess.loading.archive import is_archive
 
 
 logger = logging.create_logger("datasetcreatorconfig")
@@ -46,12 +52,48 @@ class LMDCleanDatasetCreatorBarConfig(BaseModel):
         density_bins_number: An integer indicating the number of density bins.
         transpositions_train: A list of integers indicating transpositions for training.
         permute_tracks: A boolean indicating whether to permute tracks.
+        ticks_per_quarter: An integer indicating the resolution of the time grid, in ticks per quarter note.
+        seed: An integer used to derive the random choices made for every song.
+        valid_ratio: A float indicating the fraction of songs used for validation.
+        split_key: A string indicating what keeps songs on the same side of the split.
         num_files_per_iteration: Number of files to process at a time.
-        midi_paths: A list of strings indicating paths to MIDI files.
+        num_shards: Number of slices the MIDI files are split into.
+        shard_index: Slice of the MIDI files processed by this run.
+        profile_file_index: Optional index of a file to profile with cProfile.
+        file_timeout: Optional seconds a file may spend loading or preprocessing.
+        max_file_memory_mb: Optional megabytes a file may allocate while loading or preprocessing.
+        prescan: A boolean indicating whether to filter files from their raw MIDI events before parsing.
+        use_quarantine: A boolean indicating whether to skip files rejected by earlier runs.
+        quarantine_path: Optional file with the rejected files. Default: quarantine.json in the dataset.
+        index_path: Optional corpus index used to select the files to process.
+        genres: Optional list of genres to keep. Needs index_path.
+        time_signature: Optional only time signature the files may use. Needs index_path.
+        max_tracks: Optional maximum number of tracks with notes. Needs index_path.
+        num_workers: Number of processes that parse files.
+        longest_first: A boolean indicating whether to process the most expensive files first.
+        max_batch_memory_mb: Optional megabytes a batch may use, which makes batch sizes adaptive.
+        prefetch_files: Number of files read ahead on threads and parsed from memory.
+        deduplicate: A boolean indicating whether to skip files with the bytes or notes of another file.
+        deduplicate_windows: A boolean indicating whether to drop windows with the content of a window already encoded.
+        window_dedup_capacity: Number of windows the window filter holds at its error rate.
+        window_dedup_error_rate: Fraction of unique windows the full window filter drops by mistake.
+        pack_context_length: Optional number of tokens per line. Packs the windows of each split into blocks of this length at the end of the run.
+        separator_token: A string with the token written after every window in packed blocks.
+        max_tokens: Optional most tokens a window may have, checked before it is encoded.
+        over_length: A string indicating what to do with longer windows: skip, drop_tracks or shrink.
+        export_parquet: A boolean indicating whether to also write the songs and sequences as Parquet tables.
+        parquet_row_group_size: Number of rows per row group of the Parquet tables.
+        parquet_file_rows: Number of rows per Parquet file.
+        midi_source: Folder with the MIDI files, or a .tar, .tar.gz or .zip archive of them.
         save_path: This is a folder where the tokenized dataset will be saved.
 
     Methods:
         check_if_paths_exists(cls, value: List): Validates that the provided MIDI file paths exist.
+        check_shard_index(cls, value: int, values: Dict): Validates the shard index.
+        check_index_path(cls, value: Any, values: Dict): Validates that filters have an index.
+        check_split_key(cls, value: str): Validates what keeps songs on the same side of the split.
+        check_over_length(cls, value: str): Validates the action for long windows.
+        check_export_parquet(cls, value: bool): Validates that pyarrow is installed for the export.
     """
 
     # Optional arguments
@@ -76,13 +118,122 @@ class LMDCleanDatasetCreatorBarConfig(BaseModel):
         [0], description="Transposition to implement for data augmentation"
     )
     permute_tracks: bool = Field(True, description="Permute tracks randomly")
+    ticks_per_quarter: int = Field(
+        TICKS_PER_QUARTER, description="Ticks per quarter note of the time grid"
+    )
+    seed: int = Field(
+        0, description="Seed for track permutation and bar fill. Same seed, same output"
+    )
+    valid_ratio: float = Field(0.2, description="Fraction of songs for validation")
+    split_key: str = Field(
+        "artist",
+        description="Split songs by path, song (groups .1/.2 variants) or artist",
+    )
     num_files_per_iteration: int = Field(
         10, description="Number of files to process at a time"
     )
+    num_shards: int = Field(
+        1, description="Split the MIDI files in this number of shards"
+    )
+    shard_index: int = Field(
+        0, description="Shard processed by this run, from 0 to num_shards - 1"
+    )
+    profile_file_index: Optional[int] = Field(
+        None, description="Save a cProfile of the file with this index"
+    )
+    file_timeout: Optional[float] = Field(
+        None, description="Skip files that take more seconds to load or preprocess"
+    )
+    max_file_memory_mb: Optional[int] = Field(
+        None, description="Skip files that need more MB to load or preprocess"
+    )
+    prescan: bool = Field(
+        True, description="Reject empty and multi-meter files before parsing them"
+    )
+    use_quarantine: bool = Field(
+        True, description="Skip files that were rejected by earlier runs"
+    )
+    quarantine_path: Optional[Path] = Field(
+        None, description="File with rejected files. Default: in the dataset folder"
+    )
+    index_path: Optional[Path] = Field(
+        None, description="Corpus index built by build_index_mmm.py to select files"
+    )
+    genres: Optional[List[str]] = Field(
+        None, description="Only process files of these genres"
+    )
+    time_signature: Optional[str] = Field(
+        None, description="Only process files that use just this meter, like 4/4"
+    )
+    max_tracks: Optional[int] = Field(
+        None, description="Only process files with at most this number of tracks"
+    )
+    num_workers: int = Field(1, description="Number of processes that parse files")
+    longest_first: bool = Field(
+        False,
+        description="Process the largest files first, or the slowest ones in the index",
+    )
+    max_batch_memory_mb: Optional[int] = Field(
+        None, description="Size batches so they use at most this number of MB"
+    )
+    prefetch_files: int = Field(
+        0, description="Read this number of files ahead and parse them from memory"
+    )
+    deduplicate: bool = Field(
+        False, description="Skip files with the same bytes or notes as another file"
+    )
+    deduplicate_windows: bool = Field(
+        False, description="Drop windows with the same content as an encoded window"
+    )
+    window_dedup_capacity: int = Field(
+        10_000_000, description="Number of windows the window filter is sized for"
+    )
+    window_dedup_error_rate: float = Field(
+        0.001, description="Fraction of unique windows the full window filter drops"
+    )
+    pack_context_length: Optional[int] = Field(
+        None,
+        description="At the end, pack the windows into lines of this many tokens",
+    )
+    separator_token: str = Field(
+        SEPARATOR_TOKEN, description="Token after every window in packed lines"
+    )
+    max_tokens: Optional[int] = Field(
+        None, description="Most tokens a window may have before it is encoded"
+    )
+    over_length: str = Field(
+        "skip",
+        description="What to do with longer windows: skip, drop_tracks or shrink",
+    )
+    export_parquet: bool = Field(
+        False, description="Also write songs and token ids as Parquet. Needs pyarrow"
+    )
+    parquet_row_group_size: int = Field(
+        1024, description="Rows per row group of the Parquet tables"
+    )
+    parquet_file_rows: int = Field(
+        100_000, description="Rows per Parquet file, later rows go to the next one"
+    )
     # Mandatory arguments
-    midi_source: str = Field(description="Folder with the LMD dataset")
+    midi_source: str = Field(
+        description="Folder with the LMD dataset, or a .tar, .tar.gz or .zip of it"
+    )
     save_path: Path = Field(description="Path where tokenized dataset will be saved")
 
+    @property
+    def max_file_memory(self) -> Optional[int]:
+        """The memory cap of a file in bytes."""
+        if self.max_file_memory_mb is None:
+            return None
+        return self.max_file_memory_mb * 1024 * 1024
+
+    @property
+    def max_batch_memory(self) -> Optional[int]:
+        """The memory budget of a batch in bytes."""
+        if self.max_batch_memory_mb is None:
+            return None
+        return self.max_batch_memory_mb * 1024 * 1024
+
     @validator("save_path", pre=True)
     @classmethod
     def convert_to_path(cls, value: str) -> Path:
@@ -112,7 +263,257 @@ class LMDCleanDatasetCreatorBarConfig(BaseModel):
         Returns:
             The original list of MIDI file paths, if all paths point to an existing file.
         """
+        if not os.path.isdir(value) and not is_archive(value):
+            message = f"'{value}' folder or archive does not exist."
+            raise FileExistsError(message)
+        return value
+
+    @validator("shard_index")
+    @classmethod
+    def check_shard_index(cls, value: int, values: Dict) -> int:
+        """
+        Validates that the shard index is smaller than the number of shards.
+
+        Args:
+            value: The shard index.
+            values: The fields validated so far.
+
+        Raises:
+            ValueError: If the shard index is out of range.
+
+        Returns:
+            The shard index.
+        """
+        num_shards = values.get("num_shards", 1)
+        if not 0 <= value < num_shards:
+            message = f"shard_index must be between 0 and {num_shards - 1}."
+            raise ValueError(message)
+        return value
+
+    @validator("genres", "time_signature", "max_tracks")
+    @classmethod
+    def check_index_path(cls, value: Any, values: Dict) -> Any:
+        """
+        Validates that file filters come with a corpus index to apply them.
+
+        Args:
+            value: The filter.
+            values: The fields validated so far.
+
+        Raises:
+            ValueError: If a filter is set without index_path.
+
+        Returns:
+            The filter.
+        """
+        if value is not None and values.get("index_path") is None:
+            raise ValueError("Filtering files needs an index_path.")
+        return value
+
+    @validator("split_key")
+    @classmethod
+    def check_split_key(cls, value: str) -> str:
+        """
+        Validates what keeps songs on the same side of the split.
+
+        Args:
+            value: The split key.
+
+        Raises:
+            ValueError: If the split key is not one of SPLIT_KEYS.
+
+        Returns:
+            The split key.
+        """
+        if value not in SPLIT_KEYS:
+            message = f"split_key must be one of {', '.join(SPLIT_KEYS)}."
+            raise ValueError(message)
+        return value
+
+    @validator("over_length")
+    @classmethod
+    def check_over_length(cls, value: str) -> str:
+        """
+        Validates the action for windows longer than max_tokens.
+
+        Args:
+            value: The action.
+
+        Raises:
+            ValueError: If the action is not one of OVER_LENGTH_ACTIONS.
+
+        Returns:
+            The action.
+        """
+        if value not in OVER_LENGTH_ACTIONS:
+            message = f"over_length must be one of {', '.join(OVER_LENGTH_ACTIONS)}."
+            raise ValueError(message)
+        return value
+
+    @validator("export_parquet")
+    @classmethod
+    def check_export_parquet(cls, value: bool) -> bool:
+        """
+        Validates that pyarrow, which writes the Parquet tables, is installed.
+
+        Args:
+            value: Whether to export Parquet tables.
+
+        Raises:
+            ValueError: If the export is asked for without pyarrow.
+
+        Returns:
+            Whether to export Parquet tables.
+        """
+        if value and importlib.util.find_spec("pyarrow") is None:
+            raise ValueError("export_parquet needs pyarrow: pip install pyarrow")
+        return value
+
+
+class RecheckQuarantineConfig(BaseModel):
+    """
+    A configuration class for re-checking quarantined files.
+
+    Attributes:
+        quarantine_path: The quarantine file.
+        recheck_all: A boolean indicating whether to re-check entries of the current version too.
+        file_timeout: Optional seconds a file may spend loading or preprocessing.
+        max_file_memory_mb: Optional megabytes a file may allocate while loading or preprocessing.
+        midi_source: Optional archive the quarantined files were read from.
+
+    Methods:
+        check_midi_source(cls, value: Optional[Path]): Validates that the MIDI source is an archive.
+    """
+
+    quarantine_path: Path = Field(description="The quarantine file")
+    recheck_all: bool = Field(
+        False, description="Re-check files quarantined by the current version too"
+    )
+    file_timeout: Optional[float] = Field(
+        None, description="Keep files that take more seconds to load or preprocess"
+    )
+    max_file_memory_mb: Optional[int] = Field(
+        None, description="Keep files that need more MB to load or preprocess"
+    )
+    midi_source: Optional[Path] = Field(
+        None,
+        description="The .tar, .tar.gz or .zip the files were read from. "
+        "Without it, files quarantined out of an archive are kept",
+    )
+
+    @validator("midi_source")
+    @classmethod
+    def check_midi_source(cls, value: Optional[Path]) -> Optional[Path]:
+        """
+        Validates that the MIDI source is an archive. Files in folders are
+        re-checked at their own path, so folders are not needed.
+
+        Args:
+            value: The MIDI source.
+
+        Raises:
+            ValueError: If the MIDI source is not an existing archive.
+
+        Returns:
+            The MIDI source.
+        """
+        if value is not None and not is_archive(value):
+            raise ValueError(f"'{value}' is not a .tar, .tar.gz or .zip archive.")
+        return value
+
+
+class MergeShardsConfig(BaseModel):
+    """
+    A configuration class for merging the shards of a dataset.
+
+    Attributes:
+        dataset_path: Folder of the dataset, containing one folder per shard.
+        reconcile_density: A boolean indicating whether to recompute the DENSITY tokens.
+        pack_context_length: Optional number of tokens per line. Also packs the merged windows into blocks of this length.
+        separator_token: A string with the token written after every window in packed blocks.
+    """
+
+    dataset_path: Path = Field(description="Folder with the shard folders")
+    reconcile_density: bool = Field(
+        True, description="Rewrite DENSITY tokens with the bins of all shards"
+    )
+    pack_context_length: Optional[int] = Field(
+        None, description="Also pack the merged windows into lines of this many tokens"
+    )
+    separator_token: str = Field(
+        SEPARATOR_TOKEN, description="Token after every window in packed lines"
+    )
+
+    @validator("dataset_path")
+    @classmethod
+    def check_if_dataset_exists(cls, value: Path) -> Path:
+        """
+        Validates that the dataset folder exists.
+
+        Args:
+            value: The dataset folder.
+
+        Raises:
+            FileExistsError: If the folder does not exist.
+
+        Returns:
+            The dataset folder.
+        """
         if not os.path.isdir(value):
             message = f"'{value}' folder does not exist."
             raise FileExistsError(message)
         return value
+
+
+class BuildIndexConfig(BaseModel):
+    """
+    A configuration class for building the corpus index.
+
+    Attributes:
+        midi_source: Folder with the MIDI files.
+        index_path: The SQLite file of the index.
+        parse: A boolean indicating whether to load every file to measure its parse time.
+        file_timeout: Optional seconds a file may spend loading.
+        max_file_memory_mb: Optional megabytes a file may allocate while loading.
+    """
+
+    midi_source: Path = Field(description="Folder with the LMD dataset")
+    index_path: Path = Field(description="SQLite file of the index")
+    parse: bool = Field(
+        True, description="Load every file to record its parse time and errors"
+    )
+    file_timeout: Optional[float] = Field(
+        None, description="Record files that take more seconds to load as errors"
+    )
+    max_file_memory_mb: Optional[int] = Field(
+        None, description="Record files that need more MB to load as errors"
+    )
+
+
+class ServeConfig(BaseModel):
+    """
+    A configuration class for the local tokenization server.
+
+    Attributes:
+        host: The address to listen on.
+        port: The port to listen on.
+        num_workers: Number of processes tokenizing files. 0 tokenizes in the server process.
+        max_batch_size: Most requests sent to a worker at once.
+        max_batch_wait_ms: Milliseconds a request waits for others to share its batch.
+        cache_size: Number of results kept to answer repeated files.
+        density_bins_path: Optional JSON file with the density bins of a dataset.
+    """
+
+    host: str = Field("127.0.0.1", description="Address to listen on")
+    port: int = Field(8765, description="Port to listen on")
+    num_workers: int = Field(
+        os.cpu_count(), description="Processes tokenizing files. 0: in the server"
+    )
+    max_batch_size: int = Field(8, description="Most requests sent to a worker at once")
+    max_batch_wait_ms: float = Field(
+        5.0, description="Milliseconds a request waits for others to batch with"
+    )
+    cache_size: int = Field(1024, description="Results kept for repeated files")
+    density_bins_path: Optional[Path] = Field(
+        None, description="density_bins.json of the dataset the tokens must match"
+    )
@@ -0,0 +1,180 @@
+import re
+import csv
+import json
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from source import logging
+from source.preprocess.encode import compute_density_bins, get_density
+from source.preprocess.packing import SEPARATOR_TOKEN, pack_token_files
+
+logger = logging.create_logger("datasetmerger")
+
+SHARD_PATTERN = re.compile(r"shard_(\d+)_of_(\d+)$")
+SEQUENCES_PATTERN = re.compile(r"token_sequences_(train|valid)_(\d+)\.txt$")
+
+
+def find_shard_paths(dataset_path: Path) -> List[Path]:
+    """Finds the shard folders of a dataset and warns if some are missing."""
+    shard_paths = sorted(
+        path
+        for path in Path(dataset_path).iterdir()
+        if path.is_dir() and SHARD_PATTERN.match(path.name)
+    )
+    if shard_paths:
+        num_shards = int(SHARD_PATTERN.match(shard_paths[0].name).group(2))
+        if len(shard_paths) != num_shards:
+            logger.warning(f"Found {len(shard_paths)} of {num_shards} shards.")
+    return shard_paths
+
+
+def merge_density_histograms(shard_paths: List[Path]) -> Tuple[Counter, int]:
+    """Sums the NOTE_ON count histograms saved by every batch of every shard."""
+    histogram = Counter()
+    bins_number = None
+    for shard_path in shard_paths:
+        for density_path in sorted(shard_path.glob("density_bins_*.json")):
+            with open(density_path, "r") as file:
+                density_data = json.load(file)
+            bins_number = density_data["bins_number"]
+            histogram.update(
+                {
+                    int(count): number
+                    for count, number in density_data["histogram"].items()
+                }
+            )
+    return histogram, bins_number
+
+
+def reconcile_density_tokens(tokens: List[str], density_bins: List[float]) -> List[str]:
+    """
+    Rewrites the DENSITY token of every track using new density bins.
+
+    The density of a track is the number of NOTE_ON events in its bars, which
+    are exactly the NOTE_ON tokens between TRACK_START and TRACK_END, so the
+    tokens can be recomputed without encoding the song again.
+
+    Args:
+        tokens: A token sequence.
+        density_bins: The density bins to use.
+
+    Returns:
+        The token sequence with the new DENSITY tokens.
+    """
+    tokens = list(tokens)
+    density_index = None
+    note_on_events = 0
+    for index, token in enumerate(tokens):
+        if token == "TRACK_START":
+            density_index = None
+            note_on_events = 0
+        elif token.startswith("DENSITY="):
+            density_index = index
+        elif token.startswith("NOTE_ON="):
+            note_on_events += 1
+        elif token == "TRACK_END" and density_index is not None:
+            density = get_density(note_on_events, density_bins)
+            tokens[density_index] = f"DENSITY={density}"
+            density_index = None
+    return tokens
+
+
+def get_sequences_paths(shard_path: Path, split: str) -> List[Path]:
+    """Gets the token sequence files of a shard, sorted by iteration."""
+    sequences_paths = []
+    for path in shard_path.iterdir():
+        match = SEQUENCES_PATTERN.match(path.name)
+        if match and match.group(1) == split:
+            sequences_paths.append((int(match.group(2)), path))
+    return [path for _, path in sorted(sequences_paths)]
+
+
+def merge_shards(
+    dataset_path: Path,
+    reconcile_density: bool = True,
+    pack_context_length: Optional[int] = None,
+    separator_token: str = SEPARATOR_TOKEN,
+) -> Dict:
+    """
+    Merges the shards of a dataset without encoding the songs again.
+
+    Writes token_sequences_train.txt and token_sequences_valid.txt with the
+    sequences of all shards, density_bins.json with the bins computed from the
+    NOTE_ON counts of all shards, and index.csv with the lines that every
+    batch file contributed to the merged files. With pack_context_length, the
+    merged sequences are also packed into token_blocks_train.txt and
+    token_blocks_valid.txt.
+
+    Args:
+        dataset_path: Folder of the dataset, containing one folder per shard.
+        reconcile_density: Whether to rewrite the DENSITY tokens with the merged bins.
+        pack_context_length: Optional number of tokens of every packed block.
+        separator_token: The token written after every sequence in packed blocks.
+
+    Returns:
+        A dictionary with the number of shards and of sequences per split, and
+        of blocks per split if they are packed.
+    """
+    dataset_path = Path(dataset_path)
+    shard_paths = find_shard_paths(dataset_path)
+    logger.info(f"Merging {len(shard_paths)} shards")
+
+    # Compute the density bins of the whole dataset
+    histogram, bins_number = merge_density_histograms(shard_paths)
+    density_bins = []
+    if histogram:
+        density_bins = compute_density_bins(list(histogram.elements()), bins_number)
+    with open(dataset_path / "density_bins.json", "w") as file:
+        json.dump(
+            {
+                "bins_number": bins_number,
+                "bins": [float(density_bin) for density_bin in density_bins],
+                "histogram": dict(histogram),
+            },
+            file,
+        )
+    logger.info(f"Density bins of the merged dataset: {density_bins}")
+
+    summary = {"shards": len(shard_paths)}
+    index_rows = []
+    for split in ["train", "valid"]:
+        merged_path = dataset_path / f"token_sequences_{split}.txt"
+        line_number = 0
+        with open(merged_path, "w") as merged_file:
+            for shard_path in shard_paths:
+                for sequences_path in get_sequences_paths(shard_path, split):
+                    first_line = line_number
+                    with open(sequences_path, "r") as sequences_file:
+                        for line in sequences_file:
+                            if reconcile_density and density_bins:
+                                tokens = reconcile_density_tokens(
+                                    line.split(), density_bins
+                                )
+                                line = " ".join(tokens) + "\n"
+                            merged_file.write(line)
+                            line_number += 1
+                    index_rows.append(
+                        [
+                            split,
+                            shard_path.name,
+                            sequences_path.name,
+                            first_line,
+                            line_number - first_line,
+                        ]
+                    )
+        summary[split] = line_number
+        logger.info(f"Wrote {line_number} sequences to {merged_path}")
+        if pack_context_length is not None:
+            blocks_path = dataset_path / f"token_blocks_{split}.txt"
+            summary[f"{split}_blocks"] = pack_token_files(
+                [merged_path], blocks_path, pack_context_length, separator_token
+            )
+            logger.info(f"Packed {summary[f'{split}_blocks']} blocks to {blocks_path}")
+
+    with open(dataset_path / "index.csv", "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["split", "shard", "source", "first_line", "num_lines"])
+        writer.writerows(index_rows)
+
+    return summary
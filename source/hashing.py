@@ -0,0 +1,25 @@
+import hashlib
+
+
+def stable_hash(*parts) -> int:
+    """
+    Hashes the given parts into a 64 bit integer.
+
+    Unlike the built-in hash(), which is salted per process, the result is the
+    same on every machine and in every run, so it can be used for decisions
+    that workers and reruns have to agree on.
+
+    Args:
+        parts: Values to hash. They are converted to strings before hashing.
+
+    Returns:
+        A non-negative integer smaller than 2**64.
+    """
+    key = "\x1f".join(str(part) for part in parts)
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def get_content_hash(data: bytes) -> str:
+    """Hashes the raw bytes of a file into a hex string."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
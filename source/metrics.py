@@ -0,0 +1,184 @@
+import os
+import sys
+import json
+import time
+import cProfile
+import resource
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional
+
+
+def get_peak_rss() -> int:
+    """Gets the peak resident set size of this process and its children, in bytes."""
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    peak_self = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(peak_self, peak_children) * scale
+
+
+def get_rss() -> int:
+    """Gets the resident set size of this process in bytes, or the peak if unknown."""
+    try:
+        with open("/proc/self/statm", "r") as file:
+            pages = int(file.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return get_peak_rss()
+
+
+def reset_peak_rss() -> bool:
+    """Resets the peak resident set size of this process. Only works on Linux."""
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def get_peak_rss_since_reset() -> int:
+    """Gets the peak resident set size since reset_peak_rss, in bytes."""
+    try:
+        with open("/proc/self/status", "r") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return get_rss()
+
+
+class PipelineMetrics:
+    """Records wall time per stage and per file, skipped files and token counts"""
+
+    def __init__(self, profile_file_index: Optional[int] = None) -> None:
+        self.start_time = time.perf_counter()
+        self.stages = defaultdict(lambda: {"seconds": 0.0, "calls": 0})
+        self.files = defaultdict(dict)
+        # Files recorded since the last dump, whose records are appended then
+        self._changed_files = set()
+        self.skipped = Counter()
+        self.tokens = 0
+        # Events counted by name, like windows dropped as duplicates
+        self.counts = Counter()
+        self.profile_file_index = profile_file_index
+        self.profile_song_id = None
+        self.profiler = cProfile.Profile() if profile_file_index is not None else None
+        # Called with (song_id, reason) every time a file is skipped
+        self.skip_callbacks = []
+
+    @contextmanager
+    def stage(self, name: str):
+        """Times a stage of the pipeline."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name]["seconds"] += time.perf_counter() - start
+            self.stages[name]["calls"] += 1
+
+    def record_file(self, song_id: str, stage: str, seconds: float) -> None:
+        """Adds the time one file spent in a stage."""
+        self.files[song_id][stage] = self.files[song_id].get(stage, 0.0) + seconds
+        self._changed_files.add(song_id)
+
+    def record_skip(self, song_id: str, reason: str) -> None:
+        """Records that a file was dropped and why."""
+        self.files[song_id]["skipped"] = reason
+        self._changed_files.add(song_id)
+        self.skipped[reason] += 1
+        for skip_callback in self.skip_callbacks:
+            skip_callback(song_id, reason)
+
+    def add_tokens(self, song_id: str, count: int) -> None:
+        self.files[song_id]["tokens"] = self.files[song_id].get("tokens", 0) + count
+        self._changed_files.add(song_id)
+        self.tokens += count
+
+    def count(self, name: str, count: int = 1) -> None:
+        self.counts[name] += count
+
+    def get_records(self) -> Dict:
+        """The records of files and the counts, to be added to metrics in another process."""
+        return {
+            "files": {song_id: dict(file) for song_id, file in self.files.items()},
+            "counts": dict(self.counts),
+        }
+
+    def add_records(self, records: Dict) -> None:
+        """Adds records returned by get_records, as if they were recorded here."""
+        for song_id, file in records["files"].items():
+            for key, value in file.items():
+                if key == "skipped":
+                    self.record_skip(song_id, value)
+                elif key == "tokens":
+                    self.add_tokens(song_id, value)
+                else:
+                    self.record_file(song_id, key, value)
+        for name, count in records["counts"].items():
+            self.count(name, count)
+
+    def select_profile(self, file_index: int, song_id: str) -> None:
+        """Profiles the song if it is the one requested with profile_file_index."""
+        if file_index == self.profile_file_index:
+            self.profile_song_id = song_id
+
+    @contextmanager
+    def profile(self, song_id: str):
+        """Runs the block under cProfile if the song is the profiled one."""
+        if self.profiler is None or song_id != self.profile_song_id:
+            yield
+            return
+        self.profiler.enable()
+        try:
+            yield
+        finally:
+            self.profiler.disable()
+
+    def summary(self) -> Dict:
+        elapsed = time.perf_counter() - self.start_time
+        loaded = sum(1 for file in self.files.values() if "load" in file)
+        return {
+            "elapsed_seconds": elapsed,
+            "files": len(self.files),
+            "files_per_second": loaded / elapsed if elapsed else None,
+            "tokens": self.tokens,
+            "tokens_per_second": self.tokens / elapsed if elapsed else None,
+            "peak_rss_bytes": get_peak_rss(),
+            "stages": dict(self.stages),
+            "skipped": dict(self.skipped),
+            "counts": dict(self.counts),
+        }
+
+    def dump(
+        self,
+        path: Path,
+        profile_path: Optional[Path] = None,
+        files_path: Optional[Path] = None,
+    ) -> None:
+        """
+        Writes the summary as JSON and, if a song was profiled, its cProfile stats.
+
+        The summary only has totals, so it stays small however many files are
+        processed. The records of single files are appended to files_path as
+        JSON lines, only for the files recorded since the last dump. A file
+        recorded again later gets a new line; the last line of a file wins.
+
+        Args:
+            path: The JSON file of the summary. It is rewritten.
+            profile_path: Optional file for the cProfile stats.
+            files_path: Optional JSON lines file for the records of single files.
+        """
+        with open(path, "w") as file:
+            json.dump(self.summary(), file, indent=2)
+        if files_path is not None:
+            with open(files_path, "a") as file:
+                for song_id in sorted(self._changed_files):
+                    record = {"song_id": song_id, **self.files[song_id]}
+                    file.write(json.dumps(record) + "\n")
+            self._changed_files = set()
+        if profile_path is not None and self.profile_song_id is not None:
+            self.profiler.dump_stats(profile_path)
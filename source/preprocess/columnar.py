@@ -0,0 +1,552 @@
+import sys
+import json
+import time
+import itertools
+import traceback
+from multiprocessing import resource_tracker, shared_memory
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from source.metrics import PipelineMetrics
+from source.preprocess.encode import (
+    fit_counted_windows,
+    get_bar_indices,
+    get_density,
+    get_song_id,
+    get_window_rng,
+)
+
+# Event types of the columnar layout, stored by their index
+EVENT_TYPES = ["NOTE_ON", "NOTE_OFF", "TIME_DELTA"]
+EVENT_TYPE_IDS = {event_type: index for index, event_type in enumerate(EVENT_TYPES)}
+NOTE_ON_ID = EVENT_TYPE_IDS["NOTE_ON"]
+TIME_DELTA_ID = EVENT_TYPE_IDS["TIME_DELTA"]
+# midi_program of drum tracks, which is "DRUMS" in song_data
+DRUMS_PROGRAM = -1
+# The arrays of a song, in the order they are written to a buffer
+COLUMN_TYPES = {
+    "track_programs": np.int16,
+    "track_offsets": np.int64,
+    "bar_offsets": np.int64,
+    "event_types": np.uint8,
+    "event_values": np.int32,
+}
+# Bytes with the length of the JSON metadata at the start of a buffer
+HEADER_BYTES = 8
+ALIGNMENT = 8
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class ColumnarSong:
+    """
+    A preprocessed song stored as flat arrays instead of nested dicts.
+
+    The events of all bars of all tracks are in event_types and event_values,
+    one after the other. Values are pitches for notes and ticks for time
+    deltas. Bar i has the events bar_offsets[i] to bar_offsets[i + 1] and
+    track t has the bars track_offsets[t] to track_offsets[t + 1]. Everything
+    else, like the title and the meter, is in metadata.
+
+    The arrays can be written to a buffer, e.g. a shared memory block, and
+    read back without copying them.
+    """
+
+    def __init__(self, metadata: Dict, columns: Dict[str, np.ndarray]) -> None:
+        self.metadata = metadata
+        self.columns = columns
+
+    @classmethod
+    def from_song_data(cls, song_data: Dict) -> "ColumnarSong":
+        """Lays out a song as returned by preprocess_music21_song."""
+        metadata = {key: value for key, value in song_data.items() if key != "tracks"}
+        metadata["tracks"] = []
+        track_programs = []
+        track_offsets = [0]
+        bar_offsets = [0]
+        event_types = []
+        event_values = []
+        for track_data in song_data["tracks"]:
+            metadata["tracks"].append(
+                {
+                    key: value
+                    for key, value in track_data.items()
+                    if key not in ("midi_program", "bars")
+                }
+            )
+            program = track_data["midi_program"]
+            track_programs.append(DRUMS_PROGRAM if program == "DRUMS" else program)
+            for bar_data in track_data["bars"]:
+                for event in bar_data["events"]:
+                    event_type = EVENT_TYPE_IDS[event["type"]]
+                    event_types.append(event_type)
+                    if event_type == TIME_DELTA_ID:
+                        event_values.append(event["delta"])
+                    else:
+                        event_values.append(event["pitch"])
+                bar_offsets.append(len(event_types))
+            track_offsets.append(len(bar_offsets) - 1)
+
+        columns = {
+            "track_programs": track_programs,
+            "track_offsets": track_offsets,
+            "bar_offsets": bar_offsets,
+            "event_types": event_types,
+            "event_values": event_values,
+        }
+        return cls(
+            metadata,
+            {
+                name: np.array(columns[name], dtype=dtype)
+                for name, dtype in COLUMN_TYPES.items()
+            },
+        )
+
+    def to_song_data(self) -> Dict:
+        """Builds the nested dicts the rest of the pipeline works with."""
+        return self.get_window_song_data(0, len(self.columns["bar_offsets"]))
+
+    def get_window_song_data(self, bar_start_index: int, bar_end_index: int) -> Dict:
+        """Builds the nested dicts of a song that only has the bars of a window."""
+        event_types = self.columns["event_types"].tolist()
+        event_values = self.columns["event_values"].tolist()
+        bar_offsets = self.columns["bar_offsets"].tolist()
+        track_offsets = self.columns["track_offsets"].tolist()
+
+        song_data = dict(self.metadata)
+        song_data["tracks"] = []
+        for track_index, program in enumerate(self.columns["track_programs"].tolist()):
+            track_data = dict(self.metadata["tracks"][track_index])
+            track_data["midi_program"] = (
+                "DRUMS" if program == DRUMS_PROGRAM else program
+            )
+            first_bar, end_bar = track_offsets[track_index : track_index + 2]
+            track_data["bars"] = [
+                {
+                    "events": [
+                        (
+                            {"type": "TIME_DELTA", "delta": event_values[index]}
+                            if event_types[index] == TIME_DELTA_ID
+                            else {
+                                "type": EVENT_TYPES[event_types[index]],
+                                "pitch": event_values[index],
+                            }
+                        )
+                        for index in range(bar_offsets[bar], bar_offsets[bar + 1])
+                    ]
+                }
+                for bar in range(
+                    min(first_bar + bar_start_index, end_bar),
+                    min(first_bar + bar_end_index, end_bar),
+                )
+            ]
+            song_data["tracks"].append(track_data)
+        return song_data
+
+    def get_bars_number(self) -> int:
+        """The bars of the longest track, like get_bars_number of song_data."""
+        return int(np.diff(self.columns["track_offsets"]).max())
+
+    def get_bar_events(
+        self, track_index: int, bar_index: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Gets views of the types and values of the events of a bar of a track."""
+        bar = self.columns["track_offsets"][track_index] + bar_index
+        start, end = self.columns["bar_offsets"][bar : bar + 2]
+        return (
+            self.columns["event_types"][start:end],
+            self.columns["event_values"][start:end],
+        )
+
+    def _get_layout(self) -> Tuple[bytes, Dict[str, int], int]:
+        header = json.dumps(
+            {
+                "metadata": self.metadata,
+                "lengths": {name: len(self.columns[name]) for name in COLUMN_TYPES},
+            }
+        ).encode("utf-8")
+        offsets = {}
+        offset = _align(HEADER_BYTES + len(header))
+        for name in COLUMN_TYPES:
+            offsets[name] = offset
+            offset = _align(offset + self.columns[name].nbytes)
+        return header, offsets, offset
+
+    @property
+    def nbytes(self) -> int:
+        """The size of the buffer the song is written to."""
+        return self._get_layout()[2]
+
+    def write(self, buffer: memoryview) -> int:
+        """Writes the song to a buffer of at least nbytes bytes. Returns nbytes."""
+        header, offsets, nbytes = self._get_layout()
+        buffer[:HEADER_BYTES] = len(header).to_bytes(HEADER_BYTES, "little")
+        buffer[HEADER_BYTES : HEADER_BYTES + len(header)] = header
+        for name, dtype in COLUMN_TYPES.items():
+            column = self.columns[name]
+            target = np.ndarray(
+                column.shape, dtype=dtype, buffer=buffer, offset=offsets[name]
+            )
+            target[:] = column
+        return nbytes
+
+    @classmethod
+    def from_buffer(cls, buffer: memoryview) -> Tuple["ColumnarSong", int]:
+        """
+        Reads a song written with write. The arrays are views of the buffer,
+        not copies, so the buffer must stay open while the song is used.
+
+        Returns:
+            The song and the number of bytes it takes in the buffer.
+        """
+        header_length = int.from_bytes(buffer[:HEADER_BYTES], "little")
+        header = json.loads(bytes(buffer[HEADER_BYTES : HEADER_BYTES + header_length]))
+        offset = _align(HEADER_BYTES + header_length)
+        columns = {}
+        for name, dtype in COLUMN_TYPES.items():
+            length = header["lengths"][name]
+            columns[name] = np.ndarray(
+                (length,), dtype=dtype, buffer=buffer, offset=offset
+            )
+            offset = _align(offset + columns[name].nbytes)
+        return cls(header["metadata"], columns), offset
+
+    def release(self) -> None:
+        """Drops the arrays, so the buffer they view can be closed."""
+        self.columns = {}
+
+
+def share_songs(songs_data: List[Dict]) -> shared_memory.SharedMemory:
+    """
+    Writes songs to a new shared memory block. Pass the name of the block to
+    another process and read it there with read_shared_songs.
+
+    All songs go to one block, so a batch costs one block however many songs
+    it has. The caller owns the block: close it and unlink it when every
+    process is done with the songs.
+
+    Args:
+        songs_data: Songs as returned by preprocess_music21_song.
+
+    Returns:
+        The shared memory block.
+    """
+    columnar_songs = [
+        ColumnarSong.from_song_data(song_data) for song_data in songs_data
+    ]
+    size = HEADER_BYTES + sum(columnar_song.nbytes for columnar_song in columnar_songs)
+    block = shared_memory.SharedMemory(create=True, size=size)
+    block.buf[:HEADER_BYTES] = len(columnar_songs).to_bytes(HEADER_BYTES, "little")
+    offset = HEADER_BYTES
+    for columnar_song in columnar_songs:
+        offset += columnar_song.write(block.buf[offset:])
+    return block
+
+
+def _attach_block(name: str) -> shared_memory.SharedMemory:
+    """
+    Opens a block created by another process without registering it with the
+    resource tracker, which would unlink it, or warn that it leaked, when
+    this process exits. The process that created the block owns it.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    # Older versions always register. Only the registration of this block is
+    # skipped, since unregistering would also drop the one of its creator
+    # when both share a tracker
+    register = resource_tracker.register
+
+    def register_others(resource_name: str, resource_type: str) -> None:
+        if resource_type == "shared_memory" and resource_name.lstrip("/") == (
+            name.lstrip("/")
+        ):
+            return
+        register(resource_name, resource_type)
+
+    resource_tracker.register = register_others
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+def read_shared_songs(name: str, function: Callable[[List[ColumnarSong]], object]):
+    """
+    Calls a function with the songs written by share_songs, without copying them.
+
+    The arrays of the songs view the shared memory and are released when the
+    function returns, so they can not keep the block from closing. The
+    function must return data of its own, e.g. to_song_data or tokens, not
+    the arrays.
+
+    Args:
+        name: The name of the shared memory block.
+        function: Called with the songs.
+
+    Returns:
+        What the function returns.
+    """
+    block = _attach_block(name)
+    columnar_songs = []
+    try:
+        offset = HEADER_BYTES
+        for _ in range(int.from_bytes(block.buf[:HEADER_BYTES], "little")):
+            columnar_song, nbytes = ColumnarSong.from_buffer(block.buf[offset:])
+            columnar_songs.append(columnar_song)
+            offset += nbytes
+        return function(columnar_songs)
+    except BaseException as error:
+        # The frames of the traceback would keep views of the block alive
+        traceback.clear_frames(error.__traceback__)
+        raise
+    finally:
+        for columnar_song in columnar_songs:
+            columnar_song.release()
+        block.close()
+
+
+def get_columnar_density_distribution(
+    columnar_songs: List[ColumnarSong], window_size_bars: int, hop_length_bars: int
+) -> List[int]:
+    """Like get_density_distribution, reading the arrays of the songs."""
+    distribution = []
+    for columnar_song in columnar_songs:
+        bar_indices = get_bar_indices(
+            columnar_song.get_bars_number(), window_size_bars, hop_length_bars
+        )
+        note_ons = _get_note_on_counts(columnar_song)
+        track_offsets = columnar_song.columns["track_offsets"].tolist()
+        for first_bar, end_bar in zip(track_offsets, track_offsets[1:]):
+            for bar_start_index, bar_end_index in bar_indices:
+                # Do not count empty tracks
+                count = sum(
+                    note_ons[
+                        min(first_bar + bar_start_index, end_bar) : min(
+                            first_bar + bar_end_index, end_bar
+                        )
+                    ]
+                )
+                if count != 0:
+                    distribution += [count]
+    return distribution
+
+
+def _get_note_on_counts(columnar_song: ColumnarSong) -> List[int]:
+    """The NOTE_ON events of every bar of the song."""
+    columns = columnar_song.columns
+    note_ons = np.concatenate(
+        ([0], np.cumsum(columns["event_types"] == NOTE_ON_ID, dtype=np.int64))
+    )
+    return np.diff(note_ons[columns["bar_offsets"]]).tolist()
+
+
+def encode_columnar_songs(
+    columnar_songs: List[ColumnarSong],
+    transpositions,
+    permute,
+    window_size_bars,
+    hop_length_bars,
+    density_bins,
+    bar_fill,
+    seed=None,
+    metrics=None,
+    window_deduplicator=None,
+    max_tokens=None,
+    over_length="skip",
+    sequence_windows=None,
+) -> List[List[str]]:
+    """
+    Like encode_songs_data, reading the arrays of the songs instead of dicts.
+    The token sequences are the same.
+    """
+    if metrics is None:
+        metrics = PipelineMetrics()
+
+    token_sequences = []
+    for columnar_song in columnar_songs:
+        song_id = get_song_id(columnar_song.metadata)
+        start = time.perf_counter()
+        song_windows = [] if sequence_windows is not None else None
+        with metrics.profile(song_id):
+            song_token_sequences = encode_columnar_song(
+                columnar_song,
+                transpositions,
+                permute,
+                window_size_bars,
+                hop_length_bars,
+                density_bins,
+                bar_fill,
+                seed,
+                window_deduplicator,
+                max_tokens,
+                over_length,
+                metrics,
+                song_windows,
+            )
+        if sequence_windows is not None:
+            sequence_windows += [(song_id, *window) for window in song_windows]
+        metrics.record_file(song_id, "encode", time.perf_counter() - start)
+        metrics.add_tokens(
+            song_id, sum(len(token_sequence) for token_sequence in song_token_sequences)
+        )
+        token_sequences += song_token_sequences
+    return token_sequences
+
+
+def encode_columnar_song(
+    columnar_song: ColumnarSong,
+    transpositions,
+    permute,
+    window_size_bars,
+    hop_length_bars,
+    density_bins,
+    bar_fill,
+    seed=None,
+    window_deduplicator=None,
+    max_tokens=None,
+    over_length="skip",
+    metrics=None,
+    sequence_windows=None,
+) -> List[List[str]]:
+    """Like encode_song_data, reading the arrays of the song instead of dicts."""
+    metadata = columnar_song.metadata
+    columns = columnar_song.columns
+    track_offsets = columns["track_offsets"].tolist()
+    bar_offsets = columns["bar_offsets"].tolist()
+    programs = columns["track_programs"].tolist()
+    num_tracks = len(programs)
+
+    bar_indices = get_bar_indices(
+        columnar_song.get_bars_number(), window_size_bars, hop_length_bars
+    )
+
+    # Drop repeated windows with all their transpositions, with the same
+    # fingerprints as the dicts
+    if window_deduplicator is not None:
+        bar_indices = [
+            (bar_start_index, bar_end_index)
+            for bar_start_index, bar_end_index in bar_indices
+            if window_deduplicator.check_window(
+                columnar_song.get_window_song_data(bar_start_index, bar_end_index),
+                0,
+                bar_end_index - bar_start_index,
+            )
+        ]
+
+    all_track_indices = list(range(num_tracks))
+    windows = [
+        (bar_start_index, bar_end_index, all_track_indices)
+        for bar_start_index, bar_end_index in bar_indices
+    ]
+    if max_tokens is not None:
+        # BAR_START, the events and BAR_END
+        track_bar_token_counts = [
+            [
+                bar_offsets[bar + 1] - bar_offsets[bar] + 2
+                for bar in range(first_bar, end_bar)
+            ]
+            for first_bar, end_bar in zip(track_offsets, track_offsets[1:])
+        ]
+        windows = fit_counted_windows(
+            track_bar_token_counts, windows, max_tokens, over_length, bar_fill, metrics
+        )
+
+    event_types = columns["event_types"].tolist()
+    event_values = columns["event_values"].tolist()
+    note_ons = _get_note_on_counts(columnar_song)
+    # The tokens of every event, built once per transposition
+    event_tokens = {}
+
+    def get_event_tokens(transposition):
+        if transposition not in event_tokens:
+            event_tokens[transposition] = [
+                (
+                    f"TIME_DELTA={value}"
+                    if event_type == TIME_DELTA_ID
+                    else f"{EVENT_TYPES[event_type]}={value + transposition}"
+                )
+                for event_type, value in zip(event_types, event_values)
+            ]
+        return event_tokens[transposition]
+
+    def get_track_bars(track_index, bar_start_index, bar_end_index):
+        first_bar, end_bar = track_offsets[track_index : track_index + 2]
+        return range(
+            min(first_bar + bar_start_index, end_bar),
+            min(first_bar + bar_end_index, end_bar),
+        )
+
+    # Bars moved to a fill. Like the dicts, which bar fill changes in place,
+    # they stay filled in the later windows of the song
+    filled_bars = set()
+    token_sequences = []
+    for window, transposition in itertools.product(windows, transpositions):
+        bar_start_index, bar_end_index, track_indices = window
+
+        # Random choices only depend on the song, the window and the transposition
+        rng = get_window_rng(seed, metadata, bar_start_index, transposition)
+
+        if bar_fill:
+            track_index = rng.choice(track_indices)
+            bar = rng.choice(
+                get_track_bars(track_index, bar_start_index, bar_end_index)
+            )
+            fill_tokens = ["FILL_START"]
+            if bar in filled_bars:
+                fill_tokens += ["FILL_IN"]
+            else:
+                tokens = get_event_tokens(transposition)
+                fill_tokens += tokens[bar_offsets[bar] : bar_offsets[bar + 1]]
+            fill_tokens += ["FILL_END"]
+            filled_bars.add(bar)
+
+        token_sequence = [
+            "PIECE_START",
+            f"TIME_SIGNATURE={metadata['time_signature_numerator']}"
+            f"_{metadata['time_signature_denominator']}",
+            f"GENRE={metadata['genre']}",
+        ]
+
+        track_data_indices = list(track_indices)
+        if permute:
+            rng.shuffle(track_data_indices)
+
+        for track_index in track_data_indices:
+            token_sequence += ["TRACK_START"]
+            track_transposition = transposition
+            if not metadata["tracks"][track_index].get("drums", False):
+                program = programs[track_index]
+                number = "DRUMS" if program == DRUMS_PROGRAM else program
+                token_sequence += [f"INST={number}"]
+            else:
+                # Drums are not transposed
+                token_sequence += ["INST=DRUMS"]
+                track_transposition = 0
+
+            bars = get_track_bars(track_index, bar_start_index, bar_end_index)
+            note_on_events = sum(
+                note_ons[bar] for bar in bars if bar not in filled_bars
+            )
+            token_sequence += [f"DENSITY={get_density(note_on_events, density_bins)}"]
+
+            tokens = get_event_tokens(track_transposition)
+            for bar in bars:
+                token_sequence += ["BAR_START"]
+                if bar in filled_bars:
+                    token_sequence += ["FILL_IN"]
+                else:
+                    token_sequence += tokens[bar_offsets[bar] : bar_offsets[bar + 1]]
+                token_sequence += ["BAR_END"]
+            token_sequence += ["TRACK_END"]
+
+        if bar_fill:
+            token_sequence += fill_tokens
+
+        token_sequences += [token_sequence]
+        if sequence_windows is not None:
+            sequence_windows += [(bar_start_index, bar_end_index, transposition)]
+
+    return token_sequences
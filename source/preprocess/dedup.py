@@ -0,0 +1,254 @@
+import os
+import json
+import math
+import hashlib
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from source.hashing import get_content_hash
+from source.metrics import PipelineMetrics
+
+# Reasons recorded when a duplicate is skipped
+DUPLICATE_FILE = "duplicate_file"
+DUPLICATE_NOTES = "duplicate_notes"
+# Counted in the metrics for every window dropped as a repeat
+DUPLICATE_WINDOWS = "duplicate_windows"
+
+
+def get_note_fingerprint(song_data: Dict) -> str:
+    """
+    Hashes the musical content of a preprocessed song.
+
+    The title, the track names and the track order are left out, so two files
+    with the same notes get the same fingerprint even if their tracks were
+    named or ordered differently.
+    """
+    tracks = sorted(
+        json.dumps([track["midi_program"], track["bars"]], sort_keys=True)
+        for track in song_data["tracks"]
+    )
+    content = [
+        song_data.get("time_signature_numerator"),
+        song_data.get("time_signature_denominator"),
+        tracks,
+    ]
+    return get_content_hash(json.dumps(content).encode("utf-8"))
+
+
+class Deduplicator:
+    """
+    Remembers the files and songs already seen, so duplicates are skipped
+    before they are parsed or encoded.
+
+    Files are first compared by the hash of their bytes and, after
+    preprocessing, by a fingerprint of their notes. Every duplicate is linked
+    to the first song with the same content.
+    """
+
+    def __init__(self, dedup_path: Optional[Path] = None) -> None:
+        self.dedup_path = Path(dedup_path) if dedup_path is not None else None
+        self.file_hashes = {}
+        self.note_fingerprints = {}
+        self.duplicates = {}
+        # Tokens of the songs that have duplicates, kept across runs
+        self.original_tokens = {}
+        if self.dedup_path is not None and self.dedup_path.exists():
+            with open(self.dedup_path, "r") as file:
+                state = json.load(file)
+            self.file_hashes = state["file_hashes"]
+            self.note_fingerprints = state["note_fingerprints"]
+            self.duplicates = state["duplicates"]
+            self.original_tokens = state["original_tokens"]
+
+    def _check(self, seen: Dict, key: str, song_id: str, reason: str) -> Optional[str]:
+        original = seen.setdefault(key, song_id)
+        # A song seen again, e.g. after a resume, is not its own duplicate
+        if original == song_id:
+            return None
+        self.duplicates[song_id] = {"original": original, "reason": reason}
+        return original
+
+    def check_file(self, song_id: str, content_hash: str) -> Optional[str]:
+        """
+        Checks if a file has the same bytes as a file seen before.
+
+        Args:
+            song_id: The id of the song.
+            content_hash: The hash of the bytes of the file.
+
+        Returns:
+            The song id of the first file with these bytes, or None.
+        """
+        return self._check(self.file_hashes, content_hash, song_id, DUPLICATE_FILE)
+
+    def check_notes(self, song_id: str, song_data: Dict) -> Optional[str]:
+        """Like check_file, comparing the notes of a preprocessed song."""
+        return self._check(
+            self.note_fingerprints,
+            get_note_fingerprint(song_data),
+            song_id,
+            DUPLICATE_NOTES,
+        )
+
+    def filter_songs_data(
+        self, songs_data: List[Dict], metrics: PipelineMetrics
+    ) -> List[Dict]:
+        """Drops the songs with the notes of a song seen before."""
+        unique_songs_data = []
+        for song_data in songs_data:
+            song_id = song_data.get("song_id", song_data["title"])
+            if self.check_notes(song_id, song_data) is not None:
+                metrics.record_skip(song_id, DUPLICATE_NOTES)
+                continue
+            unique_songs_data.append(song_data)
+        return unique_songs_data
+
+    def summary(self, metrics: Optional[PipelineMetrics] = None) -> Dict:
+        """
+        Counts the duplicates and the tokens they would have added.
+
+        Args:
+            metrics: The metrics with the tokens of every encoded song.
+
+        Returns:
+            The number of duplicates by reason and the tokens saved.
+        """
+        if metrics is not None:
+            for duplicate in self.duplicates.values():
+                file_metrics = metrics.files.get(duplicate["original"], {})
+                if "tokens" in file_metrics:
+                    self.original_tokens[duplicate["original"]] = file_metrics["tokens"]
+        files = {}
+        tokens = 0
+        for duplicate in self.duplicates.values():
+            reason = duplicate["reason"]
+            files[reason] = files.get(reason, 0) + 1
+            tokens += self.original_tokens.get(duplicate["original"], 0)
+        return {"files_saved": files, "tokens_saved": tokens}
+
+    def save(self, metrics: Optional[PipelineMetrics] = None) -> None:
+        """Writes the seen content, the links and the summary, atomically."""
+        if self.dedup_path is None:
+            return
+        self.dedup_path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = self.dedup_path.with_suffix(".tmp")
+        with open(temporary_path, "w") as file:
+            json.dump(
+                {
+                    "summary": self.summary(metrics),
+                    "duplicates": self.duplicates,
+                    "file_hashes": self.file_hashes,
+                    "note_fingerprints": self.note_fingerprints,
+                    "original_tokens": self.original_tokens,
+                },
+                file,
+                indent=2,
+            )
+        os.replace(temporary_path, self.dedup_path)
+
+
+def get_window_fingerprint(
+    song_data: Dict, bar_start_index: int, bar_end_index: int
+) -> bytes:
+    """
+    Hashes the content of one window of a preprocessed song, before it is
+    transposed or its tracks are permuted.
+
+    The tracks are sorted, so the fingerprint does not depend on their order.
+    """
+    tracks = sorted(
+        json.dumps(
+            [
+                track["midi_program"],
+                track.get("drums", False),
+                track["bars"][bar_start_index:bar_end_index],
+            ],
+            sort_keys=True,
+        )
+        for track in song_data["tracks"]
+    )
+    content = [
+        song_data.get("time_signature_numerator"),
+        song_data.get("time_signature_denominator"),
+        song_data.get("genre"),
+        tracks,
+    ]
+    return hashlib.blake2b(json.dumps(content).encode("utf-8"), digest_size=16).digest()
+
+
+class BloomFilter:
+    """
+    Set of fingerprints in a fixed amount of memory.
+
+    Membership tests may be wrong for new fingerprints, with about the given
+    error rate once capacity fingerprints were added, but never for
+    fingerprints added before.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001) -> None:
+        self.num_bits = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.num_hashes = max(round(self.num_bits / capacity * math.log(2)), 1)
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def _get_positions(self, fingerprint: bytes) -> List[int]:
+        # Double hashing with the two halves of the fingerprint
+        first = int.from_bytes(fingerprint[:8], "big")
+        second = int.from_bytes(fingerprint[8:16], "big") | 1
+        return [
+            (first + index * second) % self.num_bits for index in range(self.num_hashes)
+        ]
+
+    def add(self, fingerprint: bytes) -> bool:
+        """
+        Adds a fingerprint of at least 16 bytes.
+
+        Returns:
+            True if the fingerprint was not in the filter before.
+        """
+        added = False
+        for position in self._get_positions(fingerprint):
+            byte_index, bit = divmod(position, 8)
+            if not self.bits[byte_index] & (1 << bit):
+                self.bits[byte_index] |= 1 << bit
+                added = True
+        return added
+
+
+class WindowDeduplicator:
+    """
+    Drops the windows whose content was already encoded, with every
+    transposition of them.
+
+    Windows are remembered in a Bloom filter, so memory stays fixed however
+    many windows are written. A few unique windows, about error_rate of them,
+    are dropped as well.
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        error_rate: float = 0.001,
+        metrics: Optional[PipelineMetrics] = None,
+    ) -> None:
+        self.seen_windows = BloomFilter(capacity, error_rate)
+        self.metrics = metrics if metrics is not None else PipelineMetrics()
+
+    def check_window(
+        self, song_data: Dict, bar_start_index: int, bar_end_index: int
+    ) -> bool:
+        """
+        Checks if a window is new and remembers it.
+
+        Args:
+            song_data: The preprocessed song.
+            bar_start_index: The first bar of the window.
+            bar_end_index: The bar after the last bar of the window.
+
+        Returns:
+            True if the window should be encoded.
+        """
+        fingerprint = get_window_fingerprint(song_data, bar_start_index, bar_end_index)
+        if self.seen_windows.add(fingerprint):
+            return True
+        self.metrics.count(DUPLICATE_WINDOWS)
+        return False
@@ -14,12 +14,29 @@
 # limitations under the License.
 
 # Lint as: python3
-import numpy as np
 import itertools
 import random
+import time
+
+from source.hashing import stable_hash
+from source.metrics import PipelineMetrics
+
+# What to do with a window that would have more than max_tokens tokens
+OVER_LENGTH_ACTIONS = ("skip", "drop_tracks", "shrink")
+# Counted in the metrics for every window that was too long
+SKIPPED_WINDOWS = "over_length_skipped_windows"
+DROPPED_TRACKS = "over_length_dropped_tracks"
+SHRUNK_WINDOWS = "over_length_shrunk_windows"
 
 
 def get_density_bins(songs_data, window_size_bars, hop_length_bars, bins):
+    distribution = get_density_distribution(
+        songs_data, window_size_bars, hop_length_bars
+    )
+    return compute_density_bins(distribution, bins)
+
+
+def get_density_distribution(songs_data, window_size_bars, hop_length_bars):
     # Go through all songs and count the NOTE_ON events for each
     # window_size_bars
     distribution = []
@@ -41,6 +58,17 @@ def get_density_bins(songs_data, window_size_bars, hop_length_bars, bins):
                 if count != 0:
                     distribution += [count]
 
+    return distribution
+
+
+def compute_density_bins(distribution, bins):
+    # Without notes there is nothing to bin. Every track gets density 0
+    if len(distribution) == 0:
+        return []
+
+    # numpy is imported when it is needed, so the command line starts quickly
+    import numpy as np
+
     # Comput the quantiles, which will become the density bins
     quantiles = []
     for i in range(100 // bins, 100, 100 // bins):
@@ -50,6 +78,12 @@ def get_density_bins(songs_data, window_size_bars, hop_length_bars, bins):
     return quantiles
 
 
+def get_density(note_on_events, density_bins):
+    import numpy as np
+
+    return np.digitize(note_on_events, density_bins)
+
+
 def get_bars_number(song_data):
     bars = [len(track_data["bars"]) for track_data in song_data["tracks"]]
     bars = max(bars)
@@ -86,21 +120,48 @@ def encode_songs_data(
     hop_length_bars,
     density_bins,
     bar_fill,
+    seed=None,
+    metrics=None,
+    window_deduplicator=None,
+    max_tokens=None,
+    over_length="skip",
+    sequence_windows=None,
 ):
+    if metrics is None:
+        metrics = PipelineMetrics()
+
     # This will be returned
     token_sequences = []
 
     # Go through all songs
     for song_data in songs_data:
-        token_sequences += encode_song_data(
-            song_data,
-            transpositions,
-            permute,
-            window_size_bars,
-            hop_length_bars,
-            density_bins,
-            bar_fill,
+        song_id = get_song_id(song_data)
+        start = time.perf_counter()
+        # The windows of the song. Added to sequence_windows with the song id
+        song_windows = [] if sequence_windows is not None else None
+        with metrics.profile(song_id):
+            song_token_sequences = encode_song_data(
+                song_data,
+                transpositions,
+                permute,
+                window_size_bars,
+                hop_length_bars,
+                density_bins,
+                bar_fill,
+                seed,
+                window_deduplicator,
+                max_tokens,
+                over_length,
+                metrics,
+                song_windows,
+            )
+        if sequence_windows is not None:
+            sequence_windows += [(song_id, *window) for window in song_windows]
+        metrics.record_file(song_id, "encode", time.perf_counter() - start)
+        metrics.add_tokens(
+            song_id, sum(len(token_sequence) for token_sequence in song_token_sequences)
         )
+        token_sequences += song_token_sequences
 
     return token_sequences
 
@@ -113,6 +174,12 @@ def encode_song_data(
     hop_length_bars,
     density_bins,
     bar_fill,
+    seed=None,
+    window_deduplicator=None,
+    max_tokens=None,
+    over_length="skip",
+    metrics=None,
+    sequence_windows=None,
 ):
     # This will be returned
     token_sequences = []
@@ -123,18 +190,45 @@ def encode_song_data(
     # For iterating over the bars
     bar_indices = get_bar_indices(bars, window_size_bars, hop_length_bars)
 
+    # Drop repeated windows with all their transpositions. Checked before bar
+    # fill changes the bars
+    if window_deduplicator is not None:
+        bar_indices = [
+            (bar_start_index, bar_end_index)
+            for bar_start_index, bar_end_index in bar_indices
+            if window_deduplicator.check_window(
+                song_data, bar_start_index, bar_end_index
+            )
+        ]
+
+    # Every window keeps all its tracks unless it is too long
+    all_track_indices = list(range(len(song_data["tracks"])))
+    windows = [
+        (bar_start_index, bar_end_index, all_track_indices)
+        for bar_start_index, bar_end_index in bar_indices
+    ]
+    if max_tokens is not None:
+        windows = fit_windows(
+            song_data, windows, max_tokens, over_length, bar_fill, metrics
+        )
+
     # Go through all combinations
     count = 0
-    for (bar_start_index, bar_end_index), transposition in itertools.product(
-        bar_indices, transpositions
-    ):
+    for window, transposition in itertools.product(windows, transpositions):
+        bar_start_index, bar_end_index, track_indices = window
+
         # Start empty
         token_sequence = []
 
+        # Random choices only depend on the song, the window and the transposition
+        rng = get_window_rng(seed, song_data, bar_start_index, transposition)
+
         # Do bar fill if necessary
         if bar_fill:
-            track_data = random.choice(song_data["tracks"])
-            bar_data = random.choice(track_data["bars"][bar_start_index:bar_end_index])
+            track_data = rng.choice(
+                [song_data["tracks"][index] for index in track_indices]
+            )
+            bar_data = rng.choice(track_data["bars"][bar_start_index:bar_end_index])
             bar_data_fill = {"events": bar_data["events"]}
             bar_data["events"] = "bar_fill"
 
@@ -149,9 +243,9 @@ def encode_song_data(
         token_sequence += ["GENRE=" + str(song_data["genre"])]
 
         # Get the indices. Permute if necessary
-        track_data_indices = list(range(len(song_data["tracks"])))
+        track_data_indices = list(track_indices)
         if permute:
-            random.shuffle(track_data_indices)
+            rng.shuffle(track_data_indices)
 
         # Encode the tracks
         for track_data_index in track_data_indices:
@@ -170,12 +264,184 @@ def encode_song_data(
             )
 
         token_sequences += [token_sequence]
+        if sequence_windows is not None:
+            sequence_windows += [(bar_start_index, bar_end_index, transposition)]
         count += 1
 
     # Done
     return token_sequences
 
 
+def get_bar_token_count(bar_data):
+    # BAR_START, the events and BAR_END. A filled bar only has FILL_IN
+    if bar_data["events"] == "bar_fill":
+        return 3
+    return len(bar_data["events"]) + 2
+
+
+def get_window_token_count(
+    track_bar_token_counts, bar_start_index, bar_end_index, track_indices, bar_fill
+):
+    """
+    Counts the tokens of a window from the number of events of its bars,
+    without encoding it.
+
+    Args:
+        track_bar_token_counts: The tokens of every bar of every track.
+        bar_start_index: The first bar of the window.
+        bar_end_index: The bar after the last bar of the window.
+        track_indices: The tracks of the window.
+        bar_fill: Whether a bar is moved to the end as a fill.
+
+    Returns:
+        The number of tokens of the encoded window.
+    """
+    # PIECE_START, TIME_SIGNATURE and GENRE
+    count = 3
+    for track_index in track_indices:
+        # TRACK_START, INST, DENSITY and TRACK_END
+        count += 4
+        count += sum(track_bar_token_counts[track_index][bar_start_index:bar_end_index])
+    # The filled bar becomes FILL_IN and its events go between FILL_START and FILL_END
+    if bar_fill:
+        count += 3
+    return count
+
+
+def fit_windows(song_data, windows, max_tokens, over_length, bar_fill, metrics=None):
+    """
+    Makes the windows of a song fit in max_tokens tokens, before they are encoded.
+
+    A window that is too long is skipped, loses its longest tracks until it
+    fits, or loses bars from its end until it fits, depending on over_length.
+    Windows that can not be made to fit are skipped.
+
+    Args:
+        song_data: The song being encoded.
+        windows: Tuples with the first bar, the bar after the last bar and the
+            tracks of every window.
+        max_tokens: The most tokens a window may have.
+        over_length: One of OVER_LENGTH_ACTIONS.
+        bar_fill: Whether a bar is moved to the end as a fill.
+        metrics: The metrics that count the windows that were too long.
+
+    Returns:
+        The windows that fit, in the same format.
+    """
+    track_bar_token_counts = [
+        [get_bar_token_count(bar_data) for bar_data in track_data["bars"]]
+        for track_data in song_data["tracks"]
+    ]
+    return fit_counted_windows(
+        track_bar_token_counts, windows, max_tokens, over_length, bar_fill, metrics
+    )
+
+
+def fit_counted_windows(
+    track_bar_token_counts, windows, max_tokens, over_length, bar_fill, metrics=None
+):
+    """
+    Like fit_windows, from the tokens of every bar of every track.
+
+    Args:
+        track_bar_token_counts: The tokens of every bar of every track.
+        windows: Tuples with the first bar, the bar after the last bar and the
+            tracks of every window.
+        max_tokens: The most tokens a window may have.
+        over_length: One of OVER_LENGTH_ACTIONS.
+        bar_fill: Whether a bar is moved to the end as a fill.
+        metrics: The metrics that count the windows that were too long.
+
+    Returns:
+        The windows that fit, in the same format.
+    """
+    if over_length not in OVER_LENGTH_ACTIONS:
+        raise ValueError(f"Unexpected over_length {over_length}")
+    if metrics is None:
+        metrics = PipelineMetrics()
+
+    def count_tokens(bar_start_index, bar_end_index, track_indices):
+        return get_window_token_count(
+            track_bar_token_counts,
+            bar_start_index,
+            bar_end_index,
+            track_indices,
+            bar_fill,
+        )
+
+    fitting_windows = []
+    for bar_start_index, bar_end_index, track_indices in windows:
+        if count_tokens(bar_start_index, bar_end_index, track_indices) <= max_tokens:
+            fitting_windows.append((bar_start_index, bar_end_index, track_indices))
+            continue
+
+        if over_length == "drop_tracks":
+            # Drop the longest tracks first, so most tracks are kept
+            track_indices = sorted(
+                track_indices,
+                key=lambda index: sum(
+                    track_bar_token_counts[index][bar_start_index:bar_end_index]
+                ),
+            )
+            dropped = 0
+            while track_indices and (
+                count_tokens(bar_start_index, bar_end_index, track_indices) > max_tokens
+            ):
+                track_indices = track_indices[:-1]
+                dropped += 1
+            if track_indices:
+                metrics.count(DROPPED_TRACKS, dropped)
+                fitting_windows.append(
+                    (bar_start_index, bar_end_index, sorted(track_indices))
+                )
+                continue
+
+        elif over_length == "shrink":
+            while bar_end_index - bar_start_index > 1 and (
+                count_tokens(bar_start_index, bar_end_index, track_indices) > max_tokens
+            ):
+                bar_end_index -= 1
+            if (
+                count_tokens(bar_start_index, bar_end_index, track_indices)
+                <= max_tokens
+            ):
+                metrics.count(SHRUNK_WINDOWS)
+                fitting_windows.append((bar_start_index, bar_end_index, track_indices))
+                continue
+
+        metrics.count(SKIPPED_WINDOWS)
+    return fitting_windows
+
+
+def get_song_id(song_data):
+    # Songs loaded from disk carry their artist/file name. Fall back to the title
+    return song_data.get("song_id", song_data["title"])
+
+
+def get_window_rng(seed, song_data, bar_start_index, transposition):
+    """
+    Gets the random number generator used to encode one window of a song.
+
+    The generator is seeded from the global seed, the song, the window and the
+    transposition, so the result does not depend on which worker encodes the song
+    or on the order in which songs are processed.
+
+    Args:
+        seed: The global seed. If None, the global random module is used.
+        song_data: The song being encoded.
+        bar_start_index: The first bar of the window.
+        transposition: The transposition applied to the window.
+
+    Returns:
+        A random.Random instance, or the random module if seed is None.
+    """
+    if seed is None:
+        return random
+    return random.Random(
+        stable_hash(seed, get_song_id(song_data), bar_start_index, transposition)
+    )
+
+
 def encode_track_data(
     track_data, density_bins, bar_start_index, bar_end_index, transposition
 ):
@@ -205,7 +471,7 @@ def encode_track_data(
                 note_on_events += 1
 
     # Determine density
-    density = np.digitize(note_on_events, density_bins)
+    density = get_density(note_on_events, density_bins)
     tokens += [f"DENSITY={density}"]
 
     # Encode the bars
@@ -0,0 +1,122 @@
+import tarfile
+import zipfile
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+ARCHIVE_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".zip")
+MIDI_SUFFIXES = (".mid", ".midi")
+
+
+def is_archive(path: Path) -> bool:
+    return Path(path).is_file() and Path(path).name.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def is_midi_name(name: str) -> bool:
+    return name.lower().endswith(MIDI_SUFFIXES)
+
+
+class ArchiveReader:
+    """
+    Reads MIDI files out of a tar or zip archive without extracting it.
+
+    Members are addressed as archive_path / member name, so the artist folder
+    stays in the path for the genre lookup and the song id. Zip members are
+    read in any order. Compressed tar archives can only be read forwards, so
+    their members are listed in archive order and asking for an earlier
+    member reads the archive again from the start.
+    """
+
+    def __init__(self, archive_path: Path) -> None:
+        self.archive_path = Path(archive_path)
+        self.random_access = zipfile.is_zipfile(self.archive_path)
+        self._lock = threading.Lock()
+        self._sizes = {}
+        # Member names as written in the archive, by normalized name
+        self._names = {}
+        # Position of every MIDI member among all the members of a tar archive
+        self._ordinals = {}
+        self._zip = None
+        self._tar = None
+        self._tar_ordinal = -1
+        self.member_paths = self._list_members()
+
+    def _list_members(self) -> List[Path]:
+        names = []
+        if self.random_access:
+            self._zip = zipfile.ZipFile(self.archive_path)
+            for info in self._zip.infolist():
+                if not info.is_dir() and is_midi_name(info.filename):
+                    name = Path(info.filename).as_posix()
+                    names.append(name)
+                    self._names[name] = info.filename
+                    self._sizes[name] = info.file_size
+            names.sort()
+        else:
+            with tarfile.open(self.archive_path, "r|*") as tar:
+                for ordinal, member in enumerate(tar):
+                    if member.isfile() and is_midi_name(member.name):
+                        # Drops prefixes like ./ so names match the member paths
+                        name = Path(member.name).as_posix()
+                        names.append(name)
+                        self._names[name] = member.name
+                        self._sizes[name] = member.size
+                        self._ordinals[name] = ordinal
+        return [self.archive_path / name for name in names]
+
+    def get_member_name(self, member_path: Path) -> str:
+        return Path(member_path).relative_to(self.archive_path).as_posix()
+
+    def get_size(self, member_path: Path) -> int:
+        return self._sizes.get(self.get_member_name(member_path), 0)
+
+    def read(self, member_path: Path) -> Optional[bytes]:
+        """
+        Reads a member of the archive.
+
+        Args:
+            member_path: The archive path joined with the member name.
+
+        Returns:
+            The bytes of the member, or None if it is not in the archive.
+        """
+        name = self.get_member_name(member_path)
+        with self._lock:
+            if self.random_access:
+                if name not in self._names:
+                    return None
+                return self._zip.read(self._names[name])
+            return self._read_tar(name)
+
+    def _read_tar(self, name: str) -> Optional[bytes]:
+        ordinal = self._ordinals.get(name)
+        if ordinal is None:
+            return None
+        if self._tar is None or ordinal <= self._tar_ordinal:
+            self._open_tar()
+        while True:
+            member = self._tar.next()
+            self._tar_ordinal += 1
+            if member is None:
+                return None
+            if self._tar_ordinal == ordinal:
+                return self._tar.extractfile(member).read()
+
+    def _open_tar(self) -> None:
+        if self._tar is not None:
+            self._tar.close()
+        self._tar = tarfile.open(self.archive_path, "r|*")
+        self._tar_ordinal = -1
+
+    def get_sizes(self) -> Dict[Path, int]:
+        return {
+            member_path: self.get_size(member_path) for member_path in self.member_paths
+        }
+
+    def close(self) -> None:
+        if self._zip is not None:
+            self._zip.close()
+            self._zip = None
+        if self._tar is not None:
+            self._tar.close()
+            self._tar = None
@@ -0,0 +1,154 @@
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from source import logging
+from source.preprocess.loading.loaderiterator import (
+    LoaderIterator,
+    _init_worker,
+    _load_in_worker,
+)
+from source.preprocess.loading.serialization import get_song_id
+
+logger = logging.create_logger("asyncloader")
+
+
+class AsyncLoaderIterator:
+    """
+    Async iterator over the batches of a LoaderIterator, for use in an event loop.
+
+    Files are read on threads and parsed on a pool of num_workers forked
+    processes, so music21 does not hold the GIL of the loop. Only the checks
+    before parsing, like the quarantine and duplicate lookups, run on the
+    loop. Pass a preprocess function to the loader so workers send back its
+    results; Scores sent back are thawed on the loop. A batch is only loaded
+    when the consumer asks for it, so a slow consumer never piles up batches
+    in memory. The pool is created on the first batch and stopped by aclose,
+    or when the last batch was loaded.
+    """
+
+    def __init__(self, loader: LoaderIterator, num_workers: Optional[int] = None):
+        self.loader = loader
+        # The workers of the loader, by default
+        self.num_workers = (
+            num_workers if num_workers is not None else max(loader.num_workers, 1)
+        )
+        self.executor = None
+
+    def __aiter__(self):
+        iter(self.loader)
+        return self
+
+    async def __anext__(self) -> List[Dict]:
+        loader = self.loader
+        if loader.batch_budget is not None:
+            # The caller is done with the previous batch
+            loader.batch_budget.finish_batch()
+        if loader._did_load_all_batches():
+            await self.aclose()
+            raise StopAsyncIteration
+        # Planning a batch stats its files
+        start_index, stop_index = await asyncio.to_thread(
+            loader._get_batch_bounds, loader._current_iteration
+        )
+        if loader.batch_budget is not None:
+            file_sizes = await asyncio.to_thread(
+                loader._get_file_sizes, start_index, stop_index
+            )
+            loader.batch_budget.start_batch(sum(file_sizes))
+
+        with loader.metrics.stage("load"):
+            tasks = []
+            # Files are read one after the other, archive members in order,
+            # while the files read before are parsed
+            for file_index in range(
+                start_index, min(stop_index, len(loader.load_paths))
+            ):
+                load_path = loader.load_paths[file_index]
+                file_data = await asyncio.to_thread(self._read_file, load_path)
+                if not loader._check_file(load_path, file_data):
+                    continue
+                tasks.append(
+                    asyncio.ensure_future(
+                        self._parse_file(file_index, load_path, file_data)
+                    )
+                )
+            data_batch = [
+                data for data in await asyncio.gather(*tasks) if data is not None
+            ]
+        loader._current_iteration += 1
+        return data_batch
+
+    @property
+    def current_iteration(self) -> int:
+        """The number of batches loaded, as written by write_current_iteration."""
+        return self.loader._current_iteration
+
+    async def aclose(self) -> None:
+        """Stops the workers without blocking the loop."""
+        if self.executor is not None:
+            await asyncio.to_thread(self.executor.shutdown)
+            self.executor = None
+        await asyncio.to_thread(self.loader.close)
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            self.num_workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_worker,
+            initargs=(self.loader.serializer, self.loader.preprocess),
+        )
+
+    def _read_file(self, load_path: Path) -> Optional[bytes]:
+        if self.loader.archive_reader is not None:
+            return self.loader.archive_reader.read(load_path)
+        if not load_path.exists():
+            return None
+        return load_path.read_bytes()
+
+    async def _parse_file(
+        self, file_index: int, load_path: Path, file_data: bytes
+    ) -> Optional[Any]:
+        loader = self.loader
+        if file_index == loader.metrics.profile_file_index:
+            # The profiled file is parsed on a thread, where cProfile runs
+            return await asyncio.to_thread(
+                loader._parse_file, file_index, load_path, file_data
+            )
+        if self.executor is None:
+            self.executor = self._create_executor()
+        loop = asyncio.get_running_loop()
+        isolate = False
+        while True:
+            executor = self.executor
+            try:
+                seconds, result = await loop.run_in_executor(
+                    executor,
+                    functools.partial(
+                        _load_in_worker,
+                        load_path,
+                        file_data,
+                        loader.file_timeout,
+                        loader.max_file_memory,
+                        isolate,
+                    ),
+                )
+                data = loader._from_result(result)
+            except BrokenProcessPool:
+                # Not the fault of this file. It is sent again, isolated, so a
+                # file that kills its worker is recorded as crashed
+                if self.executor is executor:
+                    logger.warning("A worker of the pool died. Restarting the pool")
+                    executor.shutdown(wait=False)
+                    self.executor = self._create_executor()
+                isolate = True
+                continue
+            except Exception as e:
+                loader._record_load_error(load_path, e)
+                return None
+            loader.metrics.record_file(get_song_id(load_path), "load", seconds)
+            return data
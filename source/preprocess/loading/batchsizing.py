@@ -0,0 +1,82 @@
+from typing import List
+
+from source.metrics import get_rss, get_peak_rss_since_reset, reset_peak_rss
+
+# Bytes of memory per byte of MIDI file before anything was measured
+DEFAULT_EXPANSION_FACTOR = 200.0
+# Batches shrink to one file when the memory kept since the first batch
+# reaches this fraction of the budget
+BACKOFF_THRESHOLD = 0.9
+
+
+class BatchMemoryBudget:
+    """
+    Sizes batches so their estimated memory fits a budget.
+
+    The memory of a file is estimated as its size times an expansion factor.
+    The factor is measured on every batch as the peak RSS growth divided by
+    the bytes of its files. It follows increases at once and decreases
+    slowly, so a batch of dense files quickly makes the next batches smaller.
+    """
+
+    def __init__(
+        self,
+        max_batch_memory: int,
+        expansion_factor: float = DEFAULT_EXPANSION_FACTOR,
+    ) -> None:
+        self.max_batch_memory = max_batch_memory
+        self.expansion_factor = expansion_factor
+        self.baseline_rss = None
+        self._batch_bytes = 0
+        self._batch_start_rss = None
+
+    def get_available_memory(self) -> int:
+        """Gets the memory the next batch may use, after what earlier batches kept."""
+        rss = get_rss()
+        if self.baseline_rss is None:
+            self.baseline_rss = rss
+        retained = max(rss - self.baseline_rss, 0)
+        if retained >= BACKOFF_THRESHOLD * self.max_batch_memory:
+            return 0
+        return self.max_batch_memory - retained
+
+    def get_batch_size(self, file_sizes: List[int], max_files: int) -> int:
+        """
+        Gets how many of the next files fit in the budget.
+
+        Args:
+            file_sizes: Sizes in bytes of the next files, in order.
+            max_files: Most files a batch may have.
+
+        Returns:
+            The number of files of the batch. At least one if there are files left.
+        """
+        available = self.get_available_memory()
+        estimated_memory = 0.0
+        batch_size = 0
+        for file_size in file_sizes[:max_files]:
+            file_memory = file_size * self.expansion_factor
+            if batch_size > 0 and estimated_memory + file_memory > available:
+                break
+            estimated_memory += file_memory
+            batch_size += 1
+        return batch_size
+
+    def start_batch(self, batch_bytes: int) -> None:
+        self._batch_bytes = batch_bytes
+        self._batch_start_rss = get_rss()
+        reset_peak_rss()
+
+    def finish_batch(self) -> None:
+        """Updates the expansion factor with the memory the last batch used."""
+        if self._batch_start_rss is None or self._batch_bytes == 0:
+            return
+        growth = get_peak_rss_since_reset() - self._batch_start_rss
+        self._batch_start_rss = None
+        if growth <= 0:
+            return
+        measured = growth / self._batch_bytes
+        if measured > self.expansion_factor:
+            self.expansion_factor = measured
+        else:
+            self.expansion_factor = 0.8 * self.expansion_factor + 0.2 * measured
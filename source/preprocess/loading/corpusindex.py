@@ -0,0 +1,241 @@
+import time
+import sqlite3
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from source import logging
+from source.hashing import get_content_hash
+from source.preprocess.loading.isolation import IsolatedTaskError, run_isolated
+from source.preprocess.loading.serialization import Music21Serializer, get_song_id
+from source.preprocess.loading.midiprescan import get_bar_count, scan_midi
+
+logger = logging.create_logger("corpusindex")
+
+COLUMNS = [
+    ("song_id", "TEXT PRIMARY KEY"),
+    ("path", "TEXT"),
+    ("hash", "TEXT"),
+    ("artist", "TEXT"),
+    ("genre", "TEXT"),
+    ("time_signatures", "TEXT"),
+    ("bar_count", "INTEGER"),
+    ("track_count", "INTEGER"),
+    ("instruments", "TEXT"),
+    ("has_drums", "INTEGER"),
+    ("note_count", "INTEGER"),
+    ("file_size", "INTEGER"),
+    ("parse_seconds", "REAL"),
+    ("error", "TEXT"),
+]
+
+
+def get_time_signatures(header: Dict) -> str:
+    """Lists the distinct meters of a scanned file in order, like '4/4,3/4'."""
+    meters = []
+    for _, numerator, denominator in sorted(header["time_signatures"]):
+        meter = f"{numerator}/{denominator}"
+        if meter not in meters:
+            meters.append(meter)
+    # MIDI files without a time signature are in 4/4
+    return ",".join(meters) or "4/4"
+
+
+def _load(serializer: Music21Serializer, load_path: Path) -> None:
+    serializer.load(load_path)
+
+
+def index_file(
+    load_path: Path,
+    serializer: Music21Serializer,
+    parse: bool = True,
+    timeout: Optional[float] = None,
+    max_memory: Optional[int] = None,
+) -> Dict:
+    """
+    Collects the properties of a MIDI file.
+
+    Everything but the parse time comes from the raw MIDI events. The parse
+    time is measured loading the file with the serializer, like the pipeline does.
+
+    Args:
+        load_path: The MIDI file.
+        serializer: The serializer used to load the file and look up the genre.
+        parse: Whether to load the file to measure the parse time.
+        timeout: Seconds the load may take. None waits forever.
+        max_memory: Bytes the load may allocate. None does not limit it.
+
+    Returns:
+        A row of the index.
+    """
+    data = load_path.read_bytes()
+    artist = load_path.parts[-2]
+    entry = {
+        "song_id": get_song_id(load_path),
+        "path": str(load_path),
+        "hash": get_content_hash(data),
+        "artist": artist,
+        "genre": serializer.get_genre(artist),
+        "file_size": len(data),
+        "parse_seconds": None,
+        "error": None,
+    }
+
+    try:
+        header = scan_midi(data)
+    except ValueError as e:
+        header = None
+        entry["error"] = f"invalid_midi: {e}"
+    if header is not None:
+        entry["time_signatures"] = get_time_signatures(header)
+        entry["bar_count"] = get_bar_count(header)
+        entry["track_count"] = header["note_tracks"]
+        entry["instruments"] = " ".join(
+            str(program) for program in sorted(header["programs"])
+        )
+        entry["has_drums"] = int(header["has_drums"])
+        entry["note_count"] = header["note_on_count"]
+
+    if parse and entry["error"] is None:
+        start = time.perf_counter()
+        try:
+            if timeout is None and max_memory is None:
+                _load(serializer, load_path)
+            else:
+                run_isolated(
+                    _load,
+                    (serializer, load_path),
+                    timeout=timeout,
+                    max_memory=max_memory,
+                )
+        except IsolatedTaskError as e:
+            entry["error"] = e.reason
+        except Exception as e:
+            entry["error"] = f"parse_error: {type(e).__name__}"
+        entry["parse_seconds"] = time.perf_counter() - start
+    return entry
+
+
+class CorpusIndex:
+    """
+    SQLite table with the properties of every MIDI file of a corpus, built once
+    so subsets can be selected without parsing the files again.
+    """
+
+    def __init__(self, index_path: Path) -> None:
+        self.index_path = Path(index_path)
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.index_path)
+        self.connection.row_factory = sqlite3.Row
+        columns = ", ".join(f"{name} {column_type}" for name, column_type in COLUMNS)
+        self.connection.execute(f"CREATE TABLE IF NOT EXISTS files ({columns})")
+        self.connection.commit()
+
+    def __len__(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def get(self, song_id: str) -> Optional[Dict]:
+        row = self.connection.execute(
+            "SELECT * FROM files WHERE song_id = ?", (song_id,)
+        ).fetchone()
+        return dict(row) if row is not None else None
+
+    def add(self, entry: Dict) -> None:
+        """Adds or replaces the row of a file. Call commit to save it."""
+        names = [name for name, _ in COLUMNS]
+        placeholders = ", ".join("?" for _ in names)
+        self.connection.execute(
+            f"INSERT OR REPLACE INTO files ({', '.join(names)}) VALUES ({placeholders})",
+            [entry.get(name) for name in names],
+        )
+
+    def commit(self) -> None:
+        self.connection.commit()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def get_parse_seconds(self) -> Dict[str, float]:
+        """Gets the parse time of every file that was parsed, by song id."""
+        rows = self.connection.execute(
+            "SELECT song_id, parse_seconds FROM files WHERE parse_seconds IS NOT NULL"
+        )
+        return {row["song_id"]: row["parse_seconds"] for row in rows}
+
+    def select(
+        self,
+        genres: Optional[List[str]] = None,
+        time_signature: Optional[str] = None,
+        max_tracks: Optional[int] = None,
+    ) -> List[str]:
+        """
+        Selects the files that match every given filter. Files that could not
+        be read or parsed when the index was built are left out.
+
+        Args:
+            genres: Genres of lmd_genres.csv to keep. None keeps all of them.
+            time_signature: The only meter a file may use, like '4/4'.
+            max_tracks: Most tracks with notes a file may have.
+
+        Returns:
+            The song ids of the selected files, sorted.
+        """
+        conditions = ["error IS NULL"]
+        parameters = []
+        if genres is not None:
+            conditions.append(f"genre IN ({', '.join('?' for _ in genres)})")
+            parameters.extend(genres)
+        if time_signature is not None:
+            conditions.append("time_signatures = ?")
+            parameters.append(time_signature)
+        if max_tracks is not None:
+            conditions.append("track_count <= ?")
+            parameters.append(max_tracks)
+        rows = self.connection.execute(
+            f"SELECT song_id FROM files WHERE {' AND '.join(conditions)} "
+            "ORDER BY song_id",
+            parameters,
+        )
+        return [row["song_id"] for row in rows]
+
+
+def build_index(
+    index: CorpusIndex,
+    midi_paths: List[Path],
+    serializer: Music21Serializer,
+    parse: bool = True,
+    timeout: Optional[float] = None,
+    max_memory: Optional[int] = None,
+    commit_every: int = 100,
+) -> Dict:
+    """
+    Indexes the files that are new or changed since the index was built.
+
+    Args:
+        index: The index to update.
+        midi_paths: The MIDI files of the corpus.
+        serializer: The serializer used to load the files.
+        parse: Whether to load every file to measure the parse time.
+        timeout: Seconds the load of a file may take.
+        max_memory: Bytes the load of a file may allocate.
+        commit_every: Files indexed between saves, so an interrupted build resumes.
+
+    Returns:
+        The number of files indexed and left unchanged.
+    """
+    counts = {"indexed": 0, "unchanged": 0}
+    for file_index, load_path in enumerate(midi_paths):
+        entry = index.get(get_song_id(load_path))
+        if entry is not None:
+            # Rows built without parsing get their parse time when it is asked for
+            missing_parse = parse and entry["parse_seconds"] is None
+            same_file = entry["hash"] == get_content_hash(load_path.read_bytes())
+            if same_file and not (missing_parse and entry["error"] is None):
+                counts["unchanged"] += 1
+                continue
+        index.add(index_file(load_path, serializer, parse, timeout, max_memory))
+        counts["indexed"] += 1
+        if counts["indexed"] % commit_every == 0:
+            index.commit()
+            logger.info(f"Indexed {file_index + 1}/{len(midi_paths)} files")
+    index.commit()
+    return counts
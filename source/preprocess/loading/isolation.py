@@ -0,0 +1,106 @@
+import os
+import resource
+import multiprocessing
+from typing import Any, Callable, Optional, Tuple
+
+# Reasons reported by IsolatedTaskError
+TIMEOUT = "timeout"
+MEMORY = "memory"
+ERROR = "error"
+CRASHED = "crashed"
+
+
+class IsolatedTaskError(Exception):
+    """Raised when a function run in an isolated worker does not return a result."""
+
+    def __init__(self, reason: str, message: str) -> None:
+        super().__init__(f"{reason}: {message}")
+        self.reason = reason
+        self.message = message
+
+    def __reduce__(self):
+        # Keeps the reason when the error is sent back from a worker pool
+        return (IsolatedTaskError, (self.reason, self.message))
+
+
+def get_address_space_size() -> int:
+    """Gets the virtual memory size of this process, or 0 if it is unknown."""
+    try:
+        with open("/proc/self/statm", "r") as file:
+            pages = int(file.read().split()[0])
+        return pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def _run_child(writer, function: Callable, args: Tuple, max_memory: Optional[int]):
+    # The worker inherits the address space of the parent. Allow max_memory more
+    if max_memory is not None:
+        limit = get_address_space_size() + max_memory
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+    try:
+        message = ("ok", function(*args))
+    except MemoryError:
+        message = (MEMORY, "Ran out of memory")
+    except Exception as e:
+        message = (ERROR, f"{type(e).__name__}: {e}")
+
+    try:
+        writer.send(message)
+    except MemoryError:
+        writer.send((MEMORY, "Ran out of memory sending the result"))
+    except Exception as e:
+        writer.send((ERROR, f"Could not send the result. {type(e).__name__}: {e}"))
+    writer.close()
+
+
+def run_isolated(
+    function: Callable,
+    args: Tuple = (),
+    timeout: Optional[float] = None,
+    max_memory: Optional[int] = None,
+) -> Any:
+    """
+    Runs a function in a forked worker with a wall-clock timeout and a memory cap.
+
+    The worker is killed when the timeout expires, so a pathological file can not
+    stall the caller. The arguments are inherited through fork and only the
+    result is pickled back.
+
+    Args:
+        function: The function to run.
+        args: The arguments of the function.
+        timeout: Seconds to wait for the result. None waits forever.
+        max_memory: Bytes the worker may allocate on top of what it inherits.
+
+    Raises:
+        IsolatedTaskError: If the worker timed out, ran out of memory, raised or crashed.
+
+    Returns:
+        The result of the function.
+    """
+    context = multiprocessing.get_context("fork")
+    reader, writer = context.Pipe(duplex=False)
+    process = context.Process(
+        target=_run_child, args=(writer, function, args, max_memory), daemon=True
+    )
+    process.start()
+    writer.close()
+
+    try:
+        if not reader.poll(timeout):
+            process.kill()
+            raise IsolatedTaskError(TIMEOUT, f"No result after {timeout} seconds")
+        try:
+            status, result = reader.recv()
+        except EOFError:
+            process.join()
+            raise IsolatedTaskError(CRASHED, f"Exit code {process.exitcode}")
+    finally:
+        reader.close()
+        process.join()
+
+    if status != "ok":
+        raise IsolatedTaskError(status, result)
+    return result
@@ -1,7 +1,119 @@
+import json
+import time
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import Any, Callable, List, Dict, Optional, Tuple
 
-from source.preprocess.loading.serialization import Serializer
+from source import logging
+from source.hashing import get_content_hash
+from source.metrics import PipelineMetrics
+from source.preprocess.loading.isolation import IsolatedTaskError, run_isolated
+from source.preprocess.loading.serialization import Serializer, get_song_id
+from source.preprocess.loading.quarantine import QUARANTINED, Quarantine
+from source.preprocess.loading.batchsizing import BatchMemoryBudget
+from source.preprocess.loading.prefetch import FilePrefetcher
+from source.preprocess.loading.archive import ArchiveReader
+from source.preprocess.dedup import DUPLICATE_FILE, Deduplicator
+from source.preprocess.loading.midiprescan import (
+    INVALID_MIDI,
+    get_prescan_reject_reason,
+    scan_midi,
+)
+
+logger = logging.create_logger("loaderiterator")
+
+
+def _load_object(
+    serializer: Serializer, load_path: Path, file_data: Optional[bytes] = None
+) -> Any:
+    if file_data is None:
+        return serializer.load(load_path)
+    return serializer.load_bytes(file_data, load_path)
+
+
+def _load_to_bytes(
+    serializer: Serializer, load_path: Path, file_data: Optional[bytes] = None
+) -> bytes:
+    return serializer.to_bytes(_load_object(serializer, load_path, file_data))
+
+
+def _load_and_preprocess(
+    serializer: Serializer,
+    preprocess: Callable,
+    load_path: Path,
+    file_data: Optional[bytes] = None,
+) -> Any:
+    return preprocess(_load_object(serializer, load_path, file_data))
+
+
+def _run_load(
+    serializer: Serializer,
+    preprocess: Optional[Callable],
+    load_path: Path,
+    file_data: Optional[bytes],
+    timeout: Optional[float],
+    max_memory: Optional[int],
+    isolate: bool = False,
+) -> Any:
+    """
+    Loads a file to send it to another process, isolated if there are limits.
+
+    Returns:
+        The serialized object, or what preprocess returns for it.
+    """
+    if preprocess is None:
+        function, args = _load_to_bytes, (serializer, load_path, file_data)
+    else:
+        function = _load_and_preprocess
+        args = (serializer, preprocess, load_path, file_data)
+    if timeout is None and max_memory is None and not isolate:
+        return function(*args)
+    return run_isolated(function, args, timeout=timeout, max_memory=max_memory)
+
+
+# Serializer and preprocess function of a worker of the pool, set once when
+# the worker starts
+_worker_serializer = None
+_worker_preprocess = None
+
+
+def _init_worker(serializer: Serializer, preprocess: Optional[Callable]) -> None:
+    global _worker_serializer, _worker_preprocess
+    _worker_serializer = serializer
+    _worker_preprocess = preprocess
+
+
+def _load_in_worker(
+    load_path: Path,
+    file_data: Optional[bytes],
+    timeout: Optional[float],
+    max_memory: Optional[int],
+    isolate: bool = False,
+) -> Tuple[float, Any]:
+    start = time.perf_counter()
+    data = _run_load(
+        _worker_serializer,
+        _worker_preprocess,
+        load_path,
+        file_data,
+        timeout,
+        max_memory,
+        isolate,
+    )
+    return time.perf_counter() - start, data
+
+
+class _Task:
+    """A file sent to the pool. Without a future it is parsed by the caller."""
+
+    def __init__(
+        self, load_path: Path, file_data: Optional[bytes], future: Optional[Future]
+    ) -> None:
+        self.load_path = load_path
+        self.file_data = file_data
+        self.future = future
 
 
 class LoaderIterator:
@@ -12,11 +124,54 @@ class LoaderIterator:
         serializer: Serializer,
         num_files_per_iteration: int,
         load_paths: Optional[List[Path]] = None,
+        metrics: Optional[PipelineMetrics] = None,
+        file_timeout: Optional[float] = None,
+        max_file_memory: Optional[int] = None,
+        quarantine: Optional[Quarantine] = None,
+        prescan: bool = False,
+        num_workers: int = 1,
+        max_batch_memory: Optional[int] = None,
+        prefetch_files: int = 0,
+        archive_reader: Optional[ArchiveReader] = None,
+        deduplicator: Optional[Deduplicator] = None,
+        preprocess: Optional[Callable] = None,
     ) -> None:
         self.serializer = serializer
         self.num_files_per_iteration = num_files_per_iteration
         self._load_paths = load_paths
         self._current_iteration = None
+        self.metrics = metrics if metrics is not None else PipelineMetrics()
+        # With a timeout or a memory cap every file is loaded in its own worker
+        self.file_timeout = file_timeout
+        self.max_file_memory = max_file_memory
+        self.quarantine = quarantine
+        # Reject files from their raw MIDI events before parsing them
+        self.prescan = prescan
+        # With more than one worker, files are parsed in a pool, which keeps
+        # loading the files ahead while the current batch is processed
+        self.num_workers = num_workers
+        self._executor = None
+        self._tasks = {}
+        self._next_submit_index = None
+        # Applied to every loaded object where it is loaded, in the workers of
+        # the pool, so batches hold its results instead of the objects
+        self.preprocess = preprocess
+        # With a memory budget, batches have up to num_files_per_iteration
+        # files and are planned one after the other, so they can differ in size
+        self.batch_budget = None
+        if max_batch_memory is not None:
+            self.batch_budget = BatchMemoryBudget(max_batch_memory)
+        self._batch_bounds = {}
+        self._planned_iteration = 0
+        self._next_file_index = 0
+        # Read this number of files ahead on threads and parse them from memory.
+        # Workers of the pool read their own files
+        self.prefetch_files = prefetch_files
+        self._prefetcher = None
+        # Files are members of an archive instead of files on disk
+        self.archive_reader = archive_reader
+        # Skip files with the same bytes as a file seen before
+        self.deduplicator = deduplicator
 
     @property
     def load_paths(self) -> Optional[List[Path]]:
@@ -32,38 +187,394 @@ class LoaderIterator:
         return self
 
     def __next__(self) -> List[Dict]:
+        if self.batch_budget is not None:
+            # The caller is done with the previous batch
+            self.batch_budget.finish_batch()
         if self._did_load_all_batches():
+            self.close()
             raise StopIteration
+        if self.batch_budget is not None:
+            start_index, stop_index = self._get_batch_bounds(self._current_iteration)
+            self.batch_budget.start_batch(
+                sum(self._get_file_sizes(start_index, stop_index))
+            )
         data_batch = self._load_data_batch()
         self._current_iteration += 1
         return data_batch
 
-    def set_current_iteration(self, iteration: int) -> None:
-        """Set the current iteration for the loader."""
+    def set_current_iteration(
+        self, iteration: int, file_index: Optional[int] = None
+    ) -> None:
+        """
+        Set the current iteration for the loader.
+
+        Args:
+            iteration: The iteration.
+            file_index: The first file of the iteration. It is only needed when
+                batches are sized by memory. Default: as if batches had
+                num_files_per_iteration files.
+        """
         self._current_iteration = iteration
+        if file_index is None:
+            file_index = iteration * self.num_files_per_iteration
+        self._batch_bounds = {}
+        self._planned_iteration = iteration
+        self._next_file_index = file_index
+        self._clear_tasks()
 
-    def write_current_iteration(self, file_path: str) -> None:
-        """Write the current iteration to a file."""
+    def write_current_iteration(
+        self, file_path: str, state: Optional[Dict] = None
+    ) -> None:
+        """
+        Write the current iteration to a file, with its first file under a memory budget.
+
+        Args:
+            file_path: The file to write.
+            state: Optional state of the consumer of the batches, written as
+                JSON on a second line.
+        """
         with open(file_path, "w") as f:
-            f.write(str(self._current_iteration))
+            if self.batch_budget is None:
+                f.write(str(self._current_iteration))
+            else:
+                file_index = self._get_batch_start(self._current_iteration)
+                f.write(f"{self._current_iteration} {file_index}")
+            if state:
+                f.write("\n" + json.dumps(state))
 
-    def _did_load_all_batches(self) -> bool:
-        if (
-            self._current_iteration
-            >= len(self._load_paths) / self.num_files_per_iteration
-        ):
+    def close(self) -> None:
+        """Stops the workers of the pool and the prefetch threads, if there are any."""
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+        self._clear_tasks()
+        if self._prefetcher is not None:
+            self._prefetcher.close()
+            self._prefetcher = None
+
+    def _did_load_all_batches(self, iteration: Optional[int] = None) -> bool:
+        if iteration is None:
+            iteration = self._current_iteration
+        if self.batch_budget is not None:
+            return self._get_batch_start(iteration) >= len(self._load_paths)
+        if iteration >= len(self._load_paths) / self.num_files_per_iteration:
             return True
         return False
 
+    def _get_batch_start(self, iteration: int) -> int:
+        if iteration in self._batch_bounds:
+            return self._batch_bounds[iteration][0]
+        if iteration - 1 in self._batch_bounds:
+            return self._batch_bounds[iteration - 1][1]
+        return self._next_file_index
+
+    def _get_batch_bounds(self, iteration: int) -> Tuple[int, int]:
+        if self.batch_budget is None:
+            start_index = iteration * self.num_files_per_iteration
+            return start_index, start_index + self.num_files_per_iteration
+        # Batches are planned in order, when they are about to be loaded
+        while self._planned_iteration <= iteration:
+            start_index = self._next_file_index
+            file_sizes = self._get_file_sizes(
+                start_index, start_index + self.num_files_per_iteration
+            )
+            batch_size = self.batch_budget.get_batch_size(
+                file_sizes, self.num_files_per_iteration
+            )
+            self._batch_bounds[self._planned_iteration] = (
+                start_index,
+                start_index + batch_size,
+            )
+            self._planned_iteration += 1
+            self._next_file_index = start_index + batch_size
+        return self._batch_bounds[iteration]
+
+    def _get_file_sizes(self, start_index: int, stop_index: int) -> List[int]:
+        if self.archive_reader is not None:
+            return [
+                self.archive_reader.get_size(load_path)
+                for load_path in self._load_paths[start_index:stop_index]
+            ]
+        return [
+            load_path.stat().st_size if load_path.exists() else 0
+            for load_path in self._load_paths[start_index:stop_index]
+        ]
+
+    def _get_batch_paths(self, iteration: int) -> List[Tuple[int, Path]]:
+        start_index, stop_index = self._get_batch_bounds(iteration)
+        return list(enumerate(self._load_paths[start_index:stop_index], start_index))
+
     def _load_data_batch(self) -> List[Dict]:
-        start_index = self._current_iteration * self.num_files_per_iteration
-        stop_index = start_index + self.num_files_per_iteration
+        if self.num_workers > 1:
+            return self._load_data_batch_in_pool()
         batch = []
-        for load_path in self._load_paths[start_index:stop_index]:
-            if load_path.exists():
-                try:
-                    data = self.serializer.load(load_path)
+        with self.metrics.stage("load"):
+            for file_index, load_path in self._get_batch_paths(self._current_iteration):
+                data = self._load_file(file_index, load_path)
+                if data is not None:
+                    batch.append(data)
+        return batch
+
+    def _create_executor(self) -> None:
+        self._executor = ProcessPoolExecutor(
+            self.num_workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_worker,
+            initargs=(self.serializer, self.preprocess),
+        )
+
+    def _load_data_batch_in_pool(self) -> List[Dict]:
+        if self._executor is None:
+            self._create_executor()
+        start_index, stop_index = self._get_batch_bounds(self._current_iteration)
+        if self._next_submit_index is None:
+            self._next_submit_index = start_index
+        batch = []
+        with self.metrics.stage("load"):
+            # Results are taken in file order, so the output does not depend
+            # on which worker finishes first. Workers keep loading the files
+            # ahead meanwhile, of this batch and of the next ones
+            for file_index in range(
+                start_index, min(stop_index, len(self._load_paths))
+            ):
+                self._submit_until(file_index + 1)
+                if file_index not in self._tasks:
+                    # Rejected before parsing
+                    continue
+                task = self._tasks[file_index]
+                song_id = get_song_id(task.load_path)
+                data = None
+                if task.future is None:
+                    # The profiled file is parsed here, where cProfile runs
+                    data = self._parse_file(file_index, task.load_path, task.file_data)
+                else:
+                    try:
+                        seconds, result = self._get_task_result(task)
+                        data = self._from_result(result)
+                        self.metrics.record_file(song_id, "load", seconds)
+                    except Exception as e:
+                        self._record_load_error(task.load_path, e)
+                del self._tasks[file_index]
+                if data is not None:
                     batch.append(data)
-                except Exception as e:
-                    print(f"Failed to load data from {load_path}: {e}")
         return batch
+
+    def _get_max_running_tasks(self) -> int:
+        return 2 * self.num_workers
+
+    def _get_running_futures(self) -> List[Future]:
+        return [
+            task.future
+            for task in self._tasks.values()
+            if task.future is not None and not task.future.done()
+        ]
+
+    def _submit_until(self, stop_index: int) -> None:
+        """Submits every file before stop_index, and then files ahead of it."""
+        while self._next_submit_index < stop_index:
+            self._submit_file(self._next_submit_index)
+            self._next_submit_index += 1
+        self._fill_window()
+
+    def _fill_window(self) -> None:
+        """
+        Submits files ahead until there are enough running tasks to keep the
+        workers busy. Results not taken yet are capped too, so a slow file
+        does not pile up results in memory.
+        """
+        max_tasks = self.num_files_per_iteration + self._get_max_running_tasks()
+        num_running = len(self._get_running_futures())
+        while (
+            self._next_submit_index < len(self._load_paths)
+            and num_running < self._get_max_running_tasks()
+            and len(self._tasks) < max_tasks
+        ):
+            if self._submit_file(self._next_submit_index):
+                num_running += 1
+            self._next_submit_index += 1
+
+    def _get_task_result(self, task: _Task) -> Tuple:
+        while True:
+            if task.future.done():
+                try:
+                    return task.future.result()
+                except BrokenProcessPool:
+                    # Not the fault of this file. The task is sent again
+                    self._restart_executor()
+                    continue
+            wait(self._get_running_futures(), return_when=FIRST_COMPLETED)
+            self._fill_window()
+
+    def _restart_executor(self) -> None:
+        """
+        Starts a new pool after a worker died, e.g. killed for using too much
+        memory, and sends again every task the dead pool did not finish.
+
+        The tasks run isolated this time, so a file that kills its worker is
+        recorded as crashed and the other files load as usual.
+        """
+        logger.warning("A worker of the pool died. Restarting the pool")
+        self._executor.shutdown(wait=False)
+        self._create_executor()
+        for task in self._tasks.values():
+            # A dead pool finishes all its futures, with a result or the error
+            if task.future is None or not task.future.done():
+                continue
+            if not isinstance(task.future.exception(), BrokenProcessPool):
+                continue
+            task.future = self._executor.submit(
+                _load_in_worker,
+                task.load_path,
+                task.file_data,
+                self.file_timeout,
+                self.max_file_memory,
+                True,
+            )
+
+    def _submit_file(self, file_index: int) -> bool:
+        """
+        Sends a file to the pool, unless it is rejected before parsing.
+
+        Returns:
+            Whether a worker loads the file.
+        """
+        load_path = self._load_paths[file_index]
+        # Workers read files on disk themselves. Archive members are sent
+        file_data = None
+        if self.archive_reader is not None:
+            file_data = self.archive_reader.read(load_path)
+        if not self._check_file(load_path, file_data):
+            return False
+        if file_index == self.metrics.profile_file_index:
+            self._tasks[file_index] = _Task(load_path, file_data, None)
+            return False
+        # Registered first, so a restart while submitting sends the task again
+        task = _Task(load_path, file_data, None)
+        self._tasks[file_index] = task
+        try:
+            task.future = self._executor.submit(
+                _load_in_worker,
+                load_path,
+                file_data,
+                self.file_timeout,
+                self.max_file_memory,
+            )
+        except BrokenProcessPool:
+            self._restart_executor()
+            task.future = self._executor.submit(
+                _load_in_worker,
+                load_path,
+                file_data,
+                self.file_timeout,
+                self.max_file_memory,
+            )
+        return True
+
+    def _clear_tasks(self) -> None:
+        for task in self._tasks.values():
+            if task.future is not None:
+                task.future.cancel()
+        self._tasks = {}
+        self._next_submit_index = None
+
+    def _load_file(self, file_index: int, load_path: Path) -> Optional[Dict]:
+        file_data = None
+        if self.prefetch_files > 0:
+            if self._prefetcher is None:
+                self._prefetcher = self._create_prefetcher()
+            file_data = self._prefetcher.get(file_index)
+        elif self.archive_reader is not None:
+            file_data = self.archive_reader.read(load_path)
+        if not self._check_file(load_path, file_data):
+            return None
+        return self._parse_file(file_index, load_path, file_data)
+
+    def _create_prefetcher(self) -> FilePrefetcher:
+        if self.archive_reader is None:
+            return FilePrefetcher(self._load_paths, self.prefetch_files)
+        # One thread, so archive members are read in order
+        return FilePrefetcher(
+            self._load_paths,
+            self.prefetch_files,
+            num_threads=1,
+            read=self.archive_reader.read,
+        )
+
+    def _check_file(self, load_path: Path, file_data: Optional[bytes] = None) -> bool:
+        """Checks the file without parsing it. Rejected files are recorded as skipped."""
+        song_id = get_song_id(load_path)
+        in_archive = self.archive_reader is not None
+        if file_data is None and (in_archive or not load_path.exists()):
+            self.metrics.record_skip(song_id, "missing")
+            return False
+
+        needs_hash = self.quarantine is not None or self.deduplicator is not None
+        if file_data is None and (needs_hash or self.prescan):
+            file_data = load_path.read_bytes()
+        content_hash = get_content_hash(file_data) if needs_hash else None
+
+        # Known bad files are skipped before paying for the parse
+        if self.quarantine is not None:
+            if self.quarantine.check(song_id, load_path, content_hash) is not None:
+                self.metrics.record_skip(song_id, QUARANTINED)
+                return False
+
+        if self.deduplicator is not None:
+            if self.deduplicator.check_file(song_id, content_hash) is not None:
+                self.metrics.record_skip(song_id, DUPLICATE_FILE)
+                return False
+
+        if self.prescan:
+            start = time.perf_counter()
+            try:
+                reason = get_prescan_reject_reason(scan_midi(file_data))
+            except ValueError:
+                reason = INVALID_MIDI
+            self.metrics.record_file(song_id, "prescan", time.perf_counter() - start)
+            if reason is not None:
+                self.metrics.record_skip(song_id, reason)
+                return False
+        return True
+
+    def _parse_file(
+        self, file_index: int, load_path: Path, file_data: Optional[bytes] = None
+    ) -> Optional[Dict]:
+        song_id = get_song_id(load_path)
+        self.metrics.select_profile(file_index, song_id)
+        start = time.perf_counter()
+        data = None
+        try:
+            with self.metrics.profile(song_id):
+                data = self._load(load_path, file_data)
+        except Exception as e:
+            self._record_load_error(load_path, e)
+        self.metrics.record_file(song_id, "load", time.perf_counter() - start)
+        return data
+
+    def _record_load_error(self, load_path: Path, error: Exception) -> None:
+        logger.warning(f"Failed to load data from {load_path}: {error}")
+        song_id = get_song_id(load_path)
+        if isinstance(error, IsolatedTaskError):
+            self.metrics.record_skip(song_id, error.reason)
+        else:
+            self.metrics.record_skip(song_id, f"parse_error: {type(error).__name__}")
+
+    def _load(self, load_path: Path, file_data: Optional[bytes] = None):
+        if self.file_timeout is None and self.max_file_memory is None:
+            data = _load_object(self.serializer, load_path, file_data)
+            return data if self.preprocess is None else self.preprocess(data)
+        result = _run_load(
+            self.serializer,
+            self.preprocess,
+            load_path,
+            file_data,
+            self.file_timeout,
+            self.max_file_memory,
+        )
+        return self._from_result(result)
+
+    def _from_result(self, result: Any) -> Any:
+        """Results from other processes are serialized objects, or what preprocess returned."""
+        if self.preprocess is None:
+            return self.serializer.from_bytes(result)
+        return result
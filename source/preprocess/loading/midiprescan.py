@@ -0,0 +1,197 @@
+from typing import Dict, List, Optional, Tuple
+
+# Reasons returned by get_prescan_reject_reason
+INVALID_MIDI = "invalid_midi"
+EMPTY = "empty"
+MULTIPLE_METERS = "multiple_meters"
+
+DRUM_CHANNEL = 9
+
+
+def read_variable_length(data: bytes, position: int) -> Tuple[int, int]:
+    """Reads a MIDI variable length quantity. Returns the value and the next position."""
+    value = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, position
+
+
+def scan_track(data: bytes, start: int, end: int, header: Dict) -> None:
+    """Reads the events of one MTrk chunk, keeping only what the filters need."""
+    position = start
+    tick = 0
+    running_status = None
+    # Format 0 files keep every instrument in one chunk, one per channel
+    note_channels = set()
+    while position < end:
+        delta, position = read_variable_length(data, position)
+        tick += delta
+        status = data[position]
+        if status >= 0x80:
+            position += 1
+        elif running_status is not None:
+            status = running_status
+        else:
+            raise ValueError("Data byte without running status")
+
+        if status == 0xFF:
+            meta_type = data[position]
+            length, position = read_variable_length(data, position + 1)
+            if meta_type == 0x58 and length >= 2:
+                numerator = data[position]
+                denominator = 2 ** data[position + 1]
+                header["time_signatures"].append((tick, numerator, denominator))
+            position += length
+            if meta_type == 0x2F:
+                break
+        elif status in (0xF0, 0xF7):
+            length, position = read_variable_length(data, position)
+            position += length
+            running_status = None
+        else:
+            running_status = status
+            message = status & 0xF0
+            channel = status & 0x0F
+            if message in (0xC0, 0xD0):
+                if message == 0xC0:
+                    header["programs"].add(data[position])
+                position += 1
+            else:
+                if message == 0x90 and data[position + 1] > 0:
+                    header["note_on_count"] += 1
+                    note_channels.add(channel)
+                    if channel == DRUM_CHANNEL:
+                        header["has_drums"] = True
+                position += 2
+    header["length_ticks"] = max(header["length_ticks"], tick)
+    header["note_tracks"] += len(note_channels)
+
+
+def scan_midi(data: bytes) -> Dict:
+    """
+    Reads the meta data of a MIDI file without building any music21 objects.
+
+    Args:
+        data: The bytes of a standard MIDI file.
+
+    Raises:
+        ValueError: If the data does not start with a MIDI header.
+
+    Returns:
+        A dictionary with the format, the number of MTrk chunks, the number of
+        tracks with notes (one per channel of every chunk), the number of chunks
+        that could not be read, the ticks per quarter
+        (None for SMPTE time), the (tick, numerator, denominator) of every time
+        signature, the number of NOTE_ON events, the programs, whether the drum
+        channel is used and the length in ticks.
+    """
+    if len(data) < 14 or data[:4] != b"MThd":
+        raise ValueError("Missing MIDI header")
+    header_length = int.from_bytes(data[4:8], "big")
+    division = int.from_bytes(data[12:14], "big")
+    header = {
+        "format": int.from_bytes(data[8:10], "big"),
+        "num_tracks": 0,
+        "note_tracks": 0,
+        "broken_tracks": 0,
+        "ticks_per_quarter": None if division & 0x8000 else division,
+        "time_signatures": [],
+        "note_on_count": 0,
+        "programs": set(),
+        "has_drums": False,
+        "length_ticks": 0,
+    }
+
+    position = 8 + header_length
+    while position + 8 <= len(data):
+        chunk_type = data[position : position + 4]
+        chunk_length = int.from_bytes(data[position + 4 : position + 8], "big")
+        start = position + 8
+        end = min(start + chunk_length, len(data))
+        if chunk_type == b"MTrk":
+            header["num_tracks"] += 1
+            try:
+                scan_track(data, start, end, header)
+            except (IndexError, ValueError):
+                # Keep what was read. music21 decides about broken tracks
+                header["broken_tracks"] += 1
+        position = start + chunk_length
+    return header
+
+
+def get_window_end_tick(
+    time_signatures: List[Tuple[int, int, int]], ticks_per_quarter: int, bars: int
+) -> float:
+    """Gets the tick where the bar after the first bars starts."""
+    changes = sorted(time_signatures)
+    numerator, denominator = 4, 4
+    change_index = 0
+    tick = 0.0
+    for _ in range(bars):
+        while change_index < len(changes) and changes[change_index][0] <= tick:
+            _, numerator, denominator = changes[change_index]
+            change_index += 1
+        tick += ticks_per_quarter * 4 * numerator / denominator
+    return tick
+
+
+def get_bar_count(header: Dict) -> Optional[int]:
+    """Gets the number of bars of a scanned file, or None with SMPTE time."""
+    ticks_per_quarter = header["ticks_per_quarter"]
+    if not ticks_per_quarter:
+        return None
+    changes = sorted(header["time_signatures"])
+    numerator, denominator = 4, 4
+    change_index = 0
+    tick = 0.0
+    bars = 0
+    while tick < header["length_ticks"]:
+        while change_index < len(changes) and changes[change_index][0] <= tick:
+            _, numerator, denominator = changes[change_index]
+            change_index += 1
+        # Broken time signatures must not stall the loop
+        tick += max(ticks_per_quarter * 4 * numerator / denominator, 1)
+        bars += 1
+    return bars
+
+
+def get_prescan_reject_reason(header: Dict, bars: Optional[int] = 8) -> Optional[str]:
+    """
+    Applies the emptiness and meter filters of the preprocessing to a scanned header.
+
+    Only the time signatures of the first bars count, because the serializer
+    keeps only those bars before the meters are checked. The check is
+    conservative: when in doubt the file is accepted and left to the full parse.
+
+    Args:
+        header: The result of scan_midi.
+        bars: The number of bars kept by the serializer. None checks the whole file.
+
+    Returns:
+        The reason to reject the file, or None if it has to be parsed.
+    """
+    if header["num_tracks"] == 0:
+        return INVALID_MIDI
+    if header["note_on_count"] == 0:
+        return EMPTY
+
+    time_signatures = header["time_signatures"]
+    if header["ticks_per_quarter"] is None:
+        # Bars can not be located with SMPTE time
+        return None
+    if bars is not None:
+        end_tick = get_window_end_tick(
+            time_signatures, header["ticks_per_quarter"], bars
+        )
+        time_signatures = [
+            time_signature
+            for time_signature in time_signatures
+            if time_signature[0] < end_tick
+        ]
+    meters = {(numerator, denominator) for _, numerator, denominator in time_signatures}
+    if len(meters) > 1:
+        return MULTIPLE_METERS
+    return None
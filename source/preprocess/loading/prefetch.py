@@ -0,0 +1,59 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, List, Optional
+
+
+def read_file(load_path: Path) -> Optional[bytes]:
+    """Reads a file, or returns None if it can not be read."""
+    try:
+        return load_path.read_bytes()
+    except OSError:
+        return None
+
+
+class FilePrefetcher:
+    """
+    Reads the next files on background threads, so disk or network latency
+    is paid while the current file is parsed.
+
+    Reading releases the GIL, so threads are enough to overlap it with the
+    CPU-bound parsing.
+    """
+
+    def __init__(
+        self,
+        load_paths: List[Path],
+        num_files: int,
+        num_threads: int = 2,
+        read: Callable[[Path], Optional[bytes]] = read_file,
+    ) -> None:
+        self.load_paths = load_paths
+        self.num_files = num_files
+        self.read = read
+        self._executor = ThreadPoolExecutor(num_threads, thread_name_prefix="prefetch")
+        self._futures = {}
+
+    def get(self, file_index: int) -> Optional[bytes]:
+        """
+        Gets the bytes of a file and starts reading the files after it.
+
+        Args:
+            file_index: The index of the file in load_paths.
+
+        Returns:
+            The bytes of the file, or None if it can not be read.
+        """
+        # Files before this one will not be asked for, e.g. after a resume
+        for index in [index for index in self._futures if index < file_index]:
+            self._futures.pop(index).cancel()
+        stop_index = min(file_index + self.num_files + 1, len(self.load_paths))
+        for index in range(file_index, stop_index):
+            if index not in self._futures:
+                self._futures[index] = self._executor.submit(
+                    self.read, self.load_paths[index]
+                )
+        return self._futures.pop(file_index).result()
+
+    def close(self) -> None:
+        self._executor.shutdown(cancel_futures=True)
+        self._futures = {}
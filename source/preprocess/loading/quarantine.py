@@ -0,0 +1,192 @@
+import os
+import json
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from source import logging
+from source.hashing import get_content_hash
+from source.preprocess.loading.archive import ArchiveReader, is_archive
+from source.preprocess.loading.isolation import MEMORY, TIMEOUT
+from source.preprocess.dedup import DUPLICATE_FILE, DUPLICATE_NOTES
+
+logger = logging.create_logger("quarantine")
+
+QUARANTINED = "quarantined"
+
+# Skip reasons that say nothing about the file itself
+TRANSIENT_REASONS = {"missing", QUARANTINED, DUPLICATE_FILE, DUPLICATE_NOTES}
+
+
+class Quarantine:
+    """
+    Persistent record of files that were rejected, so later runs skip them
+    without parsing them again.
+
+    Every entry keeps the path, the content hash, the reason and the
+    preprocessor version. An entry only applies while the file has the same
+    content and the preprocessor has the same version. Files rejected for a
+    timeout or for memory also keep the limit they broke, and are processed
+    again by runs with a larger limit or none.
+    """
+
+    def __init__(
+        self,
+        quarantine_path: Path,
+        version: str,
+        file_timeout: Optional[float] = None,
+        max_file_memory: Optional[int] = None,
+    ) -> None:
+        self.quarantine_path = Path(quarantine_path)
+        self.version = version
+        # The limits of this run, by the reason breaking them is recorded with
+        self.limits = {TIMEOUT: file_timeout, MEMORY: max_file_memory}
+        self.entries = {}
+        # Files checked in this run, so they can be quarantined by song id
+        self._observed = {}
+        self._dirty = False
+        if self.quarantine_path.exists():
+            with open(self.quarantine_path, "r") as file:
+                self.entries = json.load(file)
+
+    def check(self, song_id: str, load_path: Path, content_hash: str) -> Optional[str]:
+        """
+        Checks if a file is quarantined.
+
+        Args:
+            song_id: The id of the song.
+            load_path: The path of the file.
+            content_hash: The hash of the content of the file.
+
+        Returns:
+            The reason of the quarantine, or None if the file has to be processed.
+        """
+        self._observed[song_id] = (str(load_path), content_hash)
+        entry = self.entries.get(song_id)
+        if entry is None:
+            return None
+        if entry["hash"] != content_hash or entry["version"] != self.version:
+            return None
+        if not self._applies_to_limits(entry):
+            return None
+        return entry["reason"]
+
+    def _applies_to_limits(self, entry: Dict) -> bool:
+        if entry["reason"] not in self.limits:
+            return True
+        limit = self.limits[entry["reason"]]
+        rejected_limit = entry.get("limit")
+        if limit is None or rejected_limit is None:
+            return False
+        return limit <= rejected_limit
+
+    def add(self, song_id: str, reason: str) -> None:
+        """Quarantines a file checked in this run. Other files are ignored."""
+        if reason in TRANSIENT_REASONS or song_id not in self._observed:
+            return
+        load_path, content_hash = self._observed[song_id]
+        self.entries[song_id] = {
+            "path": load_path,
+            "hash": content_hash,
+            "reason": reason,
+            "version": self.version,
+        }
+        if reason in self.limits:
+            self.entries[song_id]["limit"] = self.limits[reason]
+        self._dirty = True
+
+    def remove(self, song_id: str) -> None:
+        if self.entries.pop(song_id, None) is not None:
+            self._dirty = True
+
+    def get_stale_song_ids(self) -> List[str]:
+        """Gets the files quarantined by another preprocessor version."""
+        return [
+            song_id
+            for song_id, entry in self.entries.items()
+            if entry["version"] != self.version
+        ]
+
+    def save(self) -> None:
+        """Writes the entries if they changed. The file is replaced atomically."""
+        if not self._dirty:
+            return
+        self.quarantine_path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = self.quarantine_path.with_suffix(".tmp")
+        with open(temporary_path, "w") as file:
+            json.dump(self.entries, file, indent=2, sort_keys=True)
+        os.replace(temporary_path, self.quarantine_path)
+        self._dirty = False
+
+    def summary(self) -> Dict:
+        reasons = {}
+        for entry in self.entries.values():
+            reasons[entry["reason"]] = reasons.get(entry["reason"], 0) + 1
+        return reasons
+
+
+def get_archive_path(load_path: Path) -> Optional[Path]:
+    """Gets the archive a member path points into, or None for plain files."""
+    for parent in Path(load_path).parents:
+        if is_archive(parent):
+            return parent
+    return None
+
+
+def recheck_quarantine(
+    quarantine: Quarantine,
+    check_file,
+    song_ids: List[str],
+    archive_reader: Optional[ArchiveReader] = None,
+) -> Dict:
+    """
+    Processes quarantined files again and releases the ones that pass.
+
+    Args:
+        quarantine: The quarantine to update.
+        check_file: A function that takes a path and the bytes of the file and
+            returns None if the file can be processed, or the reason why it can not.
+        song_ids: The quarantined files to re-check.
+        archive_reader: The archive the files were read from, if any. Members
+            of other archives are kept without re-checking them.
+
+    Returns:
+        The number of files released, still rejected, gone or changed and kept.
+    """
+    counts = {"released": 0, "rejected": 0, "changed": 0, "kept": 0}
+    for song_id in song_ids:
+        entry = quarantine.entries[song_id]
+        load_path = Path(entry["path"])
+        archive_path = get_archive_path(load_path)
+        if archive_path is None:
+            data = load_path.read_bytes() if load_path.exists() else None
+        elif (
+            archive_reader is not None
+            and archive_reader.archive_path.resolve() == archive_path.resolve()
+        ):
+            data = archive_reader.read(load_path)
+        else:
+            counts["kept"] += 1
+            continue
+        # Missing or changed files are processed again by the next run
+        if data is None:
+            quarantine.remove(song_id)
+            counts["changed"] += 1
+            continue
+        content_hash = get_content_hash(data)
+        if content_hash != entry["hash"]:
+            quarantine.remove(song_id)
+            counts["changed"] += 1
+            continue
+
+        quarantine.check(song_id, load_path, content_hash)
+        reason = check_file(load_path, data)
+        if reason is None:
+            quarantine.remove(song_id)
+            counts["released"] += 1
+            logger.info(f"Released {song_id}")
+        else:
+            quarantine.add(song_id, reason)
+            counts["rejected"] += 1
+            logger.info(f"Still rejected {song_id}: {reason}")
+    quarantine.save()
+    return counts
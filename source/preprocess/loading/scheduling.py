@@ -0,0 +1,73 @@
+import statistics
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from source.preprocess.loading.serialization import get_song_id
+
+
+def get_file_costs(
+    load_paths: List[Path],
+    parse_seconds: Optional[Dict[str, float]] = None,
+    file_sizes: Optional[Dict[Path, int]] = None,
+) -> Dict[Path, float]:
+    """
+    Estimates the cost of loading every file.
+
+    Files with a parse time in the corpus index cost that time. The rest cost
+    their size, scaled by the median seconds per byte of the indexed files so
+    both estimates can be compared.
+
+    Args:
+        load_paths: The MIDI files.
+        parse_seconds: Parse time by song id, like CorpusIndex.get_parse_seconds.
+        file_sizes: Size of every file, for files that are not on disk.
+
+    Returns:
+        The estimated cost of every file.
+    """
+    parse_seconds = parse_seconds or {}
+    sizes = file_sizes
+    if sizes is None:
+        sizes = {
+            load_path: load_path.stat().st_size if load_path.exists() else 0
+            for load_path in load_paths
+        }
+    seconds_per_byte = [
+        parse_seconds[get_song_id(load_path)] / sizes[load_path]
+        for load_path in load_paths
+        if get_song_id(load_path) in parse_seconds and sizes[load_path]
+    ]
+    scale = statistics.median(seconds_per_byte) if seconds_per_byte else 1.0
+
+    costs = {}
+    for load_path in load_paths:
+        song_id = get_song_id(load_path)
+        if song_id in parse_seconds:
+            costs[load_path] = parse_seconds[song_id]
+        else:
+            costs[load_path] = sizes[load_path] * scale
+    return costs
+
+
+def order_longest_first(
+    load_paths: List[Path],
+    parse_seconds: Optional[Dict[str, float]] = None,
+    file_sizes: Optional[Dict[Path, int]] = None,
+) -> List[Path]:
+    """
+    Orders the files from the most to the least expensive to load.
+
+    Starting with the longest files keeps one late straggler from holding up
+    the end of the run. Ties keep the path order, so the order is the same in
+    every run and resuming from an iteration stays valid.
+
+    Args:
+        load_paths: The MIDI files.
+        parse_seconds: Parse time by song id, like CorpusIndex.get_parse_seconds.
+        file_sizes: Size of every file, for files that are not on disk.
+
+    Returns:
+        The files, most expensive first.
+    """
+    costs = get_file_costs(load_paths, parse_seconds, file_sizes)
+    return sorted(load_paths, key=lambda load_path: (-costs[load_path], load_path))
@@ -1,13 +1,20 @@
+import pickle
 from abc import ABC, abstractmethod
 from pathlib import Path
-from typing import Any
-
-import pandas as pd
-from music21 import converter
-from music21.stream.base import Score
-from music21 import metadata
+from typing import TYPE_CHECKING, Any
 
 from source.preprocess.preprocessutilities import keep_first_eight_measures
+from source.preprocess.sharedstate import GENRE_FILE, get_genre_map
+
+# music21 takes long to import. It is imported by the serializer that uses
+# it, so modules that only need get_song_id stay fast to import
+if TYPE_CHECKING:
+    from music21.stream.base import Score
+
+
+def get_song_id(load_path: Path) -> str:
+    """Identifies a song by its artist folder and file name, independent of the root."""
+    return "/".join(load_path.parts[-2:])
 
 
 class Serializer(ABC):
@@ -21,6 +28,17 @@ class Serializer(ABC):
     def load(self, load_path: Path) -> Any:
         pass
 
+    def load_bytes(self, data: bytes, load_path: Path) -> Any:
+        """Loads a file from its bytes. Serializers that can not, read the file again."""
+        return self.load(load_path)
+
+    def to_bytes(self, obj: Any) -> bytes:
+        """Converts a loaded object to bytes, to send it between processes."""
+        return pickle.dumps(obj)
+
+    def from_bytes(self, data: bytes) -> Any:
+        return pickle.loads(data)
+
 
 class Music21Serializer(Serializer):
 
@@ -29,28 +47,43 @@ class Music21Serializer(Serializer):
     def __init__(
         self,
         save_format: str = "midi",
-        genre_file: Path = "source/preprocess/loading/lmd_genres.csv",
+        genre_file: Path = GENRE_FILE,
     ) -> None:
+        # Imported here, before any worker is forked, so workers inherit it
+        import music21.converter  # noqa: F401
+
         self.save_format = save_format
 
-        # Read the genre CSV file into a DataFrame.
-        self.genre_df = pd.read_csv(genre_file)
+        # Read once per process and shared by every serializer
+        self.genre_map = get_genre_map(genre_file)
 
-    def dump(self, m21_stream: Score, save_path: Path) -> None:
+    def dump(self, m21_stream: "Score", save_path: Path) -> None:
         m21_stream.write(fmt=self.save_format, fp=save_path, quantizePost=False)
 
-    def load(self, load_path: Path) -> Score:
-        # Extract the artist name from the load_path.
-        artist_name = load_path.parts[-2]
-
-        # Search for the artist name in the DataFrame.
-        genre_row = self.genre_df.loc[self.genre_df["Artist"] == artist_name]
-
+    def get_genre(self, artist_name: str) -> str:
         # Get the genre if the artist was found.
-        genre = genre_row["Genre_ChatGPT"].values[0] if not genre_row.empty else "other"
+        return self.genre_map.get(artist_name, "other")
+
+    def load(self, load_path: Path) -> "Score":
+        from music21 import converter
 
         # Load the score from the file.
         stream = converter.parse(load_path, quantizePost=False)
+        return self._prepare(stream, load_path)
+
+    def load_bytes(self, data: bytes, load_path: Path) -> "Score":
+        from music21 import converter
+
+        # Parse the score from memory. load_path only names the song and artist
+        stream = converter.parseData(data, format=self.save_format, quantizePost=False)
+        return self._prepare(stream, load_path)
+
+    def _prepare(self, stream: "Score", load_path: Path) -> "Score":
+        from music21 import metadata
+
+        # Extract the artist name from the load_path.
+        genre = self.get_genre(load_path.parts[-2])
+
         # Remove final measure with just rests
         stream = keep_first_eight_measures(stream)
         # Add metadata
@@ -60,5 +93,19 @@ class Music21Serializer(Serializer):
         stream.metadata.title = load_path.parts[-1].split(".")[0]
         if genre is not None:
             stream.metadata.setCustom("genre", genre)
+        stream.metadata.setCustom("song_id", get_song_id(load_path))
 
         return stream
+
+    def to_bytes(self, m21_stream: "Score") -> bytes:
+        from music21 import freezeThaw
+
+        # Streams hold weak references that plain pickle can not handle
+        return freezeThaw.StreamFreezer(m21_stream).writeStr(fmt="pickle")
+
+    def from_bytes(self, data: bytes) -> "Score":
+        from music21 import freezeThaw
+
+        stream_thawer = freezeThaw.StreamThawer()
+        stream_thawer.openStr(data)
+        return stream_thawer.stream
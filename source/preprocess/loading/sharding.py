@@ -0,0 +1,41 @@
+from pathlib import Path
+from typing import List
+
+from source.hashing import stable_hash
+
+
+def get_shard_name(shard_index: int, num_shards: int) -> str:
+    """Name of the folder where a shard writes its token sequences."""
+    return f"shard_{shard_index:05d}_of_{num_shards:05d}"
+
+
+def get_shard_index(relative_path: Path, num_shards: int) -> int:
+    """Assigns a file to a shard using a stable hash of its relative path."""
+    return stable_hash(Path(relative_path).as_posix()) % num_shards
+
+
+def select_shard(
+    paths: List[Path], root: Path, num_shards: int, shard_index: int
+) -> List[Path]:
+    """
+    Keeps the paths that belong to one shard.
+
+    The decision only depends on the path relative to root, so every machine
+    gets the same partition no matter where the dataset is mounted.
+
+    Args:
+        paths: Paths of the MIDI files.
+        root: Folder the paths are relative to.
+        num_shards: Total number of shards.
+        shard_index: Index of the shard to keep, from 0 to num_shards - 1.
+
+    Returns:
+        The paths of the shard, in the same order as paths.
+    """
+    if num_shards <= 1:
+        return list(paths)
+    return [
+        path
+        for path in paths
+        if get_shard_index(Path(path).relative_to(root), num_shards) == shard_index
+    ]
@@ -15,45 +15,163 @@
 
 # Lint as: python3
 
-from typing import List, Dict
+import time
+from typing import List, Dict, Optional, Tuple
 
 import music21
 from music21 import meter, instrument
 from music21.stream import Score
 
 from source import logging
-from source.preprocess.preprocessutilities import events_to_events_data
-
+from source.metrics import PipelineMetrics
+from source.preprocess.preprocessutilities import (
+    TICKS_PER_QUARTER,
+    events_to_events_data,
+    get_tick,
+)
+from source.preprocess.sharedstate import get_percussion_mapper
+from source.preprocess.split import is_validation_song
+from source.preprocess.loading.isolation import IsolatedTaskError, run_isolated
 
 logger = logging.create_logger("music21lmd")
 
-
-def preprocess_music21(m21_streams: List[Score]) -> Dict:
-    split_index = int(0.8 * len(m21_streams))
-    songs_train = m21_streams[:split_index]
-    songs_valid = m21_streams[split_index:]
+# Bump when a change could accept songs that were rejected before
+PREPROCESSOR_VERSION = "1"
+
+# Reason recorded when preprocess_music21_song drops a song
+MULTIPLE_METERS = "multiple_meters"
+
+
+def preprocess_music21(
+    m21_streams: List[Score],
+    valid_ratio: float = 0.2,
+    split_key: str = "artist",
+    metrics: Optional[PipelineMetrics] = None,
+    timeout: Optional[float] = None,
+    max_memory: Optional[int] = None,
+    ticks_per_quarter: int = TICKS_PER_QUARTER,
+) -> Dict:
+    # Every song decides its own split, so batching and order do not matter
+    songs_train = []
+    songs_valid = []
+    for m21_stream in m21_streams:
+        if is_validation_song(get_stream_song_id(m21_stream), valid_ratio, split_key):
+            songs_valid.append(m21_stream)
+        else:
+            songs_train.append(m21_stream)
 
     logger.info(f"Using {len(songs_train)} for training.")
     logger.info(f"Using {len(songs_valid)} for validation.")
 
-    songs_data_train = preprocess_music21_songs(songs_train, train=True)
-    songs_data_valid = preprocess_music21_songs(songs_valid, train=False)
+    songs_data_train = preprocess_music21_songs(
+        songs_train, True, metrics, timeout, max_memory, ticks_per_quarter
+    )
+    songs_data_valid = preprocess_music21_songs(
+        songs_valid, False, metrics, timeout, max_memory, ticks_per_quarter
+    )
 
     return songs_data_train, songs_data_valid
 
 
-def preprocess_music21_songs(songs, train):
+def get_stream_song_id(song):
+    # Streams loaded by Music21Serializer know their file. Fall back to the title
+    song_id = song.metadata.getCustom("song_id")
+    if song_id:
+        return str(song_id[0])
+    return str(song.metadata.title)
+
+
+def preprocess_music21_songs(
+    songs,
+    train,
+    metrics=None,
+    timeout=None,
+    max_memory=None,
+    ticks_per_quarter=TICKS_PER_QUARTER,
+):
+    if metrics is None:
+        metrics = PipelineMetrics()
     songs_data = []
 
     for song in songs:
-        song_data = preprocess_music21_song(song, train)
+        song_id = get_stream_song_id(song)
+        start = time.perf_counter()
+        try:
+            with metrics.profile(song_id):
+                if timeout is None and max_memory is None:
+                    song_data = preprocess_music21_song(song, train, ticks_per_quarter)
+                else:
+                    # Run in a worker that is killed if the song takes too long
+                    song_data = run_isolated(
+                        preprocess_music21_song,
+                        (song, train, ticks_per_quarter),
+                        timeout,
+                        max_memory,
+                    )
+        except IsolatedTaskError as e:
+            logger.warning(f"Skipping {song_id}. {e}")
+            metrics.record_skip(song_id, e.reason)
+            continue
+        finally:
+            metrics.record_file(song_id, "preprocess", time.perf_counter() - start)
         if song_data is not None:
             songs_data += [song_data]
+        else:
+            metrics.record_skip(song_id, MULTIPLE_METERS)
 
     return songs_data
 
 
-def preprocess_music21_song(song, train):
+def preprocess_loaded_song(
+    song: Score,
+    valid_ratio: float = 0.2,
+    split_key: str = "artist",
+    ticks_per_quarter: int = TICKS_PER_QUARTER,
+) -> Dict:
+    """
+    Preprocesses a song where it is loaded, e.g. in a worker of the loader, so
+    only its song data is sent back instead of the Score.
+
+    Returns:
+        The song id, whether the song is for training, the seconds it took and
+        the song data, which is None for songs with multiple meters.
+    """
+    song_id = get_stream_song_id(song)
+    train = not is_validation_song(song_id, valid_ratio, split_key)
+    start = time.perf_counter()
+    song_data = preprocess_music21_song(song, train, ticks_per_quarter)
+    return {
+        "song_id": song_id,
+        "train": train,
+        "seconds": time.perf_counter() - start,
+        "song_data": song_data,
+    }
+
+
+def split_preprocessed_songs(
+    preprocessed_songs: List[Dict], metrics: Optional[PipelineMetrics] = None
+) -> Tuple[List[Dict], List[Dict]]:
+    """Splits the results of preprocess_loaded_song like preprocess_music21 does."""
+    if metrics is None:
+        metrics = PipelineMetrics()
+    songs_data_train = []
+    songs_data_valid = []
+    for preprocessed_song in preprocessed_songs:
+        song_id = preprocessed_song["song_id"]
+        metrics.record_file(song_id, "preprocess", preprocessed_song["seconds"])
+        if preprocessed_song["song_data"] is None:
+            metrics.record_skip(song_id, MULTIPLE_METERS)
+        elif preprocessed_song["train"]:
+            songs_data_train.append(preprocessed_song["song_data"])
+        else:
+            songs_data_valid.append(preprocessed_song["song_data"])
+
+    logger.info(f"Using {len(songs_data_train)} for training.")
+    logger.info(f"Using {len(songs_data_valid)} for validation.")
+    return songs_data_train, songs_data_valid
+
+
+def preprocess_music21_song(song, train, ticks_per_quarter=TICKS_PER_QUARTER):
     # TODO add multiple measures
 
     # Skip songs with multiple measures
@@ -71,6 +189,8 @@ def preprocess_music21_song(song, train):
     song_data["title"] = song.metadata.title
     song_data["number"] = song.metadata.number
     song_data["genre"] = str(song.metadata.getCustom("genre")[0]).upper()
+    if song.metadata.getCustom("song_id"):
+        song_data["song_id"] = get_stream_song_id(song)
     song_data["tracks"] = []
 
     # Add the time signature to the song
@@ -91,13 +211,15 @@ def preprocess_music21_song(song, train):
         part.makeMeasures(inPlace=True)
         part.makeTies(inPlace=True)
         part.insert(0, part_instrument)
-        track_data = preprocess_music21_part(part, part_index, train)
+        track_data = preprocess_music21_part(part, part_index, train, ticks_per_quarter)
         song_data["tracks"] += [track_data]
 
     return song_data
 
 
-def preprocess_music21_part(part, part_index, train):
+def preprocess_music21_part(
+    part, part_index, train, ticks_per_quarter=TICKS_PER_QUARTER
+):
     # Get the instrument for this part.
     instrument = part.getInstrument()
     is_drum = part.partName == "Percussion"
@@ -120,19 +242,39 @@ def preprocess_music21_part(part, part_index, train):
         measure = part.measure(measure_index)
         if measure is None:
             break
-        bar_data = preprocess_music21_measure(measure, train, is_drum)
+        bar_data = preprocess_music21_measure(
+            measure, train, is_drum, ticks_per_quarter
+        )
         track_data["bars"] += [bar_data]
 
     return track_data
 
 
-def preprocess_music21_measure(measure, train, is_drum):
+def preprocess_music21_measure(
+    measure, train, is_drum, ticks_per_quarter=TICKS_PER_QUARTER
+):
     bar_data = {}
     bar_data["events"] = []
-    # Create precussion mapper
-    pm = music21.midi.percussion.PercussionMapper()
+    # The precussion mapper is built once per process
+    pm = get_percussion_mapper()
     events = []
     for event in measure.recurse():
+        # Quantize once, so everything after works with integer ticks
+        if isinstance(
+            event,
+            (
+                music21.note.Unpitched,
+                music21.percussion.PercussionChord,
+                music21.note.Note,
+                music21.chord.Chord,
+            ),
+        ):
+            start_tick = get_tick(event.offset, ticks_per_quarter)
+            end_tick = get_tick(
+                event.offset + event.duration.quarterLength, ticks_per_quarter
+            )
+            # Notes shorter than a tick still last one, so NOTE_OFF follows NOTE_ON
+            end_tick = max(end_tick, start_tick + 1)
         if is_drum:
             if isinstance(event, music21.note.Unpitched):
                 # Catch instruments that are not in GM Percussion Map
@@ -142,14 +284,8 @@ def preprocess_music21_measure(measure, train, is_drum):
                     default_perc = music21.instrument.SnareDrum()
                     per_pitch = pm.midiInstrumentToPitch(default_perc)
 
-                events += [("NOTE_ON", per_pitch.midi, 4 * event.offset)]
-                events += [
-                    (
-                        "NOTE_OFF",
-                        per_pitch.midi,
-                        4 * event.offset + 4 * event.duration.quarterLength,
-                    )
-                ]
+                events += [("NOTE_ON", per_pitch.midi, start_tick)]
+                events += [("NOTE_OFF", per_pitch.midi, end_tick)]
             if isinstance(event, music21.percussion.PercussionChord):
                 for note in event:
                     try:
@@ -157,39 +293,21 @@ def preprocess_music21_measure(measure, train, is_drum):
                     except music21.midi.percussion.MIDIPercussionException:
                         default_perc = music21.instrument.SnareDrum()
                         per_pitch = pm.midiInstrumentToPitch(default_perc)
-                    events += [("NOTE_ON", per_pitch.midi, 4 * event.offset)]
-                    events += [
-                        (
-                            "NOTE_OFF",
-                            per_pitch.midi,
-                            4 * event.offset + 4 * event.duration.quarterLength,
-                        )
-                    ]
+                    events += [("NOTE_ON", per_pitch.midi, start_tick)]
+                    events += [("NOTE_OFF", per_pitch.midi, end_tick)]
             # print(f"Drums events {dir(event)} {event.offset}")
         # E.g. note.pitch.midi: 67, note.pitch: G4, note.offset: 0.0, note.duration.quarterLength: 1.0
-        # Becomes [('NOTE_ON', 67, 0.0), ('NOTE_OFF', 67, 4.0)]
+        # Becomes [('NOTE_ON', 67, 0), ('NOTE_OFF', 67, 4)]
         # First check if it is note
         if isinstance(event, music21.note.Note):
-            events += [("NOTE_ON", event.pitch.midi, 4 * event.offset)]
-            events += [
-                (
-                    "NOTE_OFF",
-                    event.pitch.midi,
-                    4 * event.offset + 4 * event.duration.quarterLength,
-                )
-            ]
+            events += [("NOTE_ON", event.pitch.midi, start_tick)]
+            events += [("NOTE_OFF", event.pitch.midi, end_tick)]
 
         # Do same as above in case notes are considered as chords
         if isinstance(event, music21.chord.Chord):
             for note in event:
-                events += [("NOTE_ON", note.pitch.midi, 4 * event.offset)]
-                events += [
-                    (
-                        "NOTE_OFF",
-                        note.pitch.midi,
-                        4 * event.offset + 4 * event.duration.quarterLength,
-                    )
-                ]
+                events += [("NOTE_ON", note.pitch.midi, start_tick)]
+                events += [("NOTE_OFF", note.pitch.midi, end_tick)]
 
     bar_data["events"] += events_to_events_data(events)
 
@@ -0,0 +1,116 @@
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, Iterator, List
+
+if TYPE_CHECKING:
+    import numpy as np
+
+SEPARATOR_TOKEN = "PIECE_END"
+
+
+def get_offsets_path(blocks_path: Path) -> Path:
+    """Gets the file with the byte offsets of the blocks of a packed file."""
+    blocks_path = Path(blocks_path)
+    return blocks_path.with_name(blocks_path.stem + ".offsets.npy")
+
+
+def pack_token_sequences(
+    token_sequences: Iterable[List[str]],
+    context_length: int,
+    separator_token: str = SEPARATOR_TOKEN,
+) -> Iterator[List[str]]:
+    """
+    Packs token sequences into blocks of a fixed number of tokens.
+
+    Every sequence is followed by the separator token and the sequences are
+    concatenated, so a sequence may continue in the next block. Only the last
+    block may be shorter. Nothing is padded.
+
+    Args:
+        token_sequences: The token sequences, in order.
+        context_length: The number of tokens of every block.
+        separator_token: The token written after every sequence.
+
+    Returns:
+        An iterator over the blocks.
+    """
+    if context_length < 1:
+        raise ValueError("context_length must be at least 1.")
+    block = []
+    for token_sequence in token_sequences:
+        for token in [*token_sequence, separator_token]:
+            block.append(token)
+            if len(block) == context_length:
+                yield block
+                block = []
+    if block:
+        yield block
+
+
+def read_token_sequences(paths: Iterable[Path]) -> Iterator[List[str]]:
+    """Reads files with one token sequence per line, one sequence at a time."""
+    for path in paths:
+        with open(path, "r") as file:
+            for line in file:
+                yield line.split()
+
+
+def pack_token_files(
+    sequences_paths: Iterable[Path],
+    blocks_path: Path,
+    context_length: int,
+    separator_token: str = SEPARATOR_TOKEN,
+) -> int:
+    """
+    Packs the token sequence files of a split, in order, into one packed file.
+
+    The sequences of all files form a single stream, so the tokens left at
+    the end of a file continue in the next one and only the last block of
+    the split may be shorter.
+
+    Args:
+        sequences_paths: The token sequence files, in order.
+        blocks_path: The packed file to write, next to its offsets.
+        context_length: The number of tokens of every block.
+        separator_token: The token written after every sequence.
+
+    Returns:
+        The number of blocks written.
+    """
+    token_blocks = pack_token_sequences(
+        read_token_sequences(sequences_paths), context_length, separator_token
+    )
+    return save_token_blocks(token_blocks, blocks_path)
+
+
+def save_token_blocks(token_blocks: Iterable[List[str]], path: Path) -> int:
+    """
+    Writes one block per line and, next to it, the byte offset of every line.
+
+    The offsets file has one more entry than there are blocks, the size of the
+    file, so block i is bytes offsets[i] to offsets[i + 1].
+
+    Args:
+        token_blocks: The blocks of tokens.
+        path: The text file to write.
+
+    Returns:
+        The number of blocks written.
+    """
+    import numpy as np
+
+    offsets = [0]
+    with open(path, "wb") as file:
+        for token_block in token_blocks:
+            line = (" ".join(token_block) + "\n").encode("utf-8")
+            file.write(line)
+            offsets.append(offsets[-1] + len(line))
+    np.save(get_offsets_path(path), np.array(offsets, dtype=np.int64))
+    return len(offsets) - 1
+
+
+def read_token_block(path: Path, offsets: "np.ndarray", block_index: int) -> List[str]:
+    """Reads one block of a packed file without reading the blocks before it."""
+    with open(path, "rb") as file:
+        file.seek(int(offsets[block_index]))
+        line = file.read(int(offsets[block_index + 1] - offsets[block_index]))
+    return line.decode("utf-8").split()
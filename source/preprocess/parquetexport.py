@@ -0,0 +1,342 @@
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+from source.preprocess.encode import get_song_id
+from source.preprocess.vocabulary import get_token_ids
+
+# Rows of a table written to the file at once. Readers can skip whole groups
+ROW_GROUP_SIZE = 1024
+# Rows of a Parquet file. Fuller files are rolled over to the next one
+MAX_FILE_ROWS = 100_000
+SPLITS = ["train", "valid"]
+
+
+def get_songs_schema():
+    """The columns of the songs table. pyarrow is imported when it is needed."""
+    import pyarrow as pa
+
+    track_type = pa.struct(
+        [
+            ("name", pa.string()),
+            ("instrument", pa.string()),
+            ("bars", pa.int32()),
+            ("notes", pa.int32()),
+        ]
+    )
+    return pa.schema(
+        [
+            ("song_id", pa.string()),
+            ("title", pa.string()),
+            ("split", pa.string()),
+            ("genre", pa.string()),
+            ("time_signature", pa.string()),
+            ("num_tracks", pa.int32()),
+            ("num_bars", pa.int32()),
+            ("tracks", pa.list_(track_type)),
+        ]
+    )
+
+
+def get_sequences_schema():
+    """The columns of the sequences table."""
+    import pyarrow as pa
+
+    return pa.schema(
+        [
+            ("song_id", pa.string()),
+            ("split", pa.string()),
+            ("bar_start", pa.int32()),
+            ("bar_end", pa.int32()),
+            ("transposition", pa.int32()),
+            ("num_tokens", pa.int32()),
+            ("token_ids", pa.list_(pa.int32())),
+        ]
+    )
+
+
+def get_song_row(song_data: Dict, split: str) -> Dict:
+    """Summarizes a song as returned by preprocess_music21_song in a row."""
+    tracks = []
+    for track_data in song_data["tracks"]:
+        notes = 0
+        for bar_data in track_data["bars"]:
+            notes += sum(
+                1 for event in bar_data["events"] if event["type"] == "NOTE_ON"
+            )
+        tracks.append(
+            {
+                "name": track_data["name"],
+                # The value of the INST token of the track
+                "instrument": str(track_data["midi_program"]),
+                "bars": len(track_data["bars"]),
+                "notes": notes,
+            }
+        )
+    return {
+        "song_id": get_song_id(song_data),
+        "title": song_data["title"],
+        "split": split,
+        "genre": song_data["genre"],
+        "time_signature": f"{song_data['time_signature_numerator']}_"
+        f"{song_data['time_signature_denominator']}",
+        "num_tracks": len(tracks),
+        "num_bars": max((track["bars"] for track in tracks), default=0),
+        "tracks": tracks,
+    }
+
+
+class ParquetTableWriter:
+    """
+    Writes the rows of a table to Parquet files of max_file_rows rows each,
+    {name}-00000.parquet, {name}-00001.parquet and so on.
+
+    A Parquet file can only be read once it is closed, so the rows of the
+    file being filled are spooled to an Arrow stream first, _{name}-00001.arrows.
+    The spool is converted to Parquet, in row groups of row_group_size rows,
+    when the file is full or the writer is closed. pyarrow.dataset skips files
+    that start with _, so the folder reads as one table at any time.
+
+    A writer created with the rows written before, as returned by rows at
+    the last checkpoint, drops the rows written after it and continues.
+    """
+
+    def __init__(
+        self,
+        folder: str,
+        name: str,
+        schema,
+        row_group_size: int = ROW_GROUP_SIZE,
+        max_file_rows: int = MAX_FILE_ROWS,
+        rows: int = 0,
+    ) -> None:
+        self.folder = folder
+        self.name = name
+        self.schema = schema
+        self.row_group_size = row_group_size
+        self.max_file_rows = max_file_rows
+        self.rows = rows
+        self._spool = None
+        self._spool_writer = None
+        self._part, self._part_rows = divmod(rows, max_file_rows)
+        os.makedirs(folder, exist_ok=True)
+        self._restore()
+
+    def get_part_path(self, part: int) -> str:
+        return os.path.join(self.folder, f"{self.name}-{part:05d}.parquet")
+
+    def _get_spool_path(self, part: int) -> str:
+        return os.path.join(self.folder, f"_{self.name}-{part:05d}.arrows")
+
+    def _restore(self) -> None:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        # The rows of the current file that were written before the checkpoint
+        batches = []
+        if self._part_rows > 0:
+            spool_path = self._get_spool_path(self._part)
+            if os.path.exists(spool_path):
+                batches = _read_stream_batches(spool_path, self._part_rows)
+            elif os.path.exists(self.get_part_path(self._part)):
+                batches = pq.read_table(self.get_part_path(self._part)).to_batches()
+            table = pa.Table.from_batches(batches, schema=self.schema)
+            if table.num_rows < self._part_rows:
+                raise ValueError(
+                    f"{self.name} has {table.num_rows} of the {self.rows} rows "
+                    "written before, delete the Parquet files to export again."
+                )
+            batches = table.slice(0, self._part_rows).to_batches()
+
+        # Everything written after the checkpoint is written again
+        for file_name in os.listdir(self.folder):
+            part = _get_part(file_name, self.name)
+            if part is not None and part >= self._part:
+                os.remove(os.path.join(self.folder, file_name))
+        if batches:
+            self._open_spool()
+            for batch in batches:
+                self._spool_writer.write_batch(batch)
+
+    def _open_spool(self) -> None:
+        import pyarrow as pa
+
+        self._spool = pa.OSFile(self._get_spool_path(self._part), "wb")
+        self._spool_writer = pa.ipc.new_stream(self._spool, self.schema)
+
+    def _close_spool(self) -> None:
+        self._spool_writer.close()
+        self._spool.close()
+        self._spool_writer = None
+        self._spool = None
+
+    def write_rows(self, rows: List[Dict]) -> None:
+        import pyarrow as pa
+
+        while rows:
+            part_rows = rows[: self.max_file_rows - self._part_rows]
+            rows = rows[len(part_rows) :]
+            if self._spool_writer is None:
+                self._open_spool()
+            self._spool_writer.write_table(
+                pa.Table.from_pylist(part_rows, schema=self.schema)
+            )
+            self._part_rows += len(part_rows)
+            self.rows += len(part_rows)
+            if self._part_rows == self.max_file_rows:
+                self._finish_part()
+
+    def _finish_part(self) -> None:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        spool_path = self._get_spool_path(self._part)
+        temporary_path = os.path.join(self.folder, f"_{self.name}.parquet.tmp")
+        self._close_spool()
+        # Read one batch at a time, so only a row group is kept in memory
+        with pq.ParquetWriter(temporary_path, self.schema) as writer:
+            pending = []
+            pending_rows = 0
+            with pa.OSFile(spool_path, "rb") as spool:
+                for batch in pa.ipc.open_stream(spool):
+                    pending.append(batch)
+                    pending_rows += batch.num_rows
+                    while pending_rows >= self.row_group_size:
+                        table = pa.Table.from_batches(pending, schema=self.schema)
+                        writer.write_table(table.slice(0, self.row_group_size))
+                        pending = table.slice(self.row_group_size).to_batches()
+                        pending_rows -= self.row_group_size
+            if pending_rows > 0:
+                writer.write_table(pa.Table.from_batches(pending, schema=self.schema))
+        os.replace(temporary_path, self.get_part_path(self._part))
+        os.remove(spool_path)
+        self._part += 1
+        self._part_rows = 0
+
+    def close(self) -> None:
+        """Writes the file being filled. A table without rows gets an empty file."""
+        import pyarrow.parquet as pq
+
+        if self._spool_writer is not None:
+            self._finish_part()
+        elif self.rows == 0:
+            pq.write_table(self.schema.empty_table(), self.get_part_path(0))
+
+
+def _get_part(file_name: str, name: str) -> Optional[int]:
+    """Gets the file index of a Parquet file or spool of a table."""
+    match = re.fullmatch(rf"_?{re.escape(name)}-(\d+)\.(parquet|arrows)", file_name)
+    return int(match.group(1)) if match else None
+
+
+def _read_stream_batches(path: str, num_rows: int) -> List:
+    """Reads the first batches of a spool, which may end in a cut batch."""
+    import pyarrow as pa
+
+    batches = []
+    with pa.OSFile(path, "rb") as spool:
+        reader = pa.ipc.open_stream(spool)
+        while sum(batch.num_rows for batch in batches) < num_rows:
+            try:
+                batches.append(reader.read_next_batch())
+            except (StopIteration, pa.ArrowInvalid):
+                break
+    return batches
+
+
+class ParquetExporter:
+    """
+    Exports the songs and the token sequences of a run to Parquet, under
+    parquet/songs and parquet/sequences in the dataset folder.
+
+    The writers stay open across iterations, so files fill up to
+    max_file_rows rows in row groups of row_group_size rows, however small
+    the batches are. Every split has its own files, e.g. train-00000.parquet,
+    and a split column. Read a folder as one table, e.g. with
+    pyarrow.parquet.read_table or pandas.read_parquet.
+    """
+
+    def __init__(
+        self,
+        dataset_path: str,
+        vocabulary: Dict[str, int],
+        row_group_size: int = ROW_GROUP_SIZE,
+        max_file_rows: int = MAX_FILE_ROWS,
+        rows: Optional[Dict[str, int]] = None,
+    ) -> None:
+        """
+        Args:
+            dataset_path: The dataset folder.
+            vocabulary: The token ids.
+            row_group_size: The rows of a row group.
+            max_file_rows: The rows of a file.
+            rows: The rows written before by every writer, as returned by
+                get_rows at the last checkpoint. None starts over.
+        """
+        rows = rows or {}
+        self.vocabulary = vocabulary
+        self.writers = {}
+        for table, schema in [
+            ("songs", get_songs_schema()),
+            ("sequences", get_sequences_schema()),
+        ]:
+            for split in SPLITS:
+                self.writers[f"{table}/{split}"] = ParquetTableWriter(
+                    os.path.join(dataset_path, "parquet", table),
+                    split,
+                    schema,
+                    row_group_size,
+                    max_file_rows,
+                    rows.get(f"{table}/{split}", 0),
+                )
+
+    def get_rows(self) -> Dict[str, int]:
+        """The rows written by every writer, to resume from after a checkpoint."""
+        return {key: writer.rows for key, writer in self.writers.items()}
+
+    def write_songs(self, songs_data: List[Dict], split: str) -> None:
+        """Adds songs. Call it before encoding them, bar fill changes the bars."""
+        self.writers[f"songs/{split}"].write_rows(
+            [get_song_row(song_data, split) for song_data in songs_data]
+        )
+
+    def write_sequences(
+        self,
+        token_sequences: List[List[str]],
+        sequence_windows: List[Tuple[str, int, int, int]],
+        split: str,
+    ) -> None:
+        """
+        Adds token sequences as token ids.
+
+        Args:
+            token_sequences: The token sequences.
+            sequence_windows: The song id, first bar, bar after the last bar
+                and transposition of every sequence, as filled by encode_songs_data.
+            split: The split of the sequences.
+        """
+        rows = []
+        for token_sequence, window in zip(token_sequences, sequence_windows):
+            song_id, bar_start_index, bar_end_index, transposition = window
+            rows.append(
+                {
+                    "song_id": song_id,
+                    "split": split,
+                    "bar_start": bar_start_index,
+                    "bar_end": bar_end_index,
+                    "transposition": transposition,
+                    "num_tokens": len(token_sequence),
+                    "token_ids": get_token_ids(token_sequence, self.vocabulary),
+                }
+            )
+        self.writers[f"sequences/{split}"].write_rows(rows)
+
+    def close(self) -> None:
+        for writer in self.writers.values():
+            writer.close()
+
+    def __enter__(self) -> "ParquetExporter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
@@ -14,22 +14,46 @@
 # limitations under the License.
 
 # Lint as: python3
-from music21 import stream
+import math
+from typing import TYPE_CHECKING
+
+# Only for annotations. music21 takes long to import
+if TYPE_CHECKING:
+    from music21 import stream
+
+
+# Ticks per quarter note of the time grid. 4 ticks are a sixteenth note each
+TICKS_PER_QUARTER = 4
+
+
+def get_tick(offset, ticks_per_quarter=TICKS_PER_QUARTER):
+    """
+    Quantizes an offset in quarter notes to the integer tick grid.
+
+    Args:
+        offset: The offset in quarter notes, e.g. a music21 Fraction.
+        ticks_per_quarter: The resolution of the grid.
+
+    Returns:
+        The nearest tick, an int. Halves round up, so evenly spaced notes
+        between ticks stay evenly spaced.
+    """
+    return math.floor(offset * ticks_per_quarter + 0.5)
 
 
 def events_to_events_data(events):
-    # Ensure right order. Float to deal with music21 Fractions
-    events = sorted(events, key=lambda event: float(event[2]))
+    # Ensure right order. Times are integer ticks
+    events = sorted(events, key=lambda event: event[2])
 
     events_data = []
     for event_index, event, event_next in zip(
         range(len(events)), events, events[1:] + [None]
     ):
         # event_index  event                    event_next
-        # 0            ('NOTE_ON', 67, 0.0)     ('NOTE_OFF', 67, 4.0)
-        # 1            ('NOTE_OFF', 67, 4.0)    None
-        if event_index == 0 and event[2] != 0.0:
-            event_data = {"type": "TIME_DELTA", "delta": float(event[2])}
+        # 0            ('NOTE_ON', 67, 0)       ('NOTE_OFF', 67, 4)
+        # 1            ('NOTE_OFF', 67, 4)      None
+        if event_index == 0 and event[2] != 0:
+            event_data = {"type": "TIME_DELTA", "delta": event[2]}
             events_data += [event_data]
 
         event_data = {"type": event[0], "pitch": event[1]}
@@ -40,19 +64,19 @@ def events_to_events_data(events):
 
         delta = event_next[2] - event[2]
         assert delta >= 0, events
-        if delta != 0.0:
-            event_data = {"type": "TIME_DELTA", "delta": float(delta)}
+        if delta != 0:
+            event_data = {"type": "TIME_DELTA", "delta": delta}
             events_data += [event_data]
 
     # events_data
-    # {'events': [{'type': 'NOTE_ON', 'pitch': 67}, {'type': 'TIME_DELTA', 'delta': 4.0},
+    # {'events': [{'type': 'NOTE_ON', 'pitch': 67}, {'type': 'TIME_DELTA', 'delta': 4},
     # {'type': 'NOTE_OFF', 'pitch': 67}]}, {'events': [{'type': 'NOTE_ON', 'pitch': 67},
-    # {'type': 'TIME_DELTA', 'delta': 8.0}
+    # {'type': 'TIME_DELTA', 'delta': 8}
 
     return events_data
 
 
-def keep_first_eight_measures(score: stream.Score) -> stream.Score:
+def keep_first_eight_measures(score: "stream.Score") -> "stream.Score":
     # Create a new score for the output
     new_score = score.measures(1, 8)
     return new_score
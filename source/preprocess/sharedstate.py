@@ -0,0 +1,92 @@
+import csv
+import json
+import functools
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from source.preprocess.preprocessutilities import TICKS_PER_QUARTER
+from source.preprocess.vocabulary import build_vocabulary
+
+GENRE_FILE = Path(__file__).parent / "loading" / "lmd_genres.csv"
+
+# Read-only state used by every song. Each getter builds its value once per
+# process. Calling warm_up in the parent before forking workers lets them
+# share the values copy-on-write instead of building them again.
+
+
+def get_genre_map(genre_file: Path = GENRE_FILE) -> Dict[str, str]:
+    """Reads the genre of every artist. The first row of an artist wins."""
+    # Cached by the full path, so every way of naming the file shares the map
+    return _read_genre_map(Path(genre_file).resolve())
+
+
+@functools.lru_cache(maxsize=None)
+def _read_genre_map(genre_file: Path) -> Dict[str, str]:
+    genre_map = {}
+    with open(genre_file, "r", newline="") as file:
+        for row in csv.DictReader(file):
+            genre_map.setdefault(row["Artist"], row["Genre_ChatGPT"])
+    return genre_map
+
+
+@functools.lru_cache(maxsize=None)
+def get_percussion_mapper():
+    """Gets the mapper from General MIDI percussion instruments to pitches."""
+    from music21.midi.percussion import PercussionMapper
+
+    return PercussionMapper()
+
+
+def get_vocabulary(
+    density_bins_number: int = 5,
+    ticks_per_quarter: int = TICKS_PER_QUARTER,
+    genre_file: Path = GENRE_FILE,
+) -> Dict[str, int]:
+    """Gets the vocabulary for the genres of genre_file. See build_vocabulary."""
+    return _build_vocabulary(
+        density_bins_number, ticks_per_quarter, Path(genre_file).resolve()
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _build_vocabulary(
+    density_bins_number: int, ticks_per_quarter: int, genre_file: Path
+) -> Dict[str, int]:
+    genres = set(get_genre_map(genre_file).values())
+    return build_vocabulary(genres, density_bins_number, ticks_per_quarter)
+
+
+def load_density_bins(density_bins_path: Path) -> List[float]:
+    """Reads density bins saved with a dataset, e.g. by merge_dataset_mmm.py."""
+    return _read_density_bins(Path(density_bins_path).resolve())
+
+
+@functools.lru_cache(maxsize=None)
+def _read_density_bins(density_bins_path: Path) -> List[float]:
+    with open(density_bins_path, "r") as file:
+        return json.load(file)["bins"]
+
+
+def warm_up(
+    genre_file: Path = GENRE_FILE,
+    density_bins_number: int = 5,
+    ticks_per_quarter: int = TICKS_PER_QUARTER,
+    density_bins_path: Optional[Path] = None,
+) -> None:
+    """
+    Imports music21 and builds the shared state, so processes forked after
+    this call start with everything ready.
+
+    Args:
+        genre_file: The CSV with the genre of every artist.
+        density_bins_number: The number of density bins of the vocabulary.
+        ticks_per_quarter: The resolution of the time grid of the vocabulary.
+        density_bins_path: Optional density bins to load.
+    """
+    import music21.converter  # noqa: F401
+
+    get_genre_map(genre_file)
+    get_percussion_mapper()
+    get_vocabulary(density_bins_number, ticks_per_quarter, genre_file)
+    if density_bins_path is not None:
+        load_density_bins(density_bins_path)
@@ -0,0 +1,37 @@
+from source.hashing import stable_hash
+
+SPLIT_KEYS = ["path", "song", "artist"]
+
+# Resolution of the validation ratio
+SPLIT_BUCKETS = 10000
+
+
+def get_split_key(song_id: str, split_key: str = "artist") -> str:
+    """
+    Gets the part of the song id that decides the split.
+
+    Args:
+        song_id: The artist folder and file name of the song, e.g. "ABBA/Chiquitita.1.mid".
+        split_key: "path" uses the whole id, "song" drops the variant suffix of the
+            file name so "Chiquitita.1.mid" and "Chiquitita.2.mid" go together, and
+            "artist" keeps all the songs of an artist together.
+
+    Returns:
+        The key to hash.
+    """
+    if split_key == "path":
+        return song_id
+    artist, _, file_name = song_id.rpartition("/")
+    if split_key == "song":
+        return f"{artist}/{file_name.split('.')[0]}"
+    if split_key == "artist":
+        return artist or file_name.split(".")[0]
+    raise ValueError(f"Unexpected split key {split_key}. Use one of {SPLIT_KEYS}")
+
+
+def is_validation_song(
+    song_id: str, valid_ratio: float = 0.2, split_key: str = "artist"
+) -> bool:
+    """Decides if a song goes to validation from a stable hash of its split key."""
+    bucket = stable_hash("split", get_split_key(song_id, split_key)) % SPLIT_BUCKETS
+    return bucket < valid_ratio * SPLIT_BUCKETS
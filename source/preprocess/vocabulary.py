@@ -0,0 +1,63 @@
+from typing import Dict, Iterable, List
+
+from source.preprocess.preprocessutilities import TICKS_PER_QUARTER
+
+PAD_TOKEN = "[PAD]"
+UNKNOWN_TOKEN = "[UNK]"
+STRUCTURE_TOKENS = [
+    "PIECE_START",
+    "PIECE_END",
+    "TRACK_START",
+    "TRACK_END",
+    "BAR_START",
+    "BAR_END",
+    "FILL_START",
+    "FILL_IN",
+    "FILL_END",
+]
+TIME_SIGNATURE_DENOMINATORS = [1, 2, 4, 8, 16]
+# Longest TIME_DELTA, in quarter notes. No bar of a supported meter is longer
+MAX_BAR_QUARTERS = 16
+
+
+def build_vocabulary(
+    genres: Iterable[str],
+    density_bins_number: int = 5,
+    ticks_per_quarter: int = TICKS_PER_QUARTER,
+) -> Dict[str, int]:
+    """
+    Lists every token the encoder can write and gives each one an id.
+
+    Args:
+        genres: The genres of the songs, as in lmd_genres.csv.
+        density_bins_number: The number of density bins.
+        ticks_per_quarter: The resolution of the time grid.
+
+    Returns:
+        The id of every token. The padding token is 0 and the unknown token is 1.
+    """
+    tokens = [PAD_TOKEN, UNKNOWN_TOKEN] + STRUCTURE_TOKENS
+    tokens += [
+        f"TIME_SIGNATURE={numerator}_{denominator}"
+        for denominator in TIME_SIGNATURE_DENOMINATORS
+        for numerator in range(1, MAX_BAR_QUARTERS + 1)
+    ]
+    # Songs of artists without a genre are in OTHER
+    genre_tokens = {f"GENRE={genre.upper()}" for genre in genres} | {"GENRE=OTHER"}
+    tokens += sorted(genre_tokens)
+    tokens += [f"INST={program}" for program in range(128)] + ["INST=DRUMS"]
+    # Densities go from 0 to the number of bin edges, which is at most the bins
+    tokens += [f"DENSITY={density}" for density in range(density_bins_number + 1)]
+    tokens += [f"NOTE_ON={pitch}" for pitch in range(128)]
+    tokens += [f"NOTE_OFF={pitch}" for pitch in range(128)]
+    tokens += [
+        f"TIME_DELTA={delta}"
+        for delta in range(1, MAX_BAR_QUARTERS * ticks_per_quarter + 1)
+    ]
+    return {token: token_id for token_id, token in enumerate(tokens)}
+
+
+def get_token_ids(tokens: List[str], vocabulary: Dict[str, int]) -> List[int]:
+    """Converts tokens to their ids. Tokens out of the vocabulary get the unknown id."""
+    unknown_id = vocabulary[UNKNOWN_TOKEN]
+    return [vocabulary.get(token, unknown_id) for token in tokens]
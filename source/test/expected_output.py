@@ -10,32 +10,32 @@ json_output = {
                 {
                     "events": [
                         {"pitch": 60, "type": "NOTE_ON"},
-                        {"delta": 4.0, "type": "TIME_DELTA"},
+                        {"delta": 4, "type": "TIME_DELTA"},
                         {"pitch": 60, "type": "NOTE_OFF"},
                         {"pitch": 60, "type": "NOTE_ON"},
-                        {"delta": 4.0, "type": "TIME_DELTA"},
+                        {"delta": 4, "type": "TIME_DELTA"},
                         {"pitch": 60, "type": "NOTE_OFF"},
                         {"pitch": 60, "type": "NOTE_ON"},
-                        {"delta": 4.0, "type": "TIME_DELTA"},
+                        {"delta": 4, "type": "TIME_DELTA"},
                         {"pitch": 60, "type": "NOTE_OFF"},
                         {"pitch": 60, "type": "NOTE_ON"},
-                        {"delta": 4.0, "type": "TIME_DELTA"},
+                        {"delta": 4, "type": "TIME_DELTA"},
                         {"pitch": 60, "type": "NOTE_OFF"},
                     ]
                 },
                 {
                     "events": [
                         {"pitch": 62, "type": "NOTE_ON"},
-                        {"delta": 4.0, "type": "TIME_DELTA"},
+                        {"delta": 4, "type": "TIME_DELTA"},
                         {"pitch": 62, "type": "NOTE_OFF"},
                         {"pitch": 62, "type": "NOTE_ON"},
-                        {"delta": 4.0, "type": "TIME_DELTA"},
+                        {"delta": 4, "type": "TIME_DELTA"},
                         {"pitch": 62, "type": "NOTE_OFF"},
                         {"pitch": 62, "type": "NOTE_ON"},
-                        {"delta": 4.0, "type": "TIME_DELTA"},
+                        {"delta": 4, "type": "TIME_DELTA"},
                         {"pitch": 62, "type": "NOTE_OFF"},
                         {"pitch": 62, "type": "NOTE_ON"},
-                        {"delta": 4.0, "type": "TIME_DELTA"},
+                        {"delta": 4, "type": "TIME_DELTA"},
                         {"pitch": 62, "type": "NOTE_OFF"},
                     ]
                 },
@@ -49,18 +49,18 @@ json_output = {
                 {
                     "events": [
                         {"pitch": 64, "type": "NOTE_ON"},
-                        {"delta": 4.0, "type": "TIME_DELTA"},
+                        {"delta": 4, "type": "TIME_DELTA"},
                         {"pitch": 64, "type": "NOTE_OFF"},
                         {"pitch": 64, "type": "NOTE_ON"},
-                        {"delta": 4.0, "type": "TIME_DELTA"},
+                        {"delta": 4, "type": "TIME_DELTA"},
                         {"pitch": 64, "type": "NOTE_OFF"},
                         {"pitch": 64, "type": "NOTE_ON"},
-                        {"delta": 4.0, "type": "TIME_DELTA"},
+                        {"delta": 4, "type": "TIME_DELTA"},
                         {"pitch": 64, "type": "NOTE_OFF"},
                         {"pitch": 62, "type": "NOTE_ON"},
                         {"pitch": 66, "type": "NOTE_ON"},
                         {"pitch": 69, "type": "NOTE_ON"},
-                        {"delta": 4.0, "type": "TIME_DELTA"},
+                        {"delta": 4, "type": "TIME_DELTA"},
                         {"pitch": 62, "type": "NOTE_OFF"},
                         {"pitch": 66, "type": "NOTE_OFF"},
                         {"pitch": 69, "type": "NOTE_OFF"},
@@ -69,18 +69,18 @@ json_output = {
                 {
                     "events": [
                         {"pitch": 65, "type": "NOTE_ON"},
-                        {"delta": 4.0, "type": "TIME_DELTA"},
+                        {"delta": 4, "type": "TIME_DELTA"},
                         {"pitch": 65, "type": "NOTE_OFF"},
                         {"pitch": 65, "type": "NOTE_ON"},
-                        {"delta": 4.0, "type": "TIME_DELTA"},
+                        {"delta": 4, "type": "TIME_DELTA"},
                         {"pitch": 65, "type": "NOTE_OFF"},
                         {"pitch": 65, "type": "NOTE_ON"},
-                        {"delta": 4.0, "type": "TIME_DELTA"},
+                        {"delta": 4, "type": "TIME_DELTA"},
                         {"pitch": 65, "type": "NOTE_OFF"},
                         {"pitch": 62, "type": "NOTE_ON"},
                         {"pitch": 66, "type": "NOTE_ON"},
                         {"pitch": 69, "type": "NOTE_ON"},
-                        {"delta": 4.0, "type": "TIME_DELTA"},
+                        {"delta": 4, "type": "TIME_DELTA"},
                         {"pitch": 62, "type": "NOTE_OFF"},
                         {"pitch": 66, "type": "NOTE_OFF"},
                         {"pitch": 69, "type": "NOTE_OFF"},
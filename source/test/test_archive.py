@@ -0,0 +1,67 @@
+import tarfile
+import zipfile
+
+from source.benchmark.syntheticcorpus import generate_corpus
+from source.preprocess.loading.archive import ArchiveReader, is_archive
+from source.preprocess.loading.loaderiterator import LoaderIterator
+from source.preprocess.loading.serialization import Music21Serializer
+
+
+def make_archives(tmp_path):
+    midi_folder = tmp_path / "midi"
+    midi_paths = sorted(generate_corpus(midi_folder, num_files=4))
+    tar_path = tmp_path / "midi.tar.gz"
+    with tarfile.open(tar_path, "w:gz") as tar:
+        for midi_path in midi_paths:
+            tar.add(midi_path, "./" + midi_path.relative_to(midi_folder).as_posix())
+        tar.add(tmp_path / "midi", "folder_entry", recursive=False)
+    zip_path = tmp_path / "midi.zip"
+    with zipfile.ZipFile(zip_path, "w") as zip_file:
+        for midi_path in midi_paths:
+            zip_file.write(midi_path, midi_path.relative_to(midi_folder).as_posix())
+    return midi_folder, midi_paths, tar_path, zip_path
+
+
+def test_archive_reader(tmp_path):
+    midi_folder, midi_paths, tar_path, zip_path = make_archives(tmp_path)
+    assert is_archive(tar_path) and is_archive(zip_path)
+    assert not is_archive(midi_folder)
+
+    for archive_path in [tar_path, zip_path]:
+        archive_reader = ArchiveReader(archive_path)
+        assert archive_reader.member_paths == [
+            archive_path / midi_path.relative_to(midi_folder)
+            for midi_path in midi_paths
+        ]
+        # Reading backwards starts over in tar archives
+        for index in [0, 2, 1, 3]:
+            member_path = archive_reader.member_paths[index]
+            assert archive_reader.read(member_path) == midi_paths[index].read_bytes()
+            assert archive_reader.get_size(member_path) == len(
+                midi_paths[index].read_bytes()
+            )
+        assert archive_reader.read(archive_path / "Artist/missing.mid") is None
+        archive_reader.close()
+
+
+def test_loop_through_archive(tmp_path):
+    _, midi_paths, tar_path, _ = make_archives(tmp_path)
+    expected = [
+        [stream.metadata.getCustom("song_id") for stream in data]
+        for data in LoaderIterator(Music21Serializer(), 3, midi_paths)
+    ]
+    archive_reader = ArchiveReader(tar_path)
+
+    for prefetch_files in [0, 2]:
+        loader_iterator = LoaderIterator(
+            Music21Serializer(),
+            3,
+            archive_reader.member_paths,
+            prefetch_files=prefetch_files,
+            archive_reader=archive_reader,
+        )
+        loaded = [
+            [stream.metadata.getCustom("song_id") for stream in data]
+            for data in loader_iterator
+        ]
+        assert loaded == expected
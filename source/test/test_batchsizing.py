@@ -0,0 +1,38 @@
+from source.preprocess.loading import batchsizing
+from source.preprocess.loading.batchsizing import BatchMemoryBudget
+
+
+def test_get_batch_size(monkeypatch):
+    monkeypatch.setattr(batchsizing, "get_rss", lambda: 1000)
+    budget = BatchMemoryBudget(max_batch_memory=1000, expansion_factor=10)
+
+    assert budget.get_batch_size([30, 30, 30, 30], max_files=10) == 3
+    assert budget.get_batch_size([30, 30, 30, 30], max_files=2) == 2
+    # A file over the budget still gets a batch of its own
+    assert budget.get_batch_size([500, 30], max_files=10) == 1
+    assert budget.get_batch_size([], max_files=10) == 0
+
+    # Memory kept since the first batch is taken from the budget
+    monkeypatch.setattr(batchsizing, "get_rss", lambda: 1400)
+    assert budget.get_batch_size([30, 30, 30, 30], max_files=10) == 2
+    # And batches shrink to one file when it approaches the limit
+    monkeypatch.setattr(batchsizing, "get_rss", lambda: 1950)
+    assert budget.get_batch_size([1, 1, 1], max_files=10) == 1
+
+
+def test_expansion_factor_is_measured(monkeypatch):
+    monkeypatch.setattr(batchsizing, "get_rss", lambda: 1000)
+    monkeypatch.setattr(batchsizing, "reset_peak_rss", lambda: True)
+    budget = BatchMemoryBudget(max_batch_memory=10000, expansion_factor=10)
+
+    # Larger batches than expected raise the factor at once
+    monkeypatch.setattr(batchsizing, "get_peak_rss_since_reset", lambda: 3000)
+    budget.start_batch(batch_bytes=100)
+    budget.finish_batch()
+    assert budget.expansion_factor == 20
+
+    # Smaller ones lower it slowly
+    monkeypatch.setattr(batchsizing, "get_peak_rss_since_reset", lambda: 1500)
+    budget.start_batch(batch_bytes=100)
+    budget.finish_batch()
+    assert budget.expansion_factor == 17
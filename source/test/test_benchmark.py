@@ -0,0 +1,101 @@
+from music21 import meter, note, stream
+
+from source.benchmark.syntheticcorpus import generate_corpus
+from source.benchmark.stages import (
+    compare_results,
+    get_percentile,
+    run_stages,
+    time_song_transfer,
+    time_tokenize_latency,
+    time_worker_startup,
+)
+from source.preprocess.loading.serialization import Music21Serializer
+from source.preprocess.music21lmd import preprocess_music21_song
+
+
+def test_generate_corpus(tmp_path):
+    paths = generate_corpus(tmp_path, num_files=4, num_artists=2)
+
+    assert len(paths) == 4
+    assert {path.parent.name for path in paths} == {
+        "Synthetic Artist 0",
+        "Synthetic Artist 1",
+    }
+    assert all(path.read_bytes().startswith(b"MThd") for path in paths)
+
+    # Same seed, same files
+    other_paths = generate_corpus(tmp_path / "other", num_files=4, num_artists=2)
+    assert [path.read_bytes() for path in paths] == [
+        path.read_bytes() for path in other_paths
+    ]
+
+
+def test_run_stages(tmp_path):
+    paths = generate_corpus(tmp_path, num_files=2, num_tracks=3, notes_per_bar=4)
+
+    run = run_stages(paths, Music21Serializer())
+
+    assert run["songs"] == 2
+    assert run["tokens"] > 0
+    assert set(run["seconds"]) == {
+        "load",
+        "preprocess",
+        "density_bins",
+        "encode",
+        "write",
+    }
+
+
+def test_compare_results():
+    baseline = {"stages": {"load": {"seconds": 1.0}, "encode": {"seconds": 1.0}}}
+    current = {"stages": {"load": {"seconds": 1.05}, "encode": {"seconds": 1.5}}}
+
+    regressions = compare_results(baseline, current, tolerance=0.1)
+
+    assert len(regressions) == 1
+    assert regressions[0].startswith("encode")
+
+
+def test_time_worker_startup():
+    seconds = time_worker_startup(1, "fork")
+
+    assert len(seconds) == 1
+    assert seconds[0] > 0
+
+
+def test_time_tokenize_latency(tmp_path):
+    paths = generate_corpus(tmp_path, num_files=2, num_tracks=2, notes_per_bar=4)
+    # A first file that is rejected does not stop the warm up
+    two_meters = stream.Stream()
+    for time_signature, quarter_length in [("4/4", 4), ("3/4", 3)]:
+        two_meters.append(meter.TimeSignature(time_signature))
+        two_meters.append(note.Note("C4", quarterLength=quarter_length))
+    two_meters.write("midi", tmp_path / "two_meters.mid")
+    paths.insert(0, tmp_path / "two_meters.mid")
+
+    latency = time_tokenize_latency(paths, repeats=2)
+
+    assert latency["calls"] == 6
+    assert 0 < latency["p50_seconds"] <= latency["p99_seconds"]
+    assert get_percentile([3.0, 1.0, 2.0, 4.0], 50) == 2.0
+    assert get_percentile([3.0, 1.0, 2.0, 4.0], 99) == 4.0
+
+
+def test_time_song_transfer(tmp_path):
+    paths = generate_corpus(tmp_path, num_files=2, num_tracks=2, notes_per_bar=4)
+    serializer = Music21Serializer()
+    songs_data = [
+        preprocess_music21_song(serializer.load(path), train=True) for path in paths
+    ]
+
+    transfer = time_song_transfer(songs_data, repeats=1)
+
+    assert transfer["songs"] == 2
+    assert transfer["pickle_bytes"] > 0
+    assert transfer["shared_memory_bytes"] > 0
+    assert (
+        0
+        < transfer["shared_memory_seconds"]
+        <= transfer["shared_memory_encode_seconds"]
+    )
+    assert 0 < transfer["pickle_seconds"] <= transfer["pickle_encode_seconds"]
@@ -0,0 +1,161 @@
+import copy
+import itertools
+import multiprocessing
+
+import numpy as np
+import pytest
+
+from source.preprocess.columnar import (
+    ColumnarSong,
+    encode_columnar_songs,
+    get_columnar_density_distribution,
+    read_shared_songs,
+    share_songs,
+)
+from source.preprocess.dedup import WindowDeduplicator
+from source.preprocess.encode import encode_songs_data, get_density_distribution
+from source.test.expected_output import json_output
+
+
+def get_songs_data():
+    song_a = copy.deepcopy(json_output)
+    song_a["song_id"] = "Artist/Song A.mid"
+    song_b = copy.deepcopy(json_output)
+    song_b["song_id"] = "Artist/Song B.mid"
+    song_b["tracks"][1]["midi_program"] = "DRUMS"
+    song_b["tracks"][0]["bars"][0]["events"][0]["pitch"] += 1
+    # Same content as song A, for the deduplication of windows
+    song_c = copy.deepcopy(song_a)
+    song_c["song_id"] = "Artist/Song C.mid"
+    return [song_a, song_b, song_c]
+
+
+def _read_in_child(name, queue):
+    queue.put(
+        read_shared_songs(name, lambda songs: [song.to_song_data() for song in songs])
+    )
+
+
+def test_columnar_song_round_trip():
+    songs_data = get_songs_data()
+    columnar_songs = [
+        ColumnarSong.from_song_data(song_data) for song_data in songs_data
+    ]
+
+    assert [columnar_song.to_song_data() for columnar_song in columnar_songs] == (
+        songs_data
+    )
+    assert columnar_songs[1].get_bars_number() == 2
+    event_types, event_values = columnar_songs[0].get_bar_events(1, 1)
+    assert len(event_types) == len(json_output["tracks"][1]["bars"][1]["events"])
+    assert event_values.dtype == np.int32
+
+
+def test_share_songs_in_another_process():
+    songs_data = get_songs_data()
+    block = share_songs(songs_data)
+    try:
+        context = multiprocessing.get_context("fork")
+        queue = context.Queue()
+        process = context.Process(target=_read_in_child, args=(block.name, queue))
+        process.start()
+        assert queue.get() == songs_data
+        process.join()
+        assert process.exitcode == 0
+
+        # The block outlives the reader, which must not unlink it
+        assert read_shared_songs(block.name, len) == len(songs_data)
+    finally:
+        block.close()
+        block.unlink()
+
+
+def test_read_shared_songs_releases_the_arrays():
+    block = share_songs(get_songs_data())
+    kept_songs = []
+    try:
+        read_shared_songs(block.name, kept_songs.extend)
+        # Songs kept by the function do not keep the block from closing
+        assert len(kept_songs) == 3
+        assert all(columnar_song.columns == {} for columnar_song in kept_songs)
+    finally:
+        block.close()
+        block.unlink()
+
+
+def test_read_shared_songs_closes_the_block_on_error():
+    block = share_songs(get_songs_data())
+
+    def fail(columnar_songs):
+        events = columnar_songs[0].columns["event_values"]
+        raise ValueError(f"{len(events)} events")
+
+    try:
+        # The frames of the error hold the arrays, which are released
+        with pytest.raises(ValueError):
+            read_shared_songs(block.name, fail)
+    finally:
+        block.close()
+        block.unlink()
+
+
+def test_get_columnar_density_distribution():
+    songs_data = get_songs_data()
+    columnar_songs = [
+        ColumnarSong.from_song_data(song_data) for song_data in songs_data
+    ]
+
+    assert get_columnar_density_distribution(columnar_songs, 1, 1) == (
+        get_density_distribution(songs_data, 1, 1)
+    )
+
+
+@pytest.mark.parametrize(
+    "bar_fill, permute, max_tokens, over_length, deduplicate",
+    [
+        (bar_fill, permute, max_tokens, over_length, deduplicate)
+        for bar_fill, permute, (max_tokens, over_length), deduplicate in (
+            itertools.product(
+                [False, True],
+                [False, True],
+                [(None, "skip"), (40, "skip"), (40, "drop_tracks"), (50, "shrink")],
+                [False, True],
+            )
+        )
+    ],
+)
+def test_encode_columnar_songs_matches_encode_songs_data(
+    bar_fill, permute, max_tokens, over_length, deduplicate
+):
+    songs_data = get_songs_data()
+    columnar_songs = [
+        ColumnarSong.from_song_data(song_data) for song_data in songs_data
+    ]
+    settings = {
+        "transpositions": [0, 2],
+        "permute": permute,
+        "window_size_bars": 1,
+        "hop_length_bars": 1,
+        "density_bins": np.array([5, 10]),
+        "bar_fill": bar_fill,
+        "seed": 42,
+        "max_tokens": max_tokens,
+        "over_length": over_length,
+    }
+    expected_windows = []
+    expected = encode_songs_data(
+        copy.deepcopy(songs_data),
+        window_deduplicator=WindowDeduplicator(100) if deduplicate else None,
+        sequence_windows=expected_windows,
+        **settings,
+    )
+    windows = []
+    token_sequences = encode_columnar_songs(
+        columnar_songs,
+        window_deduplicator=WindowDeduplicator(100) if deduplicate else None,
+        sequence_windows=windows,
+        **settings,
+    )
+
+    assert token_sequences == expected
+    assert windows == expected_windows
@@ -0,0 +1,49 @@
+from source.benchmark.syntheticcorpus import make_midi_bytes
+from source.preprocess.loading.corpusindex import CorpusIndex, build_index
+from source.preprocess.loading.serialization import Music21Serializer
+
+
+def write_midi(path, **kwargs):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(make_midi_bytes(**kwargs))
+    return path
+
+
+def test_build_index_and_select(tmp_path):
+    midi_paths = [
+        write_midi(tmp_path / "midi/ABBA/Four.mid", num_tracks=2, num_bars=6),
+        write_midi(tmp_path / "midi/ABBA/Three.mid", time_signature=(3, 4)),
+        write_midi(tmp_path / "midi/Eels/Big.mid", num_tracks=6, drums=False),
+    ]
+    (tmp_path / "midi/Eels/Broken.mid").write_bytes(b"not a midi file")
+    midi_paths.append(tmp_path / "midi/Eels/Broken.mid")
+    index = CorpusIndex(tmp_path / "index.sqlite")
+
+    counts = build_index(index, midi_paths, Music21Serializer(), parse=False)
+
+    assert counts == {"indexed": 4, "unchanged": 0}
+    entry = index.get("ABBA/Four.mid")
+    assert entry["artist"] == "ABBA"
+    assert entry["genre"] == "Pop"
+    assert entry["time_signatures"] == "4/4"
+    assert entry["bar_count"] == 6
+    assert entry["track_count"] == 2
+    assert entry["has_drums"] == 1
+    assert entry["parse_seconds"] is None
+    assert index.get("Eels/Broken.mid")["error"].startswith("invalid_midi")
+
+    assert index.select() == ["ABBA/Four.mid", "ABBA/Three.mid", "Eels/Big.mid"]
+    assert index.select(time_signature="4/4") == ["ABBA/Four.mid", "Eels/Big.mid"]
+    assert index.select(genres=["Alternative"]) == ["Eels/Big.mid"]
+    assert index.select(max_tracks=5) == ["ABBA/Four.mid", "ABBA/Three.mid"]
+    index.close()
+
+    # A later build only indexes what changed, and parses when asked to
+    index = CorpusIndex(tmp_path / "index.sqlite")
+    counts = build_index(index, midi_paths[:3], Music21Serializer(), parse=True)
+    assert counts == {"indexed": 3, "unchanged": 0}
+    assert index.get("ABBA/Four.mid")["parse_seconds"] > 0
+    write_midi(midi_paths[0], num_tracks=1)
+    counts = build_index(index, midi_paths[:3], Music21Serializer(), parse=True)
+    assert counts == {"indexed": 1, "unchanged": 2}
+    assert index.get("ABBA/Four.mid")["track_count"] == 1
@@ -0,0 +1,62 @@
+import asyncio
+
+from source.benchmark.syntheticcorpus import generate_corpus
+from source.datasetcreator import DatasetCreator
+from source.datasetcreatorconfig import LMDCleanDatasetCreatorBarConfig
+from source.preprocess.loading.asyncloader import AsyncLoaderIterator
+from source.preprocess.loading.loaderiterator import LoaderIterator
+from source.preprocess.loading.serialization import Music21Serializer
+
+
+def get_config(tmp_path, save_path):
+    return LMDCleanDatasetCreatorBarConfig(
+        midi_source=str(tmp_path / "midi"),
+        save_path=save_path,
+        deduplicate_windows=True,
+    )
+
+
+def read_token_sequences(dataset_path):
+    return {
+        path.name: path.read_text()
+        for path in sorted(dataset_path.glob("token_sequences_*.txt"))
+    }
+
+
+def test_create_async_matches_create(tmp_path):
+    paths = generate_corpus(tmp_path / "midi", num_files=6, num_artists=3)
+    m21_streams = list(LoaderIterator(Music21Serializer(), 6, paths))[0]
+    dataset_creator = DatasetCreator(get_config(tmp_path, tmp_path / "sync"))
+    dataset_creator.create(tmp_path / "sync", m21_streams, 1, overwrite=True)
+
+    # Scores sent to the worker, and batches preprocessed by the async loader
+    async_creator = DatasetCreator(get_config(tmp_path, tmp_path / "async"))
+    loader = LoaderIterator(
+        Music21Serializer(),
+        6,
+        paths,
+        preprocess=async_creator.get_loader_preprocess(),
+    )
+    preprocessed_creator = DatasetCreator(get_config(tmp_path, tmp_path / "loader"))
+
+    async def create():
+        await async_creator.create_async(
+            tmp_path / "async", m21_streams, 1, overwrite=True
+        )
+        async for batch in AsyncLoaderIterator(loader, num_workers=2):
+            await preprocessed_creator.create_async(
+                tmp_path / "loader", batch, 1, overwrite=True, preprocessed=True
+            )
+
+    asyncio.run(create())
+    async_creator.close(tmp_path / "async")
+    preprocessed_creator.close(tmp_path / "loader")
+
+    dataset_name = dataset_creator.config.dataset_name
+    expected = read_token_sequences(tmp_path / "sync" / dataset_name)
+    assert expected
+    for creator, folder in [(async_creator, "async"), (preprocessed_creator, "loader")]:
+        assert read_token_sequences(tmp_path / folder / dataset_name) == expected
+        assert creator.metrics.tokens == dataset_creator.metrics.tokens
+        assert creator.metrics.counts == dataset_creator.metrics.counts
+        assert creator.executor is None
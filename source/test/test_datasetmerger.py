@@ -0,0 +1,106 @@
+import csv
+import json
+from pathlib import Path
+
+from source.datasetmerger import merge_shards, reconcile_density_tokens
+from source.preprocess.loading.sharding import get_shard_name, select_shard
+
+
+def test_select_shard_partitions_paths():
+    root = Path("/data/lmd")
+    paths = [root / f"Artist {i}/Song {i}.mid" for i in range(50)]
+
+    shards = [select_shard(paths, root, 4, shard_index) for shard_index in range(4)]
+
+    # Every path lands in exactly one shard
+    assert sorted(sum(shards, [])) == sorted(paths)
+
+    # The partition does not depend on where the dataset is mounted
+    other_root = Path("/mnt/other")
+    other_paths = [other_root / path.relative_to(root) for path in paths]
+    assert [other_root / path.relative_to(root) for path in shards[1]] == select_shard(
+        other_paths, other_root, 4, 1
+    )
+
+
+def test_reconcile_density_tokens():
+    tokens = [
+        "PIECE_START",
+        "TRACK_START",
+        "INST=0",
+        "DENSITY=0",
+        "BAR_START",
+        "NOTE_ON=60",
+        "NOTE_OFF=60",
+        "NOTE_ON=62",
+        "NOTE_OFF=62",
+        "BAR_END",
+        "TRACK_END",
+        "TRACK_START",
+        "INST=DRUMS",
+        "DENSITY=3",
+        "BAR_START",
+        "BAR_END",
+        "TRACK_END",
+    ]
+
+    output = reconcile_density_tokens(tokens, [1.5, 3.0])
+
+    assert output[3] == "DENSITY=1"
+    assert output[13] == "DENSITY=0"
+    assert output[:3] == tokens[:3] and output[4:13] == tokens[4:13]
+
+
+def test_merge_shards(tmp_path):
+    # Two shards, each with one batch
+    for shard_index, note_counts in enumerate([[1, 2], [3, 4]]):
+        shard_path = tmp_path / get_shard_name(shard_index, 2)
+        shard_path.mkdir()
+        with open(shard_path / "density_bins_1.json", "w") as file:
+            json.dump(
+                {
+                    "bins_number": 2,
+                    "bins": [0.0],
+                    "histogram": {str(count): 1 for count in note_counts},
+                },
+                file,
+            )
+        with open(shard_path / "token_sequences_train_1.txt", "w") as file:
+            for count in note_counts:
+                notes = " ".join(["NOTE_ON=60"] * count)
+                print(f"TRACK_START DENSITY=9 {notes} TRACK_END", file=file)
+        with open(shard_path / "token_sequences_valid_1.txt", "w") as file:
+            print("TRACK_START DENSITY=9 TRACK_END", file=file)
+
+    summary = merge_shards(tmp_path)
+
+    assert summary == {"shards": 2, "train": 4, "valid": 2}
+    with open(tmp_path / "density_bins.json") as file:
+        assert json.load(file)["bins"] == [2.5]
+    with open(tmp_path / "token_sequences_train.txt") as file:
+        densities = [line.split()[1] for line in file]
+    assert densities == ["DENSITY=0", "DENSITY=0", "DENSITY=1", "DENSITY=1"]
+    with open(tmp_path / "index.csv") as file:
+        rows = list(csv.DictReader(file))
+    assert [(row["split"], row["first_line"], row["num_lines"]) for row in rows] == [
+        ("train", "0", "2"),
+        ("train", "2", "2"),
+        ("valid", "0", "1"),
+        ("valid", "1", "1"),
+    ]
+
+
+def test_merge_shards_packs(tmp_path):
+    for shard_index in range(2):
+        shard_path = tmp_path / get_shard_name(shard_index, 2)
+        shard_path.mkdir()
+        for split in ["train", "valid"]:
+            with open(shard_path / f"token_sequences_{split}_1.txt", "w") as file:
+                print("PIECE_START TRACK_START TRACK_END", file=file)
+
+    summary = merge_shards(tmp_path, reconcile_density=False, pack_context_length=8)
+
+    assert summary["train_blocks"] == 1
+    with open(tmp_path / "token_blocks_train.txt") as file:
+        sequence = ["PIECE_START", "TRACK_START", "TRACK_END", "PIECE_END"]
+        assert file.read().split() == sequence * 2
@@ -0,0 +1,120 @@
+from source.metrics import PipelineMetrics
+from source.preprocess.dedup import (
+    DUPLICATE_FILE,
+    DUPLICATE_NOTES,
+    DUPLICATE_WINDOWS,
+    BloomFilter,
+    Deduplicator,
+    WindowDeduplicator,
+    get_note_fingerprint,
+)
+from source.preprocess.encode import encode_songs_data
+
+
+def make_song_data(title, pitch):
+    return {
+        "title": title,
+        "song_id": f"Artist/{title}.mid",
+        "time_signature_numerator": 4,
+        "time_signature_denominator": 4,
+        "tracks": [
+            {
+                "name": "Piano",
+                "number": 0,
+                "midi_program": 0,
+                "bars": [{"events": [pitch]}],
+            },
+            {
+                "name": "Bass",
+                "number": 1,
+                "midi_program": 33,
+                "bars": [{"events": [40]}],
+            },
+        ],
+    }
+
+
+def test_note_fingerprint_ignores_names_and_track_order():
+    song_data = make_song_data("Song", 60)
+    renamed = make_song_data("Song.1", 60)
+    renamed["tracks"] = renamed["tracks"][::-1]
+    renamed["tracks"][0]["name"] = "Electric Bass"
+
+    assert get_note_fingerprint(song_data) == get_note_fingerprint(renamed)
+    assert get_note_fingerprint(song_data) != get_note_fingerprint(
+        make_song_data("Other", 62)
+    )
+
+
+def test_deduplicator(tmp_path):
+    metrics = PipelineMetrics()
+    deduplicator = Deduplicator(tmp_path / "duplicates.json")
+
+    assert deduplicator.check_file("Artist/Song.mid", "hash") is None
+    assert deduplicator.check_file("Artist/Song.mid", "hash") is None
+    assert deduplicator.check_file("Artist/Copy.mid", "hash") == "Artist/Song.mid"
+
+    songs_data = [
+        make_song_data("Song", 60),
+        make_song_data("Song.1", 60),
+        make_song_data("Other", 62),
+    ]
+    unique_songs_data = deduplicator.filter_songs_data(songs_data, metrics)
+    assert [song_data["title"] for song_data in unique_songs_data] == ["Song", "Other"]
+    assert metrics.skipped == {DUPLICATE_NOTES: 1}
+
+    metrics.add_tokens("Artist/Song.mid", 100)
+    assert deduplicator.summary(metrics) == {
+        "files_saved": {DUPLICATE_FILE: 1, DUPLICATE_NOTES: 1},
+        "tokens_saved": 200,
+    }
+    deduplicator.save(metrics)
+
+    # A resumed run keeps what was seen and the tokens of the originals
+    deduplicator = Deduplicator(tmp_path / "duplicates.json")
+    assert deduplicator.check_file("Artist/Third.mid", "hash") == "Artist/Song.mid"
+    assert deduplicator.summary()["tokens_saved"] == 300
+
+
+def test_bloom_filter():
+    bloom_filter = BloomFilter(capacity=1000, error_rate=0.01)
+    fingerprints = [bytes([index % 256, index // 256]) * 8 for index in range(1000)]
+
+    assert all(bloom_filter.add(fingerprint) for fingerprint in fingerprints[:500])
+    assert not any(bloom_filter.add(fingerprint) for fingerprint in fingerprints[:500])
+    assert len(bloom_filter.bits) < 2000
+
+
+def test_window_deduplicator_drops_repeated_windows():
+    metrics = PipelineMetrics()
+    window_deduplicator = WindowDeduplicator(1000, metrics=metrics)
+    songs_data = []
+    for title in ["Song", "Song.1"]:
+        song_data = make_song_data(title, 60)
+        song_data["genre"] = "pop"
+        for track in song_data["tracks"]:
+            track["bars"] = [
+                {"events": [{"type": "NOTE_ON", "pitch": 40}]},
+                {"events": [{"type": "NOTE_ON", "pitch": 40}]},
+                {"events": [{"type": "NOTE_ON", "pitch": 41}]},
+            ]
+        songs_data.append(song_data)
+    # Same notes with the tracks in another order
+    songs_data[1]["tracks"] = songs_data[1]["tracks"][::-1]
+
+    token_sequences = encode_songs_data(
+        songs_data,
+        transpositions=[0, 1],
+        permute=False,
+        window_size_bars=1,
+        hop_length_bars=1,
+        density_bins=[1],
+        bar_fill=False,
+        metrics=metrics,
+        window_deduplicator=window_deduplicator,
+    )
+
+    # The first song keeps its two different bars in both transpositions
+    assert len(token_sequences) == 4
+    assert metrics.counts[DUPLICATE_WINDOWS] == 4
+    assert metrics.files["Artist/Song.1.mid"]["tokens"] == 0
@@ -1,3 +1,5 @@
+import copy
+
 import numpy as np
 import pytest
 
@@ -9,7 +11,14 @@ from source.preprocess.encode import (
     encode_bar_data,
     encode_track_data,
     encode_song_data,
+    encode_songs_data,
+    get_window_token_count,
+    get_bar_token_count,
+    DROPPED_TRACKS,
+    SHRUNK_WINDOWS,
+    SKIPPED_WINDOWS,
 )
+from source.metrics import PipelineMetrics
 from source.test.expected_output import json_output
 
 
@@ -110,8 +119,8 @@ def test_encode_event_data():
     assert encode_event_data(event_data_3, -2) == expected_result_3
 
     # Test 5: with "TIME_DELTA" type event
-    event_data_4 = {"type": "TIME_DELTA", "delta": 4.0}
-    expected_result_4 = "TIME_DELTA=4.0"
+    event_data_4 = {"type": "TIME_DELTA", "delta": 4}
+    expected_result_4 = "TIME_DELTA=4"
     assert encode_event_data(event_data_4, 0) == expected_result_4
 
     # Test 6: with unrecognized event type
@@ -148,32 +157,32 @@ def test_encode_bar_data():
     bar_data_5 = {
         "events": [
             {"pitch": 60, "type": "NOTE_ON"},
-            {"delta": 4.0, "type": "TIME_DELTA"},
+            {"delta": 4, "type": "TIME_DELTA"},
             {"pitch": 60, "type": "NOTE_OFF"},
             {"pitch": 60, "type": "NOTE_ON"},
-            {"delta": 4.0, "type": "TIME_DELTA"},
+            {"delta": 4, "type": "TIME_DELTA"},
             {"pitch": 60, "type": "NOTE_OFF"},
             {"pitch": 60, "type": "NOTE_ON"},
-            {"delta": 4.0, "type": "TIME_DELTA"},
+            {"delta": 4, "type": "TIME_DELTA"},
             {"pitch": 60, "type": "NOTE_OFF"},
             {"pitch": 60, "type": "NOTE_ON"},
-            {"delta": 4.0, "type": "TIME_DELTA"},
+            {"delta": 4, "type": "TIME_DELTA"},
             {"pitch": 60, "type": "NOTE_OFF"},
         ]
     }
     expected_result_5 = [
         "BAR_START",
         "NOTE_ON=60",
-        "TIME_DELTA=4.0",
+        "TIME_DELTA=4",
         "NOTE_OFF=60",
         "NOTE_ON=60",
-        "TIME_DELTA=4.0",
+        "TIME_DELTA=4",
         "NOTE_OFF=60",
         "NOTE_ON=60",
-        "TIME_DELTA=4.0",
+        "TIME_DELTA=4",
         "NOTE_OFF=60",
         "NOTE_ON=60",
-        "TIME_DELTA=4.0",
+        "TIME_DELTA=4",
         "NOTE_OFF=60",
         "BAR_END",
     ]
@@ -200,30 +209,30 @@ def test_encode_track_data():
         "DENSITY=1",
         "BAR_START",
         "NOTE_ON=60",
-        "TIME_DELTA=4.0",
+        "TIME_DELTA=4",
         "NOTE_OFF=60",
         "NOTE_ON=60",
-        "TIME_DELTA=4.0",
+        "TIME_DELTA=4",
         "NOTE_OFF=60",
         "NOTE_ON=60",
-        "TIME_DELTA=4.0",
+        "TIME_DELTA=4",
         "NOTE_OFF=60",
         "NOTE_ON=60",
-        "TIME_DELTA=4.0",
+        "TIME_DELTA=4",
         "NOTE_OFF=60",
         "BAR_END",
         "BAR_START",
         "NOTE_ON=62",
-        "TIME_DELTA=4.0",
+        "TIME_DELTA=4",
         "NOTE_OFF=62",
         "NOTE_ON=62",
-        "TIME_DELTA=4.0",
+        "TIME_DELTA=4",
         "NOTE_OFF=62",
         "NOTE_ON=62",
-        "TIME_DELTA=4.0",
+        "TIME_DELTA=4",
         "NOTE_OFF=62",
         "NOTE_ON=62",
-        "TIME_DELTA=4.0",
+        "TIME_DELTA=4",
         "NOTE_OFF=62",
         "BAR_END",
         "TRACK_END",
@@ -267,30 +276,30 @@ def test_encode_song_data():
             "DENSITY=1",
             "BAR_START",
             "NOTE_ON=60",
-            "TIME_DELTA=4.0",
+            "TIME_DELTA=4",
             "NOTE_OFF=60",
             "NOTE_ON=60",
-            "TIME_DELTA=4.0",
+            "TIME_DELTA=4",
             "NOTE_OFF=60",
             "NOTE_ON=60",
-            "TIME_DELTA=4.0",
+            "TIME_DELTA=4",
             "NOTE_OFF=60",
             "NOTE_ON=60",
-            "TIME_DELTA=4.0",
+            "TIME_DELTA=4",
             "NOTE_OFF=60",
             "BAR_END",
             "BAR_START",
             "NOTE_ON=62",
-            "TIME_DELTA=4.0",
+            "TIME_DELTA=4",
             "NOTE_OFF=62",
             "NOTE_ON=62",
-            "TIME_DELTA=4.0",
+            "TIME_DELTA=4",
             "NOTE_OFF=62",
             "NOTE_ON=62",
-            "TIME_DELTA=4.0",
+            "TIME_DELTA=4",
             "NOTE_OFF=62",
             "NOTE_ON=62",
-            "TIME_DELTA=4.0",
+            "TIME_DELTA=4",
             "NOTE_OFF=62",
             "BAR_END",
             "TRACK_END",
@@ -299,36 +308,36 @@ def test_encode_song_data():
             "DENSITY=2",
             "BAR_START",
             "NOTE_ON=64",
-            "TIME_DELTA=4.0",
+            "TIME_DELTA=4",
             "NOTE_OFF=64",
             "NOTE_ON=64",
-            "TIME_DELTA=4.0",
+            "TIME_DELTA=4",
             "NOTE_OFF=64",
             "NOTE_ON=64",
-            "TIME_DELTA=4.0",
+            "TIME_DELTA=4",
             "NOTE_OFF=64",
             "NOTE_ON=62",
             "NOTE_ON=66",
             "NOTE_ON=69",
-            "TIME_DELTA=4.0",
+            "TIME_DELTA=4",
             "NOTE_OFF=62",
             "NOTE_OFF=66",
             "NOTE_OFF=69",
             "BAR_END",
             "BAR_START",
             "NOTE_ON=65",
-            "TIME_DELTA=4.0",
+            "TIME_DELTA=4",
             "NOTE_OFF=65",
             "NOTE_ON=65",
-            "TIME_DELTA=4.0",
+            "TIME_DELTA=4",
             "NOTE_OFF=65",
             "NOTE_ON=65",
-            "TIME_DELTA=4.0",
+            "TIME_DELTA=4",
             "NOTE_OFF=65",
             "NOTE_ON=62",
             "NOTE_ON=66",
             "NOTE_ON=69",
-            "TIME_DELTA=4.0",
+            "TIME_DELTA=4",
             "NOTE_OFF=62",
             "NOTE_OFF=66",
             "NOTE_OFF=69",
@@ -344,16 +353,16 @@ def test_encode_song_data():
             "DENSITY=0",
             "BAR_START",
             "NOTE_ON=62",
-            "TIME_DELTA=4.0",
+            "TIME_DELTA=4",
             "NOTE_OFF=62",
             "NOTE_ON=62",
-            "TIME_DELTA=4.0",
+            "TIME_DELTA=4",
             "NOTE_OFF=62",
             "NOTE_ON=62",
-            "TIME_DELTA=4.0",
+            "TIME_DELTA=4",
             "NOTE_OFF=62",
             "NOTE_ON=62",
-            "TIME_DELTA=4.0",
+            "TIME_DELTA=4",
             "NOTE_OFF=62",
             "BAR_END",
             "TRACK_END",
@@ -362,18 +371,18 @@ def test_encode_song_data():
             "DENSITY=1",
             "BAR_START",
             "NOTE_ON=65",
-            "TIME_DELTA=4.0",
+            "TIME_DELTA=4",
             "NOTE_OFF=65",
             "NOTE_ON=65",
-            "TIME_DELTA=4.0",
+            "TIME_DELTA=4",
             "NOTE_OFF=65",
             "NOTE_ON=65",
-            "TIME_DELTA=4.0",
+            "TIME_DELTA=4",
             "NOTE_OFF=65",
             "NOTE_ON=62",
             "NOTE_ON=66",
             "NOTE_ON=69",
-            "TIME_DELTA=4.0",
+            "TIME_DELTA=4",
             "NOTE_OFF=62",
             "NOTE_OFF=66",
             "NOTE_OFF=69",
@@ -386,3 +395,98 @@ def test_encode_song_data():
     assert (
         output_token_sequences == expected_token_sequences
     ), f"Expected {expected_token_sequences} but got {output_token_sequences}"
+
+
+def test_encode_song_data_seeded_is_reproducible():
+    # Encode the same song twice, with permutation and bar fill
+    def encode(song_data, seed):
+        return encode_song_data(
+            copy.deepcopy(song_data),
+            transpositions=[0, 2],
+            permute=True,
+            window_size_bars=1,
+            hop_length_bars=1,
+            density_bins=np.array([5, 10]),
+            bar_fill=True,
+            seed=seed,
+        )
+
+    assert encode(json_output, 42) == encode(json_output, 42)
+
+
+def test_encode_songs_data_seeded_does_not_depend_on_order():
+    song_a = copy.deepcopy(json_output)
+    song_a["song_id"] = "Artist/Song A.mid"
+    song_b = copy.deepcopy(json_output)
+    song_b["song_id"] = "Artist/Song B.mid"
+
+    def encode(songs_data):
+        return encode_songs_data(
+            copy.deepcopy(songs_data),
+            transpositions=[0],
+            permute=True,
+            window_size_bars=1,
+            hop_length_bars=1,
+            density_bins=np.array([5, 10]),
+            bar_fill=True,
+            seed=42,
+        )
+
+    # Two windows per song. Changing the order must only reorder the output
+    forward = encode([song_a, song_b])
+    backward = encode([song_b, song_a])
+    assert forward == backward[2:] + backward[:2]
+
+
+@pytest.mark.parametrize("bar_fill", [False, True])
+def test_get_window_token_count_matches_encoding(bar_fill):
+    song_data = copy.deepcopy(json_output)
+    track_bar_token_counts = [
+        [get_bar_token_count(bar_data) for bar_data in track_data["bars"]]
+        for track_data in song_data["tracks"]
+    ]
+    token_count = get_window_token_count(track_bar_token_counts, 0, 2, [0, 1], bar_fill)
+
+    token_sequences = encode_song_data(
+        song_data,
+        transpositions=[0],
+        permute=False,
+        window_size_bars=2,
+        hop_length_bars=1,
+        density_bins=np.array([5, 10]),
+        bar_fill=bar_fill,
+        seed=42,
+    )
+    assert len(token_sequences[0]) == token_count
+
+
+@pytest.mark.parametrize(
+    "max_tokens, over_length, count_name, expected_lengths",
+    [
+        (74, "skip", SKIPPED_WINDOWS, []),
+        (40, "drop_tracks", DROPPED_TRACKS, [35]),
+        (50, "shrink", SHRUNK_WINDOWS, [43]),
+    ],
+)
+def test_encode_song_data_max_tokens(
+    max_tokens, over_length, count_name, expected_lengths
+):
+    # The window of two bars and two tracks has 75 tokens
+    metrics = PipelineMetrics()
+    token_sequences = encode_song_data(
+        copy.deepcopy(json_output),
+        transpositions=[0],
+        permute=False,
+        window_size_bars=2,
+        hop_length_bars=1,
+        density_bins=np.array([5, 10]),
+        bar_fill=False,
+        max_tokens=max_tokens,
+        over_length=over_length,
+        metrics=metrics,
+    )
+
+    assert [len(token_sequence) for token_sequence in token_sequences] == (
+        expected_lengths
+    )
+    assert metrics.counts[count_name] == 1
@@ -0,0 +1,49 @@
+import time
+
+import pytest
+
+from source.preprocess.loading.isolation import IsolatedTaskError, run_isolated
+
+
+def add(a, b):
+    return a + b
+
+
+def sleep_forever():
+    time.sleep(60)
+
+
+def allocate(num_bytes):
+    return len(bytearray(num_bytes))
+
+
+def fail():
+    raise ValueError("Broken file")
+
+
+def test_run_isolated_returns_result():
+    assert run_isolated(add, (1, 2), timeout=10) == 3
+
+
+def test_run_isolated_timeout():
+    start = time.perf_counter()
+    with pytest.raises(IsolatedTaskError) as error:
+        run_isolated(sleep_forever, timeout=0.5)
+    assert error.value.reason == "timeout"
+    assert time.perf_counter() - start < 10
+
+
+def test_run_isolated_memory_cap():
+    with pytest.raises(IsolatedTaskError) as error:
+        run_isolated(allocate, (512 * 1024 * 1024,), max_memory=64 * 1024 * 1024)
+    assert error.value.reason == "memory"
+
+    # Small allocations fit in the cap
+    assert run_isolated(allocate, (1024,), max_memory=64 * 1024 * 1024) == 1024
+
+
+def test_run_isolated_error():
+    with pytest.raises(IsolatedTaskError) as error:
+        run_isolated(fail)
+    assert error.value.reason == "error"
+    assert "Broken file" in str(error.value)
@@ -1,11 +1,34 @@
+import os
+import shutil
+import asyncio
 from pathlib import Path
 
 import pytest
 
+from source.benchmark.syntheticcorpus import generate_corpus
+from source.preprocess.loading.asyncloader import AsyncLoaderIterator
 from source.preprocess.loading.loaderiterator import LoaderIterator
 from source.preprocess.loading.serialization import Music21Serializer
 
 
+class CrashingSerializer(Music21Serializer):
+    """Kills the process that loads a file named crash.mid."""
+
+    def load(self, load_path):
+        if load_path.name == "crash.mid":
+            os._exit(1)
+        return super().load(load_path)
+
+    def load_bytes(self, data, load_path):
+        if load_path.name == "crash.mid":
+            os._exit(1)
+        return super().load_bytes(data, load_path)
+
+
+def get_title(stream):
+    return stream.metadata.title
+
+
 @pytest.fixture
 def loader_iterator():
     test_folder_path = Path.home() / "mmm_tokenizer_lmd_clean/source/test/test_files"
@@ -126,3 +149,137 @@ def test_write_current_iteration(tmp_path, loader_iterator):
     with open(iteration_file, "r") as f:
         written_iteration = int(f.read().strip())
     assert written_iteration == 10
+
+
+def test_loop_through_loaded_data_with_workers(loader_iterator):
+    expected_data = [
+        [stream.metadata.title for stream in data] for data in loader_iterator
+    ]
+    loader_iterator.set_current_iteration(0)
+    loader_iterator.num_workers = 2
+
+    loaded_data = [
+        [stream.metadata.title for stream in data] for data in loader_iterator
+    ]
+
+    assert loaded_data == expected_data
+    assert loader_iterator._executor is None
+
+
+def test_loop_with_workers_loads_files_ahead(tmp_path):
+    paths = generate_corpus(tmp_path / "midi", num_files=8)
+    loader_iterator = LoaderIterator(Music21Serializer(), 1, paths, num_workers=2)
+
+    first_batch = next(iter(loader_iterator))
+
+    # Workers are not limited to the next batch, but results held are bounded
+    assert [stream.metadata.title for stream in first_batch] == [paths[0].stem]
+    assert loader_iterator._next_submit_index >= 4
+    assert len(loader_iterator._tasks) <= 1 + 2 * 2
+    titles = [[stream.metadata.title for stream in data] for data in loader_iterator]
+    assert sum(titles, []) == [path.stem for path in paths[1:]]
+    assert loader_iterator._tasks == {}
+
+
+@pytest.mark.parametrize("num_workers", [1, 2])
+def test_loop_with_preprocess(tmp_path, num_workers):
+    paths = generate_corpus(tmp_path / "midi", num_files=5)
+    loader_iterator = LoaderIterator(
+        Music21Serializer(), 2, paths, num_workers=num_workers, preprocess=get_title
+    )
+
+    titles = list(loader_iterator)
+
+    assert titles == [
+        [paths[0].stem, paths[1].stem],
+        [paths[2].stem, paths[3].stem],
+        [paths[4].stem],
+    ]
+
+
+def test_loop_with_batch_memory_budget(tmp_path):
+    paths = generate_corpus(tmp_path / "midi", num_files=5)
+    budget = 1024 * 1024
+    loader_iterator = LoaderIterator(
+        Music21Serializer(), 10, paths, max_batch_memory=budget
+    )
+    # Room for two of the synthetic files, whatever this process uses
+    largest_file = max(path.stat().st_size for path in paths)
+    loader_iterator.batch_budget.expansion_factor = budget / (2.5 * largest_file)
+    loader_iterator.batch_budget.get_available_memory = lambda: budget
+    loader_iterator.batch_budget.finish_batch = lambda: None
+
+    batch_sizes = [len(data) for data in loader_iterator]
+
+    assert batch_sizes == [2, 2, 1]
+
+    # Resuming needs the first file of the iteration
+    iteration_file = tmp_path / "iteration.txt"
+    loader_iterator.set_current_iteration(1, 2)
+    loader_iterator.write_current_iteration(iteration_file)
+    assert iteration_file.read_text() == "1 2"
+    assert [len(data) for data in loader_iterator] == [2, 1]
+
+
+def test_loop_with_prefetch(tmp_path):
+    paths = generate_corpus(tmp_path / "midi", num_files=5)
+    paths.insert(2, tmp_path / "midi/missing.mid")
+    loader_iterator = LoaderIterator(Music21Serializer(), 2, paths, prefetch_files=3)
+
+    titles = [[stream.metadata.title for stream in data] for data in loader_iterator]
+
+    assert [len(batch) for batch in titles] == [2, 1, 2]
+    assert sum(titles, []) == [path.stem for path in paths if path.exists()]
+    assert loader_iterator.metrics.skipped == {"missing": 1}
+    assert loader_iterator._prefetcher is None
+
+
+def test_async_loader_iterator(tmp_path):
+    paths = generate_corpus(tmp_path / "midi", num_files=5)
+    async_loader = AsyncLoaderIterator(LoaderIterator(Music21Serializer(), 2, paths))
+
+    async def load_titles():
+        titles = []
+        async for data in async_loader:
+            titles.append([stream.metadata.title for stream in data])
+        return titles
+
+    titles = asyncio.run(load_titles())
+
+    assert [len(batch) for batch in titles] == [2, 2, 1]
+    assert sum(titles, []) == [path.stem for path in paths]
+    assert async_loader.current_iteration == 3
+    assert async_loader.executor is None
+
+
+def test_async_loader_iterator_when_a_worker_dies(tmp_path):
+    paths = generate_corpus(tmp_path / "midi", num_files=4)
+    crash_path = tmp_path / "midi/crash.mid"
+    shutil.copy(paths[0], crash_path)
+    paths.insert(1, crash_path)
+    loader = LoaderIterator(CrashingSerializer(), 2, paths, preprocess=get_title)
+    async_loader = AsyncLoaderIterator(loader, num_workers=2)
+
+    async def load_titles():
+        return [data async for data in async_loader]
+
+    titles = asyncio.run(load_titles())
+
+    # Workers send back titles. Only the file that killed its worker is skipped
+    assert sum(titles, []) == [path.stem for path in paths if path != crash_path]
+    assert loader.metrics.skipped == {"crashed": 1}
+
+
+def test_loop_with_workers_when_a_worker_dies(tmp_path):
+    paths = generate_corpus(tmp_path / "midi", num_files=5)
+    crash_path = tmp_path / "midi/crash.mid"
+    shutil.copy(paths[0], crash_path)
+    paths.insert(1, crash_path)
+    loader_iterator = LoaderIterator(CrashingSerializer(), 2, paths, num_workers=2)
+
+    titles = [[stream.metadata.title for stream in data] for data in loader_iterator]
+
+    # Only the file that killed its worker is skipped, the others load
+    assert sum(titles, []) == [path.stem for path in paths if path != crash_path]
+    assert loader_iterator.metrics.skipped == {"crashed": 1}
+    assert loader_iterator._executor is None
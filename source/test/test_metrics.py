@@ -0,0 +1,56 @@
+import json
+import pstats
+
+from source.metrics import PipelineMetrics
+
+
+def test_pipeline_metrics_summary(tmp_path):
+    metrics = PipelineMetrics()
+    with metrics.stage("load"):
+        metrics.record_file("Artist/Song.mid", "load", 0.5)
+    metrics.record_file("Artist/Other.mid", "load", 0.25)
+    metrics.record_skip("Artist/Other.mid", "multiple_meters")
+    metrics.add_tokens("Artist/Song.mid", 100)
+
+    metrics.dump(tmp_path / "metrics.json", files_path=tmp_path / "files.jsonl")
+    with open(tmp_path / "metrics.json") as file:
+        summary = json.load(file)
+
+    assert summary["files"] == 2
+    assert summary["tokens"] == 100
+    assert summary["stages"]["load"]["calls"] == 1
+    assert summary["skipped"] == {"multiple_meters": 1}
+    assert "per_file" not in summary
+    assert summary["peak_rss_bytes"] > 0
+
+    # Only files recorded since the last dump are appended
+    metrics.add_tokens("Artist/Song.mid", 50)
+    metrics.dump(tmp_path / "metrics.json", files_path=tmp_path / "files.jsonl")
+    with open(tmp_path / "files.jsonl") as file:
+        records = [json.loads(line) for line in file]
+    assert records == [
+        {"song_id": "Artist/Other.mid", "load": 0.25, "skipped": "multiple_meters"},
+        {"song_id": "Artist/Song.mid", "load": 0.5, "tokens": 100},
+        {"song_id": "Artist/Song.mid", "load": 0.5, "tokens": 150},
+    ]
+
+
+def test_pipeline_metrics_profiles_selected_file(tmp_path):
+    metrics = PipelineMetrics(profile_file_index=1)
+    for file_index, song_id in enumerate(["Artist/A.mid", "Artist/B.mid"]):
+        metrics.select_profile(file_index, song_id)
+    assert metrics.profile_song_id == "Artist/B.mid"
+
+    def profiled_function():
+        return sum(range(1000))
+
+    with metrics.profile("Artist/A.mid"):
+        sum(range(10))
+    with metrics.profile("Artist/B.mid"):
+        profiled_function()
+
+    metrics.dump(tmp_path / "metrics.json", tmp_path / "profile.prof")
+    stats = pstats.Stats(str(tmp_path / "profile.prof"))
+    assert any(
+        function_name == "profiled_function" for _, _, function_name in stats.stats
+    )
@@ -0,0 +1,79 @@
+import pytest
+
+from source.benchmark.syntheticcorpus import (
+    make_midi_bytes,
+    make_track_chunk,
+    TICKS_PER_QUARTER,
+)
+from source.preprocess.loading.midiprescan import (
+    scan_midi,
+    get_prescan_reject_reason,
+    get_window_end_tick,
+)
+from source.preprocess.music21lmd import preprocess_music21_song
+from source.preprocess.loading.serialization import Music21Serializer
+
+
+def make_multiple_meters_midi(change_bar):
+    # 4/4 from the start and 3/4 from change_bar on, with one note per quarter
+    bar_ticks = TICKS_PER_QUARTER * 4
+    conductor = [
+        (0, bytes([0xFF, 0x58, 0x04, 4, 2, 24, 8])),
+        (change_bar * bar_ticks, bytes([0xFF, 0x58, 0x04, 3, 2, 24, 8])),
+    ]
+    notes = [(0, bytes([0xC0, 0]))]
+    for _ in range(4 * (change_bar + 4)):
+        notes += [(0, bytes([0x90, 60, 80])), (TICKS_PER_QUARTER, bytes([0x80, 60, 0]))]
+    chunks = make_track_chunk(conductor) + make_track_chunk(notes)
+    header = b"MThd" + (6).to_bytes(4, "big") + bytes([0, 1, 0, 2])
+    return header + TICKS_PER_QUARTER.to_bytes(2, "big") + chunks
+
+
+def test_scan_midi():
+    header = scan_midi(make_midi_bytes(num_tracks=3, num_bars=4, notes_per_bar=4))
+
+    assert header["num_tracks"] == 4
+    assert header["ticks_per_quarter"] == TICKS_PER_QUARTER
+    assert header["time_signatures"] == [(0, 4, 4)]
+    assert header["note_on_count"] == 3 * 4 * 4
+    assert header["programs"] == {0, 24}
+    assert header["has_drums"] is True
+    assert header["length_ticks"] == 4 * 4 * TICKS_PER_QUARTER
+    assert get_prescan_reject_reason(header) is None
+
+
+def test_scan_midi_invalid():
+    with pytest.raises(ValueError):
+        scan_midi(b"RIFF not a midi file")
+
+
+def test_get_window_end_tick():
+    time_signatures = [(0, 4, 4), (2 * 1920, 3, 4)]
+    assert get_window_end_tick(time_signatures, 480, 2) == 2 * 1920
+    assert get_window_end_tick(time_signatures, 480, 4) == 2 * 1920 + 2 * 1440
+
+
+def test_prescan_rejects_empty_files():
+    header = scan_midi(make_midi_bytes(num_tracks=2, notes_per_bar=4)[:22])
+    assert get_prescan_reject_reason(header) == "empty"
+
+
+def test_prescan_agrees_with_preprocessing(tmp_path):
+    def preprocess(midi_bytes):
+        midi_path = tmp_path / "Artist/Song.mid"
+        midi_path.parent.mkdir(exist_ok=True)
+        midi_path.write_bytes(midi_bytes)
+        return preprocess_music21_song(Music21Serializer().load(midi_path), True)
+
+    # Meter change inside the first eight bars: both reject
+    midi_bytes = make_multiple_meters_midi(change_bar=2)
+    assert get_prescan_reject_reason(scan_midi(midi_bytes)) == "multiple_meters"
+    assert preprocess(midi_bytes) is None
+
+    # Meter change after the first eight bars: only the whole file has two meters
+    midi_bytes = make_multiple_meters_midi(change_bar=10)
+    assert get_prescan_reject_reason(scan_midi(midi_bytes)) is None
+    assert preprocess(midi_bytes) is not None
+    assert get_prescan_reject_reason(scan_midi(midi_bytes), bars=None) == (
+        "multiple_meters"
+    )
@@ -1,14 +1,21 @@
+from fractions import Fraction
+
 import pytest
 import music21
 from music21 import meter, note, chord, instrument
 from music21.stream import Score, Part, Measure
 from source.preprocess.music21lmd import (
+    preprocess_music21,
     preprocess_music21_song,
     preprocess_music21_part,
     preprocess_music21_measure,
+    preprocess_loaded_song,
+    split_preprocessed_songs,
 )
+from source.metrics import PipelineMetrics
 from source.test.expected_output import json_output
-from source.preprocess.preprocessutilities import events_to_events_data
+from source.preprocess.preprocessutilities import events_to_events_data, get_tick
+from source.preprocess.split import get_split_key, is_validation_song
 
 
 # Helper function to create a simple song with 1 measure and 1 note
@@ -116,13 +123,97 @@ def test_events_to_events_data():
     # Define the expected output
     expected_output = [
         {"type": "NOTE_ON", "pitch": 67},
-        {"type": "TIME_DELTA", "delta": 4.0},
+        {"type": "TIME_DELTA", "delta": 4},
         {"type": "NOTE_OFF", "pitch": 67},
-        {"type": "TIME_DELTA", "delta": 4.0},
+        {"type": "TIME_DELTA", "delta": 4},
         {"type": "NOTE_ON", "pitch": 68},
-        {"type": "TIME_DELTA", "delta": 4.0},
+        {"type": "TIME_DELTA", "delta": 4},
         {"type": "NOTE_OFF", "pitch": 68},
     ]
 
     # Check if the output matches the expected result
     assert output == expected_output
+
+
+def test_preprocess_music21_measure_uses_integer_ticks():
+    # Three triplet eighth notes, whose offsets are Fractions in music21
+    measure = Measure(number=1)
+    for _ in range(3):
+        measure.append(note.Note("C4", quarterLength=Fraction(1, 3)))
+
+    output = preprocess_music21_measure(measure, True, False, ticks_per_quarter=12)
+
+    deltas = [event["delta"] for event in output["events"] if "delta" in event]
+    assert deltas == [4, 4, 4]
+    assert all(type(delta) is int for delta in deltas)
+    assert get_tick(Fraction(1, 3)) == 1
+
+
+def test_get_tick_rounds_halves_up():
+    # Eight 32nd notes fall on the sixteenth grid two by two
+    ticks = [get_tick(index * Fraction(1, 8)) for index in range(8)]
+    assert ticks == [0, 1, 1, 2, 2, 3, 3, 4]
+    assert get_tick(0.625) == 3
+
+
+def test_preprocess_music21_measure_keeps_short_notes():
+    # A 32nd note after a 32nd rest starts and ends on the same tick
+    measure = Measure(number=1)
+    measure.append(note.Rest(quarterLength=0.125))
+    measure.append(note.Note("C4", quarterLength=0.125))
+
+    output = preprocess_music21_measure(measure, True, False)
+
+    assert output["events"] == [
+        {"type": "TIME_DELTA", "delta": 1},
+        {"type": "NOTE_ON", "pitch": 60},
+        {"type": "TIME_DELTA", "delta": 1},
+        {"type": "NOTE_OFF", "pitch": 60},
+    ]
+
+
+def test_get_split_key():
+    song_id = "ABBA/Chiquitita.1.mid"
+    assert get_split_key(song_id, "path") == "ABBA/Chiquitita.1.mid"
+    assert get_split_key(song_id, "song") == "ABBA/Chiquitita"
+    assert get_split_key(song_id, "artist") == "ABBA"
+    with pytest.raises(ValueError):
+        get_split_key(song_id, "unknown")
+
+
+def test_preprocess_music21_split_does_not_depend_on_batch():
+    song_ids = [f"Artist {i}/Song {i}.mid" for i in range(10)]
+    songs = []
+    for song_id in song_ids:
+        song = create_simple_song()
+        song.metadata.setCustom("song_id", song_id)
+        songs.append(song)
+
+    songs_data_train, songs_data_valid = preprocess_music21(songs, valid_ratio=0.5)
+
+    # The same songs, one at a time, end up on the same side
+    expected_valid = [
+        song_id for song_id in song_ids if is_validation_song(song_id, 0.5, "artist")
+    ]
+    assert [song_data["song_id"] for song_data in songs_data_valid] == expected_valid
+    assert len(songs_data_train) + len(songs_data_valid) == len(song_ids)
+    assert 0 < len(expected_valid) < len(song_ids)
+
+
+def test_split_preprocessed_songs_matches_preprocess_music21():
+    songs = []
+    for i in range(10):
+        song = create_simple_song()
+        song.metadata.setCustom("song_id", f"Artist {i}/Song {i}.mid")
+        songs.append(song)
+    songs[3].parts[1].insert(0, meter.TimeSignature("3/4"))
+    expected = preprocess_music21(songs, valid_ratio=0.5)
+
+    # As the loader does it, one song at a time
+    metrics = PipelineMetrics()
+    preprocessed_songs = [
+        preprocess_loaded_song(song, valid_ratio=0.5) for song in songs
+    ]
+
+    assert split_preprocessed_songs(preprocessed_songs, metrics) == expected
+    assert metrics.skipped == {"multiple_meters": 1}
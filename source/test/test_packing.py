@@ -0,0 +1,50 @@
+import numpy as np
+
+from source.preprocess.packing import (
+    get_offsets_path,
+    pack_token_files,
+    pack_token_sequences,
+    read_token_block,
+    save_token_blocks,
+)
+
+
+def test_pack_token_sequences():
+    token_sequences = [["A", "B", "C"], ["D"], ["E", "F"]]
+
+    token_blocks = list(pack_token_sequences(token_sequences, 4, "SEP"))
+
+    assert token_blocks == [
+        ["A", "B", "C", "SEP"],
+        ["D", "SEP", "E", "F"],
+        ["SEP"],
+    ]
+
+
+def test_save_token_blocks(tmp_path):
+    path = tmp_path / "token_blocks_train_1.txt"
+    token_blocks = pack_token_sequences([["PIECE_START", "GENRE=pop"]] * 5, 2)
+
+    assert save_token_blocks(token_blocks, path) == 8
+
+    offsets = np.load(get_offsets_path(path))
+    assert get_offsets_path(path).name == "token_blocks_train_1.offsets.npy"
+    assert offsets[-1] == path.stat().st_size
+    assert read_token_block(path, offsets, 1) == ["PIECE_END", "PIECE_START"]
+    assert read_token_block(path, offsets, 7) == ["PIECE_END"]
+
+
+def test_pack_token_files(tmp_path):
+    sequences_paths = []
+    for iteration, lines in enumerate([["A B C", "D"], ["E F"]]):
+        sequences_path = tmp_path / f"token_sequences_train_{iteration}.txt"
+        sequences_path.write_text("".join(line + "\n" for line in lines))
+        sequences_paths.append(sequences_path)
+    blocks_path = tmp_path / "token_blocks_train.txt"
+
+    assert pack_token_files(sequences_paths, blocks_path, 4, "SEP") == 3
+
+    # The end of the first file continues in the same block as the second
+    offsets = np.load(get_offsets_path(blocks_path))
+    assert read_token_block(blocks_path, offsets, 1) == ["D", "SEP", "E", "F"]
+    assert read_token_block(blocks_path, offsets, 2) == ["SEP"]
@@ -0,0 +1,103 @@
+import copy
+
+import numpy as np
+import pytest
+
+from source.preprocess.encode import encode_songs_data
+from source.preprocess.parquetexport import (
+    ParquetExporter,
+    ParquetTableWriter,
+    get_song_row,
+)
+from source.preprocess.sharedstate import get_vocabulary
+from source.preprocess.vocabulary import get_token_ids
+from source.test.expected_output import json_output
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+
+def test_get_song_row():
+    song_data = copy.deepcopy(json_output)
+    song_data["song_id"] = "Artist/Song.mid"
+
+    row = get_song_row(song_data, "train")
+
+    assert row["song_id"] == "Artist/Song.mid"
+    assert row["split"] == "train"
+    assert row["time_signature"] == (
+        f"{json_output['time_signature_numerator']}_"
+        f"{json_output['time_signature_denominator']}"
+    )
+    assert row["num_tracks"] == len(json_output["tracks"])
+    assert [track["instrument"] for track in row["tracks"]] == [
+        str(track_data["midi_program"]) for track_data in json_output["tracks"]
+    ]
+
+
+def test_parquet_exporter(tmp_path):
+    songs_data = []
+    for name in ["A", "B", "C"]:
+        song_data = copy.deepcopy(json_output)
+        song_data["song_id"] = f"Artist/Song {name}.mid"
+        songs_data.append(song_data)
+    sequence_windows = []
+    token_sequences = encode_songs_data(
+        copy.deepcopy(songs_data),
+        transpositions=[0, 1],
+        permute=False,
+        window_size_bars=1,
+        hop_length_bars=1,
+        density_bins=np.array([5, 10]),
+        bar_fill=False,
+        sequence_windows=sequence_windows,
+    )
+    assert len(sequence_windows) == len(token_sequences)
+    assert sequence_windows[:2] == [
+        ("Artist/Song A.mid", 0, 1, 0),
+        ("Artist/Song A.mid", 0, 1, 1),
+    ]
+
+    vocabulary = get_vocabulary()
+    with ParquetExporter(tmp_path, vocabulary, row_group_size=4) as exporter:
+        exporter.write_songs(songs_data, "train")
+        exporter.write_sequences(token_sequences, sequence_windows, "train")
+
+    songs = pq.read_table(tmp_path / "parquet/songs")
+    assert songs.column("song_id").to_pylist() == [
+        song_data["song_id"] for song_data in songs_data
+    ]
+    assert pq.read_table(tmp_path / "parquet/songs/valid-00000.parquet").num_rows == 0
+    sequences_file = pq.ParquetFile(tmp_path / "parquet/sequences/train-00000.parquet")
+    # Rows are written in groups of row_group_size
+    assert sequences_file.metadata.num_row_groups == -(-len(token_sequences) // 4)
+    sequences = sequences_file.read()
+    assert sequences.column("transposition").to_pylist()[:2] == [0, 1]
+    token_ids = sequences.column("token_ids").to_pylist()
+    assert token_ids[0] == get_token_ids(token_sequences[0], vocabulary)
+
+
+@pytest.mark.parametrize("rows_after_checkpoint", [1, 3])
+def test_parquet_table_writer_resumes(tmp_path, rows_after_checkpoint):
+    schema = pa.schema([("value", pa.int32())])
+    writer = ParquetTableWriter(tmp_path, "train", schema, 2, max_file_rows=5)
+    writer.write_rows([{"value": value} for value in range(3)])
+    writer.write_rows([{"value": value} for value in range(3, 7)])
+    checkpoint_rows = writer.rows
+    # Rows written after the checkpoint, in the spool or, once the file is
+    # full, in the Parquet file, are lost with the run
+    writer.write_rows([{"value": -1}] * rows_after_checkpoint)
+
+    writer = ParquetTableWriter(
+        tmp_path, "train", schema, 2, max_file_rows=5, rows=checkpoint_rows
+    )
+    writer.write_rows([{"value": value} for value in range(7, 12)])
+    writer.close()
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "train-00000.parquet",
+        "train-00001.parquet",
+        "train-00002.parquet",
+    ]
+    assert pq.read_table(tmp_path).column("value").to_pylist() == list(range(12))
+    assert pq.ParquetFile(tmp_path / "train-00000.parquet").metadata.num_row_groups == 3
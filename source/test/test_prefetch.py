@@ -0,0 +1,19 @@
+from source.preprocess.loading.prefetch import FilePrefetcher
+
+
+def test_file_prefetcher(tmp_path):
+    load_paths = []
+    for index in range(5):
+        load_path = tmp_path / f"{index}.mid"
+        load_path.write_bytes(bytes([index]))
+        load_paths.append(load_path)
+    load_paths.append(tmp_path / "missing.mid")
+    prefetcher = FilePrefetcher(load_paths, num_files=2)
+
+    assert prefetcher.get(0) == bytes([0])
+    assert sorted(prefetcher._futures) == [1, 2]
+    # Skipping files drops what was read for them
+    assert prefetcher.get(3) == bytes([3])
+    assert sorted(prefetcher._futures) == [4, 5]
+    assert prefetcher.get(5) is None
+    prefetcher.close()
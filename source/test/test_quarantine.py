@@ -0,0 +1,115 @@
+import zipfile
+
+from source.hashing import get_content_hash
+from source.preprocess.loading.archive import ArchiveReader
+from source.preprocess.loading.quarantine import Quarantine, recheck_quarantine
+
+
+def write_file(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return get_content_hash(data)
+
+
+def test_quarantine_persists_rejected_files(tmp_path):
+    midi_path = tmp_path / "Artist/Song.mid"
+    content_hash = write_file(midi_path, b"MThd broken")
+    quarantine_path = tmp_path / "quarantine.json"
+
+    quarantine = Quarantine(quarantine_path, version="1")
+    assert quarantine.check("Artist/Song.mid", midi_path, content_hash) is None
+    quarantine.add("Artist/Song.mid", "multiple_meters")
+    # Files that were not checked in this run and transient reasons are ignored
+    quarantine.add("Artist/Other.mid", "multiple_meters")
+    quarantine.add("Artist/Song.mid", "missing")
+    quarantine.save()
+
+    # A later run skips the file
+    quarantine = Quarantine(quarantine_path, version="1")
+    assert quarantine.check("Artist/Song.mid", midi_path, content_hash) == (
+        "multiple_meters"
+    )
+    assert quarantine.summary() == {"multiple_meters": 1}
+
+    # But not if the file changed or the preprocessor changed
+    assert quarantine.check("Artist/Song.mid", midi_path, "other hash") is None
+    quarantine = Quarantine(quarantine_path, version="2")
+    assert quarantine.check("Artist/Song.mid", midi_path, content_hash) is None
+    assert quarantine.get_stale_song_ids() == ["Artist/Song.mid"]
+
+
+def test_recheck_quarantine(tmp_path):
+    quarantine = Quarantine(tmp_path / "quarantine.json", version="1")
+    for name, data in [("Good", b"good"), ("Bad", b"bad"), ("Changed", b"old")]:
+        midi_path = tmp_path / f"Artist/{name}.mid"
+        content_hash = write_file(midi_path, data)
+        quarantine.check(f"Artist/{name}.mid", midi_path, content_hash)
+        quarantine.add(f"Artist/{name}.mid", "timeout")
+    quarantine.save()
+    write_file(tmp_path / "Artist/Changed.mid", b"new")
+
+    quarantine = Quarantine(tmp_path / "quarantine.json", version="2")
+
+    def check_file(load_path, data):
+        return "multiple_meters" if load_path.stem == "Bad" else None
+
+    counts = recheck_quarantine(quarantine, check_file, quarantine.get_stale_song_ids())
+
+    assert counts == {"released": 1, "rejected": 1, "changed": 1, "kept": 0}
+    quarantine = Quarantine(tmp_path / "quarantine.json", version="2")
+    assert list(quarantine.entries) == ["Artist/Bad.mid"]
+    assert quarantine.entries["Artist/Bad.mid"]["version"] == "2"
+
+
+def test_recheck_quarantine_of_archive_members(tmp_path):
+    zip_path = tmp_path / "midi.zip"
+    with zipfile.ZipFile(zip_path, "w") as zip_file:
+        zip_file.writestr("Artist/Good.mid", b"good")
+        zip_file.writestr("Artist/Bad.mid", b"bad")
+    quarantine = Quarantine(tmp_path / "quarantine.json", version="1")
+    for name, data in [("Good", b"good"), ("Bad", b"bad")]:
+        quarantine.check(
+            f"Artist/{name}.mid",
+            zip_path / f"Artist/{name}.mid",
+            get_content_hash(data),
+        )
+        quarantine.add(f"Artist/{name}.mid", "timeout")
+    quarantine.save()
+
+    def check_file(load_path, data):
+        return "multiple_meters" if data == b"bad" else None
+
+    # Without the archive, its members can not be read, so they are kept
+    quarantine = Quarantine(tmp_path / "quarantine.json", version="2")
+    counts = recheck_quarantine(quarantine, check_file, quarantine.get_stale_song_ids())
+    assert counts == {"released": 0, "rejected": 0, "changed": 0, "kept": 2}
+    assert len(quarantine.entries) == 2
+
+    archive_reader = ArchiveReader(zip_path)
+    counts = recheck_quarantine(
+        quarantine, check_file, quarantine.get_stale_song_ids(), archive_reader
+    )
+    archive_reader.close()
+    assert counts == {"released": 1, "rejected": 1, "changed": 0, "kept": 0}
+    assert list(quarantine.entries) == ["Artist/Bad.mid"]
+
+
+def test_quarantine_keeps_the_broken_limit(tmp_path):
+    midi_path = tmp_path / "Artist/Slow.mid"
+    content_hash = write_file(midi_path, b"slow")
+    quarantine_path = tmp_path / "quarantine.json"
+
+    quarantine = Quarantine(quarantine_path, version="1", file_timeout=10)
+    quarantine.check("Artist/Slow.mid", midi_path, content_hash)
+    quarantine.add("Artist/Slow.mid", "timeout")
+    quarantine.save()
+    assert quarantine.entries["Artist/Slow.mid"]["limit"] == 10
+
+    # Skipped while the limit is not larger
+    for file_timeout in [5, 10]:
+        quarantine = Quarantine(quarantine_path, version="1", file_timeout=file_timeout)
+        assert quarantine.check("Artist/Slow.mid", midi_path, content_hash) == "timeout"
+    # Processed again with a larger limit or none
+    for file_timeout in [20, None]:
+        quarantine = Quarantine(quarantine_path, version="1", file_timeout=file_timeout)
+        assert quarantine.check("Artist/Slow.mid", midi_path, content_hash) is None
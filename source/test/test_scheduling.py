@@ -0,0 +1,43 @@
+from source.preprocess.loading.scheduling import get_file_costs, order_longest_first
+
+
+def write_file(path, size):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"x" * size)
+    return path
+
+
+def test_order_longest_first_by_size(tmp_path):
+    small = write_file(tmp_path / "Artist/Small.mid", 10)
+    big = write_file(tmp_path / "Artist/Big.mid", 1000)
+    medium = write_file(tmp_path / "Artist/Medium.mid", 100)
+    other_medium = write_file(tmp_path / "Artist/Another.mid", 100)
+
+    ordered = order_longest_first([small, big, medium, other_medium])
+
+    # Ties keep the path order
+    assert ordered == [big, other_medium, medium, small]
+
+
+def test_order_longest_first_by_parse_time(tmp_path):
+    slow = write_file(tmp_path / "Artist/Slow.mid", 10)
+    small = write_file(tmp_path / "Artist/Small.mid", 10)
+    big = write_file(tmp_path / "Artist/Big.mid", 1000)
+    unindexed = write_file(tmp_path / "Artist/New.mid", 500)
+    parse_seconds = {
+        "Artist/Slow.mid": 3.0,
+        "Artist/Small.mid": 0.02,
+        "Artist/Big.mid": 2.0,
+    }
+    load_paths = [slow, small, big, unindexed]
+
+    costs = get_file_costs(load_paths, parse_seconds)
+
+    # Files that are not in the index are scaled by the median seconds per byte
+    assert costs[unindexed] == 1.0
+    assert order_longest_first(load_paths, parse_seconds) == [
+        slow,
+        big,
+        unindexed,
+        small,
+    ]
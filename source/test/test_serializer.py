@@ -34,3 +34,20 @@ def test_music21_serializer_dump():
     m21_serializer.dump(m21_stream=s, save_path=save_path)
     assert save_path.is_file() == True
     os.remove(save_path)
+
+
+def test_music21_serializer_load_bytes():
+    test_folder_path = Path.home() / "mmm_tokenizer_lmd_clean/source/test/test_files"
+    load_path = test_folder_path / '"Weird Al" Yankovic/Amish Paradise.mid'
+    m21_serializer = Music21Serializer()
+
+    from_path = m21_serializer.load(load_path)
+    from_bytes = m21_serializer.load_bytes(load_path.read_bytes(), load_path)
+
+    assert from_bytes.metadata.title == "Amish Paradise"
+    assert from_bytes.metadata.getCustom("song_id") == from_path.metadata.getCustom(
+        "song_id"
+    )
+    assert [n.pitches for n in from_bytes.flatten().notes] == [
+        n.pitches for n in from_path.flatten().notes
+    ]
@@ -0,0 +1,48 @@
+import numpy as np
+
+from source.benchmark.syntheticcorpus import generate_corpus
+from source.preprocess.encode import encode_songs_data
+from source.preprocess.music21lmd import preprocess_music21_song
+from source.preprocess.loading.serialization import Music21Serializer
+from source.preprocess.sharedstate import (
+    GENRE_FILE,
+    get_genre_map,
+    get_percussion_mapper,
+    get_vocabulary,
+)
+from source.preprocess.vocabulary import UNKNOWN_TOKEN, get_token_ids
+
+
+def test_shared_state_is_built_once():
+    relative_genre_file = "source/preprocess/loading/lmd_genres.csv"
+
+    assert get_genre_map() is get_genre_map(relative_genre_file)
+    assert get_genre_map(GENRE_FILE)["Eels"] == "Alternative"
+    assert get_percussion_mapper() is get_percussion_mapper()
+    assert get_vocabulary() is get_vocabulary(5, 4, relative_genre_file)
+    assert Music21Serializer().genre_map is Music21Serializer().genre_map
+
+
+def test_vocabulary_covers_encoded_songs(tmp_path):
+    midi_paths = generate_corpus(tmp_path, num_files=2, num_tracks=3)
+    serializer = Music21Serializer()
+    songs_data = [
+        preprocess_music21_song(serializer.load(midi_path), train=True)
+        for midi_path in midi_paths
+    ]
+    token_sequences = encode_songs_data(
+        songs_data,
+        transpositions=[0],
+        permute=False,
+        window_size_bars=2,
+        hop_length_bars=2,
+        density_bins=np.array([5, 10, 15, 20]),
+        bar_fill=True,
+        seed=0,
+    )
+
+    vocabulary = get_vocabulary()
+    unknown_id = vocabulary[UNKNOWN_TOKEN]
+    for token_sequence in token_sequences:
+        assert unknown_id not in get_token_ids(token_sequence, vocabulary)
+    assert get_token_ids(["NOTE_ON=200"], vocabulary) == [unknown_id]
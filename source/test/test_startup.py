@@ -0,0 +1,70 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+REPOSITORY_PATH = Path(__file__).parents[2]
+HEAVY_MODULES = ["music21", "pandas", "numpy"]
+# Seconds importing a command line script may take. It is well below a
+# second without the heavy modules, and several seconds with them
+IMPORT_BUDGET_SECONDS = 1.0
+
+
+def import_in_subprocess(module_name):
+    code = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        f"import {module_name}\n"
+        "seconds = time.perf_counter() - start\n"
+        f"heavy = [name for name in {HEAVY_MODULES} if name in sys.modules]\n"
+        "print(json.dumps({'seconds': seconds, 'heavy': heavy}))\n"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=REPOSITORY_PATH,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+@pytest.mark.parametrize(
+    "module_name",
+    [
+        "create_dataset_mmm",
+        "build_index_mmm",
+        "merge_dataset_mmm",
+        "recheck_quarantine_mmm",
+        "serve_mmm",
+    ],
+)
+def test_command_line_imports_are_light(module_name):
+    result = import_in_subprocess(module_name)
+
+    assert result["heavy"] == []
+    assert result["seconds"] < IMPORT_BUDGET_SECONDS
+
+
+def test_help_does_not_import_music21():
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, runpy\n"
+            "sys.argv = ['create_dataset_mmm.py', '--help']\n"
+            "try:\n"
+            "    runpy.run_path('create_dataset_mmm.py', run_name='__main__')\n"
+            "except SystemExit:\n"
+            "    pass\n"
+            "print('music21' in sys.modules)\n",
+        ],
+        cwd=REPOSITORY_PATH,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+
+    assert output.splitlines()[-1] == "False"
@@ -0,0 +1,112 @@
+import os
+import threading
+
+import pytest
+
+from source import tokenizationserver
+from source.benchmark.loadtest import post_tokenize, run_load_test
+from source.benchmark.syntheticcorpus import generate_corpus
+from source.tokenizationserver import (
+    TokenizationError,
+    TokenizationService,
+    create_server,
+)
+from source.tokenizer import TokenizationSettings, tokenize_midi
+
+SETTINGS = TokenizationSettings(window_size_bars=2, hop_length_bars=2)
+tokenize_batch = tokenizationserver._tokenize_batch
+
+
+@pytest.fixture
+def midi_data(tmp_path):
+    midi_path = generate_corpus(tmp_path, num_files=1, num_tracks=2, num_bars=4)[0]
+    return midi_path.read_bytes()
+
+
+def test_tokenization_service(midi_data):
+    service = TokenizationService(num_workers=1, max_batch_wait=0.05)
+    try:
+        futures = [service.submit(midi_data, settings=SETTINGS) for _ in range(3)]
+        token_sequences = [future.result() for future in futures]
+        assert token_sequences[0] == tokenize_midi(midi_data, settings=SETTINGS)
+        assert token_sequences[1] == token_sequences[0]
+        # The same file sent at once is tokenized once
+        assert service.stats["batches"] == 1
+
+        assert service.tokenize(midi_data, settings=SETTINGS) == token_sequences[0]
+        assert service.stats["cache_hits"] == 1
+
+        with pytest.raises(TokenizationError):
+            service.tokenize(b"not a midi file")
+        assert service.stats["errors"] == 1
+    finally:
+        service.close()
+
+
+def test_tokenization_service_spreads_batches(midi_data, tmp_path, monkeypatch):
+    task_sizes = []
+    submit_to_executor = TokenizationService._submit_to_executor
+
+    def record_task(service, requests):
+        task_sizes.append(len(requests))
+        return submit_to_executor(service, requests)
+
+    monkeypatch.setattr(TokenizationService, "_submit_to_executor", record_task)
+    midi_paths = generate_corpus(tmp_path / "midi", num_files=5, num_bars=4)
+    service = TokenizationService(num_workers=2, max_batch_wait=0.5)
+    try:
+        futures = [
+            service.submit(midi_path.read_bytes(), settings=SETTINGS)
+            for midi_path in midi_paths
+        ]
+        for future, midi_path in zip(futures, midi_paths):
+            assert future.result(timeout=60) == tokenize_midi(
+                midi_path.read_bytes(), settings=SETTINGS
+            )
+        assert service.stats["batches"] == 1
+        assert task_sizes == [3, 2]
+    finally:
+        service.close()
+
+
+def crashing_tokenize_batch(requests, density_bins):
+    """Kills the worker that gets a file with the bytes b"crash"."""
+    if any(data == b"crash" for data, _, _, _ in requests):
+        os._exit(1)
+    return tokenize_batch(requests, density_bins)
+
+
+def test_tokenization_service_when_a_worker_dies(midi_data, monkeypatch):
+    monkeypatch.setattr(tokenizationserver, "_tokenize_batch", crashing_tokenize_batch)
+    service = TokenizationService(num_workers=1, max_batch_wait=0)
+    try:
+        with pytest.raises(TokenizationError, match="BrokenProcessPool"):
+            service.submit(b"crash").result(timeout=60)
+
+        # New workers take the next requests
+        future = service.submit(midi_data, settings=SETTINGS)
+        assert future.result(timeout=60) == tokenize_midi(midi_data, settings=SETTINGS)
+        assert service._batcher.is_alive()
+    finally:
+        service.close()
+
+
+def test_tokenization_server(midi_data):
+    service = TokenizationService(num_workers=0)
+    server = create_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    try:
+        answer = post_tokenize(url, midi_data, SETTINGS.dict())
+        assert answer["tokens"] == tokenize_midi(midi_data, settings=SETTINGS)
+        assert "error" in post_tokenize(url, b"not a midi file")
+
+        results = run_load_test(url, [midi_data], num_requests=4, concurrency=2)
+        assert results["requests"] == 4
+        assert results["errors"] == 0
+        assert results["p50_seconds"] <= results["p99_seconds"]
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.close()
@@ -0,0 +1,60 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+
+from source.benchmark.syntheticcorpus import generate_corpus
+from source.preprocess.sharedstate import get_vocabulary
+from source.tokenizer import AsyncTokenizer, TokenizationSettings, tokenize_midi
+
+
+def test_tokenize_midi(tmp_path):
+    midi_path = generate_corpus(tmp_path, num_files=1, num_tracks=2, num_bars=4)[0]
+    settings = TokenizationSettings(window_size_bars=2, hop_length_bars=2)
+
+    token_sequences = tokenize_midi(
+        midi_path.read_bytes(), "Pop/Rock", settings, density_bins=[1, 2, 3, 4]
+    )
+
+    assert len(token_sequences) == 2
+    assert token_sequences[0][:3] == [
+        "PIECE_START",
+        "TIME_SIGNATURE=4_4",
+        "GENRE=POP/ROCK",
+    ]
+    assert token_sequences[0].count("TRACK_START") == 2
+    assert "DENSITY=4" in token_sequences[0]
+
+    token_ids = tokenize_midi(
+        midi_path.read_bytes(),
+        "Pop/Rock",
+        settings,
+        density_bins=[1, 2, 3, 4],
+        return_ids=True,
+    )
+    vocabulary = get_vocabulary()
+    assert token_ids[0] == [vocabulary[token] for token in token_sequences[0]]
+
+
+def test_async_tokenizer(tmp_path):
+    midi_paths = generate_corpus(tmp_path, num_files=3, num_tracks=2, num_bars=4)
+    settings = TokenizationSettings(window_size_bars=2, hop_length_bars=2)
+    tokenizer = AsyncTokenizer(max_pending=2)
+
+    async def tokenize_all():
+        return await asyncio.gather(
+            *[
+                tokenizer.tokenize_file(midi_path, settings=settings)
+                for midi_path in midi_paths
+            ]
+        )
+
+    try:
+        results = asyncio.run(tokenize_all())
+    finally:
+        tokenizer.close()
+
+    # music21 runs in forked workers, not on threads of the loop
+    assert isinstance(tokenizer.executor, ProcessPoolExecutor)
+    for midi_path, token_sequences in zip(midi_paths, results):
+        assert token_sequences == tokenize_midi(
+            midi_path.read_bytes(), settings=settings
+        )
@@ -0,0 +1,305 @@
+import json
+import math
+import queue
+import base64
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from source import logging
+from source.hashing import get_content_hash
+from source.preprocess.sharedstate import load_density_bins, warm_up
+from source.tokenizer import TokenizationSettings, tokenize_midi
+
+logger = logging.create_logger("tokenizationserver")
+
+# A request as sent to the workers: MIDI bytes, genre, settings and return_ids
+Request = Tuple[bytes, str, TokenizationSettings, bool]
+
+
+def _tokenize_batch(
+    requests: List[Request], density_bins: Optional[List[float]]
+) -> List[Tuple[bool, object]]:
+    # One result per request, so a bad file does not fail its whole batch
+    results = []
+    for data, genre, settings, return_ids in requests:
+        try:
+            tokens = tokenize_midi(
+                data,
+                genre,
+                settings,
+                density_bins=density_bins,
+                return_ids=return_ids,
+            )
+            results.append((True, tokens))
+        except Exception as e:
+            results.append((False, f"{type(e).__name__}: {e}"))
+    return results
+
+
+class TokenizationError(Exception):
+    """Raised when a file sent to the service can not be tokenized."""
+
+
+class TokenizationService:
+    """
+    Tokenizes MIDI files sent by concurrent clients on a pool of warm workers.
+
+    Requests that arrive within max_batch_wait seconds of each other are
+    batched, and the batch is split evenly across the workers. Each worker
+    gets its share in one task, which saves a round trip per file. Results are
+    cached by the hash of the file and the settings, so a file sent again is
+    answered without tokenizing it.
+    """
+
+    def __init__(
+        self,
+        num_workers: int = 2,
+        max_batch_size: int = 8,
+        max_batch_wait: float = 0.005,
+        cache_size: int = 1024,
+        density_bins_path: Optional[Path] = None,
+    ) -> None:
+        self.num_workers = num_workers
+        self.max_batch_size = max_batch_size
+        self.max_batch_wait = max_batch_wait
+        self.cache_size = cache_size
+        self.density_bins = None
+        if density_bins_path is not None:
+            self.density_bins = load_density_bins(density_bins_path)
+        self.stats = {"requests": 0, "cache_hits": 0, "batches": 0, "errors": 0}
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        # Requests being tokenized, so the same file sent twice is done once
+        self._pending = {}
+        self._queue = queue.Queue()
+
+        # Built before forking, so every worker starts warm
+        warm_up()
+        self._executor = None
+        if num_workers > 0:
+            self._create_executor()
+        self._batcher = threading.Thread(target=self._run_batches, daemon=True)
+        self._batcher.start()
+
+    def _create_executor(self) -> None:
+        self._executor = ProcessPoolExecutor(
+            self.num_workers, mp_context=multiprocessing.get_context("fork")
+        )
+
+    def tokenize(
+        self,
+        data: bytes,
+        genre: str = "other",
+        settings: Optional[TokenizationSettings] = None,
+        return_ids: bool = False,
+    ) -> List[List]:
+        """
+        Tokenizes a MIDI file. Blocks until the result is ready.
+
+        Args:
+            data: The bytes of the MIDI file.
+            genre: The genre of the song.
+            settings: The encoding settings. None uses the defaults.
+            return_ids: Whether to return token ids instead of tokens.
+
+        Raises:
+            TokenizationError: If the file can not be tokenized.
+
+        Returns:
+            The tokens, or token ids, of every window.
+        """
+        return self.submit(data, genre, settings, return_ids).result()
+
+    def submit(
+        self,
+        data: bytes,
+        genre: str = "other",
+        settings: Optional[TokenizationSettings] = None,
+        return_ids: bool = False,
+    ) -> Future:
+        """Like tokenize, but returns a future instead of waiting for the result."""
+        if settings is None:
+            settings = TokenizationSettings()
+        key = (get_content_hash(data), genre, settings.json(), return_ids)
+        future = Future()
+        with self._lock:
+            self.stats["requests"] += 1
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.stats["cache_hits"] += 1
+                future.set_result(self._cache[key])
+                return future
+            if key in self._pending:
+                self._pending[key].append(future)
+                return future
+            self._pending[key] = [future]
+        self._queue.put((key, (data, genre, settings, return_ids)))
+        return future
+
+    def _run_batches(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            # Wait a moment for concurrent requests to share the batch
+            while len(batch) < self.max_batch_size:
+                try:
+                    item = self._queue.get(timeout=self.max_batch_wait)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)
+                    break
+                batch.append(item)
+            try:
+                self._submit_batch(batch)
+            except Exception as e:
+                # The batcher has to keep running, or later requests never finish
+                logger.exception("Could not submit a batch")
+                self._fail_batch([key for key, _ in batch], e)
+
+    def _submit_batch(self, batch: List[Tuple[Tuple, Request]]) -> None:
+        keys = [key for key, _ in batch]
+        requests = [request for _, request in batch]
+        with self._lock:
+            self.stats["batches"] += 1
+        if self._executor is None:
+            try:
+                self._finish_batch(keys, _tokenize_batch(requests, self.density_bins))
+            except Exception as e:
+                self._fail_batch(keys, e)
+            return
+        # One task per worker, so a batch does not wait on a single worker
+        task_size = math.ceil(len(batch) / self.num_workers)
+        for start in range(0, len(batch), task_size):
+            self._submit_task(
+                keys[start : start + task_size], requests[start : start + task_size]
+            )
+
+    def _submit_task(self, keys: List[Tuple], requests: List[Request]) -> None:
+        try:
+            task_future = self._submit_to_executor(requests)
+        except Exception as e:
+            self._fail_batch(keys, e)
+            return
+
+        def finish(task_future: Future) -> None:
+            try:
+                results = task_future.result()
+            except Exception as e:
+                # A worker died, e.g. out of memory
+                self._fail_batch(keys, e)
+                return
+            self._finish_batch(keys, results)
+
+        task_future.add_done_callback(finish)
+
+    def _submit_to_executor(self, requests: List[Request]) -> Future:
+        try:
+            return self._executor.submit(_tokenize_batch, requests, self.density_bins)
+        except BrokenProcessPool:
+            # A worker died since the last batch, which failed the batches it
+            # had. Later batches go to new workers
+            logger.warning("A worker of the pool died. Restarting the pool")
+            self._executor.shutdown(wait=False)
+            self._create_executor()
+            return self._executor.submit(_tokenize_batch, requests, self.density_bins)
+
+    def _finish_batch(self, keys: List[Tuple], results: List[Tuple]) -> None:
+        for key, (ok, result) in zip(keys, results):
+            with self._lock:
+                futures = self._pending.pop(key, [])
+                if ok:
+                    self._cache[key] = result
+                    if len(self._cache) > self.cache_size:
+                        self._cache.popitem(last=False)
+                else:
+                    self.stats["errors"] += 1
+            for future in futures:
+                if ok:
+                    future.set_result(result)
+                else:
+                    future.set_exception(TokenizationError(result))
+
+    def _fail_batch(self, keys: List[Tuple], error: Exception) -> None:
+        self._finish_batch(
+            keys, [(False, f"{type(error).__name__}: {error}")] * len(keys)
+        )
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._batcher.join()
+        if self._executor is not None:
+            self._executor.shutdown()
+
+
+def create_server(
+    service: TokenizationService, host: str = "127.0.0.1", port: int = 8765
+) -> ThreadingHTTPServer:
+    """
+    Creates an HTTP server for the service. Call serve_forever to run it.
+
+    POST /tokenize takes a JSON object with the MIDI file in base64 under
+    "midi" and optionally "genre", "settings" and "return_ids". It answers
+    {"tokens": [...]} with one list per window, or {"error": "..."} with
+    status 400. GET /stats answers the counters of the service.
+
+    Args:
+        service: The service that tokenizes the files.
+        host: The address to listen on. Keep it local, requests are not authenticated.
+        port: The port to listen on. 0 picks a free port.
+
+    Returns:
+        The server.
+    """
+
+    class TokenizationHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status: int, body: Dict) -> None:
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self) -> None:
+            if self.path != "/stats":
+                self._send_json(404, {"error": "Not found"})
+                return
+            self._send_json(200, dict(service.stats))
+
+        def do_POST(self) -> None:
+            if self.path != "/tokenize":
+                self._send_json(404, {"error": "Not found"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length))
+                data = base64.b64decode(request["midi"])
+                settings = TokenizationSettings(**request.get("settings", {}))
+            except (ValueError, KeyError, TypeError) as e:
+                self._send_json(400, {"error": f"Bad request: {e}"})
+                return
+            try:
+                tokens = service.tokenize(
+                    data,
+                    request.get("genre", "other"),
+                    settings,
+                    bool(request.get("return_ids", False)),
+                )
+            except TokenizationError as e:
+                self._send_json(400, {"error": str(e)})
+                return
+            self._send_json(200, {"tokens": tokens})
+
+        def log_message(self, format: str, *args) -> None:
+            logger.debug(format % args)
+
+    return ThreadingHTTPServer((host, port), TokenizationHandler)
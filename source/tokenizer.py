@@ -0,0 +1,205 @@
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Union
+
+from pydantic import BaseModel, Field
+
+from source.preprocess.encode import encode_song_data, get_density_bins
+from source.preprocess.loading.serialization import Music21Serializer
+from source.preprocess.preprocessutilities import TICKS_PER_QUARTER
+from source.preprocess.sharedstate import get_vocabulary, load_density_bins, warm_up
+from source.preprocess.vocabulary import get_token_ids
+
+
+class TokenizationSettings(BaseModel):
+    """
+    The encoding settings of a single tokenization.
+
+    Attributes:
+        window_size_bars: An integer indicating the number of bars per window.
+        hop_length_bars: An integer indicating the number of bars between windows.
+        density_bins_number: An integer indicating the number of density bins.
+        transpositions: A list of integers indicating the transpositions to encode.
+        permute_tracks: A boolean indicating whether to permute tracks.
+        bar_fill: A boolean indicating whether to encode with bar fill, like mmmbar.
+        seed: An integer used to derive the random choices made for the song.
+        ticks_per_quarter: An integer indicating the resolution of the time grid.
+        max_tokens: Optional most tokens a window may have.
+        over_length: A string indicating what to do with longer windows.
+    """
+
+    window_size_bars: int = Field(8, description="Number of bars per window")
+    hop_length_bars: int = Field(8, description="Number of bars between windows")
+    density_bins_number: int = Field(5, description="Number of density bins")
+    transpositions: List[int] = Field([0], description="Transpositions to encode")
+    permute_tracks: bool = Field(False, description="Permute tracks randomly")
+    bar_fill: bool = Field(False, description="Encode with bar fill, like mmmbar")
+    seed: int = Field(0, description="Seed for track permutation and bar fill")
+    ticks_per_quarter: int = Field(
+        TICKS_PER_QUARTER, description="Ticks per quarter note of the time grid"
+    )
+    max_tokens: Optional[int] = Field(None, description="Most tokens per window")
+    over_length: str = Field("skip", description="What to do with longer windows")
+
+
+@functools.lru_cache(maxsize=None)
+def get_serializer() -> Music21Serializer:
+    """Gets the serializer shared by every tokenization of this process."""
+    warm_up()
+    return Music21Serializer()
+
+
+def tokenize_midi(
+    data: bytes,
+    genre: str = "other",
+    settings: Optional[TokenizationSettings] = None,
+    density_bins: Optional[List[float]] = None,
+    density_bins_path: Optional[Path] = None,
+    return_ids: bool = False,
+    name: str = "song",
+) -> Union[List[List[str]], List[List[int]]]:
+    """
+    Tokenizes one MIDI file in memory, without writing anything.
+
+    The song is prepared like the files of the dataset, so the tokens match
+    what a model trained on the dataset saw. Pass the density bins of that
+    dataset, so the DENSITY tokens mean the same. Without them the bins are
+    computed from the song itself.
+
+    Args:
+        data: The bytes of the MIDI file.
+        genre: The genre of the song, as in lmd_genres.csv.
+        settings: The encoding settings. None uses the defaults.
+        density_bins: Optional density bins.
+        density_bins_path: Optional JSON file with density bins, like the
+            density_bins.json written by merge_dataset_mmm.py.
+        return_ids: Whether to return token ids of the vocabulary instead of tokens.
+        name: The title of the song.
+
+    Raises:
+        ValueError: If the song can not be tokenized, e.g. it has several meters.
+
+    Returns:
+        The token sequence, or the token ids, of every window.
+    """
+    if settings is None:
+        settings = TokenizationSettings()
+    # Local imports so importing this module stays fast
+    from source.preprocess.music21lmd import preprocess_music21_song
+
+    # The path only names the song. Genres like Pop/Rock would split it
+    stream = get_serializer().load_bytes(data, Path("upload") / f"{name}.mid")
+    stream.metadata.setCustom("genre", genre)
+    song_data = preprocess_music21_song(
+        stream, train=False, ticks_per_quarter=settings.ticks_per_quarter
+    )
+    if song_data is None:
+        raise ValueError("Songs with several meters can not be tokenized.")
+
+    if density_bins is None and density_bins_path is not None:
+        density_bins = load_density_bins(density_bins_path)
+    if density_bins is None:
+        density_bins = get_density_bins(
+            [song_data],
+            settings.window_size_bars,
+            settings.hop_length_bars,
+            settings.density_bins_number,
+        )
+
+    token_sequences = encode_song_data(
+        song_data,
+        transpositions=settings.transpositions,
+        permute=settings.permute_tracks,
+        window_size_bars=settings.window_size_bars,
+        hop_length_bars=settings.hop_length_bars,
+        density_bins=density_bins,
+        bar_fill=settings.bar_fill,
+        seed=settings.seed,
+        max_tokens=settings.max_tokens,
+        over_length=settings.over_length,
+    )
+    if not return_ids:
+        return token_sequences
+    vocabulary = get_vocabulary(
+        settings.density_bins_number, settings.ticks_per_quarter
+    )
+    return [
+        get_token_ids(token_sequence, vocabulary) for token_sequence in token_sequences
+    ]
+
+
+class AsyncTokenizer:
+    """
+    Tokenizes MIDI files from an event loop without blocking it.
+
+    Files are read on threads and tokenized on the executor. Without an
+    executor, a pool of num_workers forked processes is created after
+    warm_up, so workers start ready and music21 does not hold the GIL of the
+    loop. Call close to stop it. A given executor is not closed here; call
+    warm_up before creating a ProcessPoolExecutor. At most max_pending files
+    are read or tokenized at once. Later calls wait their turn, which keeps
+    the memory of a burst of uploads bounded.
+    """
+
+    def __init__(
+        self,
+        executor: Optional[Executor] = None,
+        max_pending: int = 8,
+        num_workers: int = 2,
+    ) -> None:
+        self._owns_executor = executor is None
+        if executor is None:
+            # Built before forking, so every worker starts warm
+            warm_up()
+            executor = ProcessPoolExecutor(
+                num_workers, mp_context=multiprocessing.get_context("fork")
+            )
+        self.executor = executor
+        self._semaphore = asyncio.Semaphore(max_pending)
+
+    async def tokenize(
+        self,
+        data: bytes,
+        genre: str = "other",
+        settings: Optional[TokenizationSettings] = None,
+        density_bins: Optional[List[float]] = None,
+        return_ids: bool = False,
+    ) -> Union[List[List[str]], List[List[int]]]:
+        """Like tokenize_midi, but awaits the result instead of blocking."""
+        async with self._semaphore:
+            return await self._run(data, genre, settings, density_bins, return_ids)
+
+    async def tokenize_file(
+        self,
+        midi_path: Path,
+        genre: str = "other",
+        settings: Optional[TokenizationSettings] = None,
+        density_bins: Optional[List[float]] = None,
+        return_ids: bool = False,
+    ) -> Union[List[List[str]], List[List[int]]]:
+        """Reads a MIDI file on a thread and tokenizes it. See tokenize."""
+        async with self._semaphore:
+            data = await asyncio.to_thread(Path(midi_path).read_bytes)
+            return await self._run(data, genre, settings, density_bins, return_ids)
+
+    async def _run(self, data, genre, settings, density_bins, return_ids):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor,
+            functools.partial(
+                tokenize_midi,
+                data,
+                genre,
+                settings,
+                density_bins=density_bins,
+                return_ids=return_ids,
+            ),
+        )
+
+    def close(self) -> None:
+        """Stops the workers of the pool created here, if any."""
+        if self._owns_executor:
+            self.executor.shutdown()